@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Benchmark ANSI escape-sequence handling (``bmdf.ansi.AnsiStream``) on a synthetic, colored log, against the per-line
+regex substitution it replaced; fails (exit 1) if stripping isn't faster than that (unless ``--no-speed-check``, which the
+test suite passes, since timings there are noisy).
+
+The log mixes SGR colors and styles (16-color, 256-color and truecolor), cursor movement, and OSC hyperlinks and window
+titles. ``AnsiStream`` is fed the log in batches of lines (as ``bmd`` does); the regex is applied to each line. Each
+timing is the best of ``REPEAT`` runs.
+
+Usage:
+    python bench/ansi.py [-m MIB] [-r REPEAT] [--no-speed-check]
+"""
+import random
+import re
+import sys
+from time import perf_counter
+from typing import Callable
+
+from click import command, option
+
+from bmdf.ansi import AnsiStream
+
+# `bmdf.utils.strip_ansi`'s previous implementation
+LEGACY_RGX = r'\x1b\[[^m]*m|\x1b\[\d*[ABCDEFGJKST]'
+
+BATCH_SIZE = 1000
+
+
+def legacy_strip_ansi(text):
+    return re.sub(LEGACY_RGX, '', text)
+
+
+def mk_log(mib: float, seed: int = 0) -> list[str]:
+    """About ``mib`` MiB of colored log lines."""
+    rng = random.Random(seed)
+    levels = [ ('\x1b[32m', 'INFO'), ('\x1b[33m', 'WARN'), ('\x1b[1;31m', 'ERROR'), ('\x1b[38;5;244m', 'DEBUG') ]
+    lines = []
+    size = 0
+    while size < mib * 2**20:
+        idx = len(lines)
+        color, level = rng.choice(levels)
+        line = f'\x1b[2m{idx:08d}\x1b[22m {color}{level:<5}\x1b[0m message {idx}: value=\x1b[38;2;255;135;0m{rng.random():.6f}\x1b[39m'
+        kind = idx % 20
+        if kind == 0:
+            line += f' \x1b]8;;https://example.com/{idx}\x1b\\link\x1b]8;;\x1b\\'
+        elif kind == 1:
+            line = f'\x1b]0;step {idx}\x07\x1b[2K{line}'
+        lines.append(line)
+        size += len(line) + 1
+    return lines
+
+
+def best_time(fn: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def stream(lines: list[str], html: bool = False) -> str:
+    ansi = AnsiStream(html=html)
+    return ''.join(
+        ansi.feed('\n'.join(lines[idx:idx + BATCH_SIZE]) + '\n')
+        for idx in range(0, len(lines), BATCH_SIZE)
+    )
+
+
+@command()
+@option('-m', '--mib', type=float, default=8, help='Size of the synthetic log (MiB)')
+@option('-r', '--repeat', type=int, default=3, help='Runs per benchmark (best time is reported)')
+@option('--speed-check/--no-speed-check', default=True, help='Exit 1 if AnsiStream strips slower than the regex')
+def main(mib: float, repeat: int, speed_check: bool):
+    lines = mk_log(mib)
+    size = sum(len(line) + 1 for line in lines) / 2**20
+    # The legacy regex misses OSC sequences, so outputs are only compared on lines without them
+    plain = [ line for line in lines if '\x1b]' not in line ]
+    assert stream(plain) == ''.join(legacy_strip_ansi(line) + '\n' for line in plain)
+
+    results = {
+        'regex (per line)': best_time(lambda: [ legacy_strip_ansi(line) for line in lines ], repeat),
+        'AnsiStream': best_time(lambda: stream(lines), repeat),
+        'AnsiStream (html)': best_time(lambda: stream(lines, html=True), repeat),
+    }
+    print(f'{len(lines)} lines, {size:.1f}MiB')
+    print(f'{"benchmark":<18} {"time (ms)":>10} {"MiB/s":>8}')
+    for name, elapsed in results.items():
+        print(f'{name:<18} {elapsed * 1000:>10.1f} {size / elapsed:>8.1f}')
+    legacy, strip = results['regex (per line)'], results['AnsiStream']
+    print(f'AnsiStream strips {legacy / strip:.2f}x as fast as the regex')
+    if speed_check and strip >= legacy:
+        print('AnsiStream is slower than the regex', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
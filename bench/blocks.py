@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""Benchmark ``mdcmd.blocks.index_blocks`` (and ``split_doc``, which is built on it), and fuzz it for linear time.
+
+``split_doc`` is timed on a synthetic corpus (see ``corpus.py``) against its previous implementation, which parsed each
+block's old contents line by line (and whose output it must match). Then, for each of several document "shapes" (random
+mixes of static text and command blocks of every form, one huge block, and many unselected or near-miss marker lines),
+``index_blocks`` is timed on documents of 1x, 2x, 4x and 8x ``-l`` lines; if its time per line on the largest document
+is more than ``-t`` times that on the smallest, the run fails (exit 1), unless ``--no-speed-check`` is passed (as in the
+test suite, where timings are noisy; every shape is still parsed). Each timing is the best of ``REPEAT`` runs.
+
+Usage:
+    python bench/blocks.py [-b BLOCKS] [-l LINES] [-r REPEAT] [-s SEED] [-t TOLERANCE] [--no-speed-check]
+"""
+import random
+import re
+import shlex
+import sys
+from time import perf_counter
+from typing import Callable, Iterator
+
+from click import command, option
+
+from corpus import mk_corpus
+
+from mdcmd.blocks import CMD_MARKER_RGX, HTML_OPEN_RGX, LIST_CONTINUATION_RGX, index_blocks
+from mdcmd.parse import Block, split_doc
+
+
+def legacy_split_doc(text: str) -> Iterator[tuple]:
+    """``split_doc``'s previous implementation: each block's old contents were consumed line by line, by a
+    ``next(lines)`` loop. Yields static runs, and ``(line, old_lines, trailing_blank)`` tuples for blocks."""
+    n = len(text)
+    run_start = search_pos = 0
+    line_no, line_pos = 1, 0
+    while m := CMD_MARKER_RGX.search(text, search_pos):
+        line_end = text.find('\n', m.end())
+        if line_end < 0:
+            line_end = n
+        cmd = shlex.split(m['cmd'])
+        line_no += text.count('\n', line_pos, m.start())
+        line_pos = m.start()
+        yield text[run_start:line_end]
+        pos = line_end + 1
+        old_lines = []
+
+        def next_line() -> str:
+            nonlocal pos
+            if pos >= n:
+                raise StopIteration
+            end = text.find('\n', pos)
+            if end < 0:
+                end = n
+            line = text[pos:end]
+            pos = end + 1
+            old_lines.append(line)
+            return line
+
+        try:
+            line = next_line()
+            if html_match := HTML_OPEN_RGX.fullmatch(line):
+                close_lines = [ f'</{html_match["tag"]}>' ]
+            elif line.startswith('```'):
+                close_lines = [ '```', re.compile(r'```\w+'), '```' ] if cmd[0] == 'bmdff' else [ '```' ]
+            elif line.startswith('- '):
+                while line and (line.startswith('- ') or LIST_CONTINUATION_RGX.match(line)):
+                    try:
+                        line = next_line()
+                    except StopIteration:
+                        break
+                close_lines = None
+            elif not line:
+                close_lines = None
+            else:
+                raise ValueError(f'Unexpected block start line under cmd {cmd}: {line}')
+        except StopIteration:
+            close_lines = None
+        while close_lines:
+            close, *close_lines = close_lines
+            line = next_line()
+            while close.fullmatch(line) if isinstance(close, re.Pattern) else line != close:
+                line = next_line()
+        yield line_no, old_lines, close_lines is None
+        run_start = search_pos = pos
+
+    if run_start < n:
+        yield text[run_start:n - 1 if text.endswith('\n') else n]
+
+
+def normalize(items) -> list:
+    return [ (item.line, item.old_lines, item.trailing_blank) if isinstance(item, Block) else item for item in items ]
+
+
+def best_time(fn: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def random_doc(rng: random.Random, num_lines: int) -> str:
+    """Static text and command blocks of every form, with (heavy-tailed) random sizes."""
+    lines = []
+    while len(lines) < num_lines:
+        size = int(rng.paretovariate(1.2))
+        kind = rng.choice(('static', 'fence', 'bmdff', 'details', 'list', 'blank'))
+        if kind == 'static':
+            lines += [ rng.choice(('text', '## Heading', '', '- item', '```', '<!-- `cmd` --', '<!-- comment -->')) for _ in range(size) ]
+            lines.append('')
+        elif kind == 'fence':
+            lines += [ '<!-- `echo` -->', '```', *[ 'out' ] * size, '```' ]
+        elif kind == 'bmdff':
+            lines += [ '<!-- `bmdff echo` -->', '```bash', 'echo', '```', '```', *[ 'out' ] * size, '```' ]
+        elif kind == 'details':
+            lines += [ '<!-- `bmdf -C echo` -->', '<details><summary>echo</summary>', '', '```', *[ 'out' ] * size, '```', '</details>' ]
+        elif kind == 'list':
+            lines += [ '<!-- `toc` -->', *[ '- item', '  - sub-item' ] * size, '' ]
+        else:
+            lines += [ '<!-- `true` -->', '' ]
+    return '\n'.join(lines) + '\n'
+
+
+SHAPES: dict[str, Callable[[random.Random, int], str]] = {
+    'random': random_doc,
+    'one fence': lambda rng, n: '<!-- `cat` -->\n```\n' + 'out\n' * n + '```\n',
+    'one list': lambda rng, n: '<!-- `toc` -->\n' + '- item\n  - sub-item\n' * (n // 2) + '\n',
+    'unselected markers': lambda rng, n: '<!-- `skipped` -->\n```\n' * n,
+    'near-miss markers': lambda rng, n: '<!-- `cmd` --\n<!-- `` -->\n' * (n // 2),
+}
+
+
+@command()
+@option('-b', '--blocks', type=int, default=1000, help='Number of command blocks in the corpus')
+@option('-l', '--lines', type=int, default=20_000, help='Lines in the corpus, and in the smallest document of each fuzzed shape')
+@option('-r', '--repeat', type=int, default=3, help='Runs per benchmark (best time is reported)')
+@option('-s', '--seed', type=int, default=0, help='Random seed')
+@option('-t', '--tolerance', type=float, default=2.5, help='Fail if time per line grows by more than this factor (from 1x to 8x lines)')
+@option('--speed-check/--no-speed-check', default=True, help='Exit 1 if index_blocks\' time per line grows by more than -t/--tolerance')
+def main(blocks: int, lines: int, repeat: int, seed: int, tolerance: float, speed_check: bool):
+    text = mk_corpus(blocks, lines, seed=seed)
+    num_lines = text.count('\n')
+    assert normalize(split_doc(text)) == list(legacy_split_doc(text))
+    results = {
+        'legacy split_doc': best_time(lambda: list(legacy_split_doc(text)), repeat),
+        'split_doc': best_time(lambda: list(split_doc(text)), repeat),
+        'index_blocks': best_time(lambda: list(index_blocks(text)), repeat),
+        'index_blocks (bytes)': best_time(lambda: list(index_blocks(text.encode())), repeat),
+    }
+    print(f'corpus: {num_lines} lines, {blocks} blocks')
+    print(f'{"benchmark":<22} {"time (ms)":>10} {"klines/s":>9}')
+    for name, elapsed in results.items():
+        print(f'{name:<22} {elapsed * 1000:>10.1f} {num_lines / elapsed / 1000:>9.0f}')
+    print(f'split_doc is {results["legacy split_doc"] / results["split_doc"]:.2f}x as fast as the legacy implementation')
+
+    select = lambda cmd_str: cmd_str != 'skipped'
+    superlinear = []
+    print(f'{"shape":<20} {"ns/line (1x, 2x, 4x, 8x)":>32} {"growth":>7}')
+    for name, mk_doc in SHAPES.items():
+        per_line = []
+        for scale in [ 1, 2, 4, 8 ]:
+            doc = mk_doc(random.Random(seed), lines * scale)
+            elapsed = best_time(lambda: list(index_blocks(doc, select)), repeat)
+            per_line.append(elapsed / doc.count('\n') * 1e9)
+        growth = per_line[-1] / per_line[0]
+        print(f'{name:<20} {", ".join(f"{t:7.0f}" for t in per_line):>32} {growth:>6.2f}x')
+        if growth > tolerance:
+            superlinear.append(name)
+    if superlinear:
+        print(f'index_blocks time per line grew by more than {tolerance}x: {", ".join(superlinear)}', file=sys.stderr)
+        if speed_check:
+            sys.exit(1)
+    else:
+        print('index_blocks ran in linear time on all shapes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Generate synthetic Markdown documents, for benchmarking ``mdcmd``, ``toc`` and ``bmd``.
+
+Documents mix headings, paragraphs, (nested) lists, code fences and ``<details>`` blocks, with ``<!-- `cmd` -->`` command
+blocks spread evenly through them. Each command block's (stale) output is in one of the forms ``mdcmd`` recognizes: a
+fence, a ``<details>`` block, a list, or nothing. Commands cycle through ``cmds`` (by default, cheap fakes: see
+:data:`CMDS`).
+
+Usage:
+    python bench/corpus.py [-b BLOCKS] [-l LINES] [-s SEED] [OUT_PATH]
+"""
+import random
+from typing import Iterator, Sequence
+
+from click import argument, command, option
+
+CMDS = (
+    'true',
+    'sleep 0.01',
+    "bash -c 'yes | head -n 100000'",
+)
+
+
+def static_section(rng: random.Random, idx: int, num_lines: int) -> Iterator[str]:
+    """About ``num_lines`` lines of static Markdown, starting with a heading."""
+    yield f'## Section {idx}'
+    yield ''
+    n = 2
+    while n < num_lines:
+        kind = rng.choice(('paragraph', 'list', 'fence', 'details', 'heading'))
+        if kind == 'paragraph':
+            lines = [ f'Paragraph {idx}.{n}, line {j}: lorem ipsum dolor sit amet, consectetur adipiscing elit.' for j in range(rng.randint(1, 5)) ]
+        elif kind == 'list':
+            lines = [
+                f'{"  " * (j % 3 == 2)}- item {idx}.{n}.{j}'
+                for j in range(rng.randint(2, 8))
+            ]
+        elif kind == 'fence':
+            body = [ f'# comment {j}' if j % 4 == 0 else f'echo {idx} {n} {j}' for j in range(rng.randint(1, 6)) ]
+            lines = [ '```bash', *body, '```' ]
+        elif kind == 'details':
+            body = [ f'detail {idx}.{n}.{j}' for j in range(rng.randint(1, 4)) ]
+            lines = [ f'<details><summary>Details {idx}.{n}</summary>', '', '```', *body, '```', '</details>' ]
+        else:
+            lines = [ f'### Subsection {idx}.{n} `code` and [a link](#section-{idx})' ]
+        yield from lines
+        yield ''
+        n += len(lines) + 1
+
+
+def old_output(rng: random.Random, idx: int) -> list[str]:
+    """A command block's stale output, in one of the forms ``mdcmd`` recognizes."""
+    kind = idx % 4
+    lines = [ f'old output {idx}.{j}' for j in range(rng.randint(1, 5)) ]
+    if kind == 0:
+        return [ '```', *lines, '```' ]
+    elif kind == 1:
+        return [ '<details><summary><code>cmd</code></summary>', '', '```', *lines, '```', '</details>' ]
+    elif kind == 2:
+        return [ f'- {line}' for line in lines ]
+    else:
+        return []
+
+
+def mk_corpus(
+    num_blocks: int,
+    num_lines: int,
+    cmds: Sequence[str] = CMDS,
+    seed: int = 0,
+) -> str:
+    """A document with ``num_blocks`` command blocks (running ``cmds``, round-robin), and about ``num_lines`` lines."""
+    rng = random.Random(seed)
+    per_section = max(num_lines // (num_blocks + 1), 4)
+    lines = [ '# Benchmark corpus', '', '<!-- `toc` -->', '' ]
+    for idx in range(num_blocks):
+        lines += static_section(rng, idx, per_section)
+        lines += [ f'<!-- `{cmds[idx % len(cmds)]}` -->', *old_output(rng, idx), '' ]
+    lines += static_section(rng, num_blocks, per_section)
+    return '\n'.join(lines) + '\n'
+
+
+@command()
+@option('-b', '--blocks', 'num_blocks', type=int, default=100, help='Number of command blocks')
+@option('-c', '--cmd', 'cmds', multiple=True, help=f'Commands to run in blocks, round-robin (default: {", ".join(CMDS)})')
+@option('-l', '--lines', 'num_lines', type=int, default=10_000, help='Approximate number of lines')
+@option('-s', '--seed', type=int, default=0, help='Random seed')
+@argument('out_path', required=False)
+def main(num_blocks: int, cmds: tuple[str, ...], num_lines: int, seed: int, out_path: str):
+    text = mk_corpus(num_blocks, num_lines, cmds=cmds or CMDS, seed=seed)
+    if out_path:
+        with open(out_path, 'w') as f:
+            f.write(text)
+    else:
+        print(text, end='')
+
+
+if __name__ == '__main__':
+    main()
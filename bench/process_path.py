@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""Compare ``mdcmd.engine.process_path``'s parse+assembly cost against the original per-line-coroutine approach.
+
+The original ``process_path`` loop (a coroutine per line, all ``gather``ed before anything is written, with its own
+line-by-line block parsing) is vendored here as the "per-line" baseline. Block outputs are served from ``memo`` in both,
+so no commands are run; what's measured is parsing, scheduling and writing the document.
+
+Usage:
+    python bench/process_path.py [-l LINES] [-b BLOCKS] [-r REPEAT]
+"""
+import asyncio
+import re
+import shlex
+import tracemalloc
+from asyncio import gather
+from io import StringIO
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from click import command, option
+
+from mdcmd.engine import process_path, shared_key
+
+
+def mk_doc(num_lines: int, num_blocks: int) -> str:
+    lines = []
+    per_block = max(num_lines // (num_blocks + 1), 1)
+    for idx in range(num_blocks):
+        lines += [ f'- changelog entry {idx}.{j}' if j % 10 else '' for j in range(per_block) ]
+        lines += [ '', f'<!-- `echo {idx}` -->', '```', 'old output', '```' ]
+    lines += [ f'trailing line {j}' for j in range(per_block) ]
+    return '\n'.join(lines) + '\n'
+
+
+async def async_line(arg: str) -> str:
+    return arg
+
+
+# Vendored from the original `mdcmd` (before `mdcmd.parse` existed), so that the baseline doesn't share any of the
+# current parser
+CMD_LINE_RGX = re.compile(r'<!-- `(?P<cmd>.+)` -->')
+HTML_OPEN_RGX = re.compile(r'<(?P<tag>\w+)(?: +\w+(?:="[^"]*")?)* *>.*')
+
+
+async def per_line(path: str, memo: dict, write_fn) -> int:
+    """The original implementation: the file is parsed line by line, each line becomes a coroutine, and they're all
+    ``gather``ed before anything is written. Commands' outputs are served from ``memo``."""
+    blocks = []
+    num_blocks = 0
+
+    def write(arg):
+        blocks.append(async_line(arg) if isinstance(arg, str) else arg)
+
+    with open(path, 'r') as fd:
+        lines = map(lambda line: line.rstrip('\n'), fd)
+        for line in lines:
+            write(line)
+            if not (m := CMD_LINE_RGX.match(line)):
+                continue
+
+            cmd = shlex.split(m.group('cmd'))
+            try:
+                line = next(lines)
+                if html_match := HTML_OPEN_RGX.fullmatch(line):
+                    close_lines = [f"</{html_match['tag']}>"]
+                elif line.startswith("```"):
+                    if cmd[0] == "bmdff":
+                        close_lines = ["```", re.compile(r"```\w+"), "```"]  # Skip two fences
+                    else:
+                        close_lines = ["```"]
+                elif line.startswith("- "):
+                    while line and (line.startswith("- ") or re.match(r"^ {2,}", line)):
+                        try:
+                            line = next(lines)
+                        except StopIteration:
+                            break
+                    close_lines = None
+                elif not line:
+                    close_lines = None
+                else:
+                    raise ValueError(f'Unexpected block start line under cmd {cmd}: {line}')
+            except StopIteration:
+                close_lines = None
+
+            while close_lines:
+                close, *close_lines = close_lines
+                line = next(lines)
+                while close.fullmatch(line) if isinstance(close, re.Pattern) else line != close:
+                    line = next(lines)
+
+            num_blocks += 1
+            write(async_line(memo[shared_key(cmd)]))
+            if close_lines is None:
+                write("")
+
+    for line in await gather(*blocks):
+        write_fn(line)
+    return num_blocks
+
+
+def measure(fn, repeat: int) -> tuple[float, int, str]:
+    times = []
+    peak = 0
+    out = None
+    for _ in range(repeat):
+        buf = StringIO()
+        write_fn = lambda line: print(line, file=buf)
+        tracemalloc.start()
+        start = perf_counter()
+        asyncio.run(fn(write_fn))
+        times.append(perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        out = buf.getvalue()
+    return min(times), peak, out
+
+
+@command()
+@option('-b', '--blocks', 'num_blocks', type=int, default=3, help='Number of command blocks')
+@option('-l', '--lines', 'num_lines', type=int, default=50_000, help='Number of static lines')
+@option('-r', '--repeat', type=int, default=3, help='Runs per approach (best time, max peak memory are reported)')
+def main(num_blocks: int, num_lines: int, repeat: int):
+    with TemporaryDirectory() as tmpdir:
+        path = join(tmpdir, 'doc.md')
+        with open(path, 'w') as f:
+            f.write(mk_doc(num_lines, num_blocks))
+        memo = { ('echo', str(idx)): str(idx) for idx in range(num_blocks) }
+
+        results = {
+            'per-line': measure(lambda write_fn: per_line(path, memo, write_fn), repeat),
+            'slices': measure(lambda write_fn: process_path(path, dry_run=False, patterns=None, write_fn=write_fn, memo=memo), repeat),
+        }
+
+    outputs = { out for _, _, out in results.values() }
+    if len(outputs) != 1:
+        raise RuntimeError('Approaches produced different output')
+
+    print(f'{num_lines} lines, {num_blocks} blocks:')
+    print(f'{"approach":<10} {"time (ms)":>10} {"peak mem (KiB)":>15}')
+    for name, (elapsed, peak, _) in results.items():
+        print(f'{name:<10} {elapsed * 1000:>10.1f} {peak / 1024:>15.0f}')
+
+
+if __name__ == '__main__':
+    main()
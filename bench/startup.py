@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Measure the console scripts' cold-start cost, failing (exit 1) if any regresses past a budget.
+
+For each console script, its command's module is imported in a fresh interpreter under ``python -X importtime``, and
+its cumulative import time is read from the last line of the output (best of ``REPEAT`` runs). Modules that should only
+be loaded once a command actually runs (see ``DEFERRED``) are also checked for. With ``--no-speed-check`` (as in the test
+suite, where timings are noisy), only the latter fail the run.
+
+Usage:
+    python bench/startup.py [-b BUDGET_MS] [-r REPEAT] [--no-speed-check]
+"""
+import re
+import sys
+from subprocess import run
+
+from click import command, option
+
+from mdcmd.client import PROGS
+
+# Modules that none of the console scripts should import before parsing their args
+DEFERRED = ('asyncio', 'concurrent.futures', 'mdcmd.engine', 'multiprocessing', 'tempfile', 'utz')
+
+IMPORTTIME_RGX = re.compile(r'import time:\s*\d+ \|\s*(?P<cumulative>\d+) \| (?P<module>\S+)')
+
+
+def import_module(module: str) -> tuple[float, list[str]]:
+    """Import ``module`` in a fresh interpreter, returning its cumulative import time (in seconds), and the
+    :data:`DEFERRED` modules it loaded."""
+    code = f'import sys, {module}; print("\\n".join(sys.modules))'
+    proc = run([ sys.executable, '-X', 'importtime', '-c', code ], capture_output=True, text=True, check=True)
+    times = {
+        m['module']: int(m['cumulative'])
+        for line in proc.stderr.splitlines()
+        if (m := IMPORTTIME_RGX.match(line))
+    }
+    loaded = proc.stdout.splitlines()
+    deferred = [
+        name for name in DEFERRED
+        if any(mod == name or mod.startswith(f'{name}.') for mod in loaded)
+    ]
+    return times[module] / 1e6, deferred
+
+
+@command()
+@option('-b', '--budget', 'budget_ms', type=float, default=200, help='Max cumulative import time (ms) of each command')
+@option('-r', '--repeat', type=int, default=5, help='Imports per module (best time is reported)')
+@option('--speed-check/--no-speed-check', default=True, help='Exit 1 if any command\'s import time exceeds the budget')
+def main(budget_ms: float, repeat: int, speed_check: bool):
+    modules = list(dict.fromkeys(module for module, _ in PROGS.values()))
+    failures = []
+    print(f'{"module":<10} {"import (ms)":>12}  deferred modules loaded')
+    for module in modules:
+        results = [ import_module(module) for _ in range(repeat) ]
+        elapsed = min(elapsed for elapsed, _ in results)
+        deferred = results[0][1]
+        print(f'{module:<10} {elapsed * 1000:>12.1f}  {", ".join(deferred) or "-"}')
+        if speed_check and elapsed * 1000 > budget_ms:
+            failures.append(f'{module}: {elapsed * 1000:.1f}ms > {budget_ms:g}ms budget')
+        if deferred:
+            failures.append(f'{module}: imports {", ".join(deferred)}')
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
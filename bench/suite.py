@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Benchmark ``mdcmd``'s parser, scheduler and engine, ``toc`` and ``bmd`` on a synthetic corpus (see ``corpus.py``).
+
+Each benchmark's best time (of ``REPEAT`` runs) is measured separately from its peak (``tracemalloc``) memory, so that
+tracing doesn't skew timings. Results are appended (as one line of JSON, with the current Git commit) to ``OUT_PATH``,
+and compared against the most recent earlier result there with the same parameters. Commands' ``Running: ...`` logs go
+to stderr (e.g. ``2>/dev/null`` to hide them).
+
+Usage:
+    python bench/suite.py [-b BLOCKS] [-l LINES] [-j JOBS] [-r REPEAT] [-n BMD_LINES] [-o OUT_PATH]
+"""
+import asyncio
+import json
+import platform
+import tracemalloc
+from datetime import datetime, timezone
+from io import StringIO
+from os.path import dirname, exists, join
+from subprocess import run
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Optional
+
+from click import command, option
+
+from corpus import CMDS, mk_corpus
+
+from bmdf.cli import bmd
+from mdcmd.engine import process_path, scheduled
+from mdcmd.parse import Block, split_doc
+from mdcmd.sched import Scheduler
+from toc import generate_toc
+
+DEFAULT_OUT_PATH = join(dirname(__file__), 'results.jsonl')
+
+
+def best_time(fn: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def peak_mem(fn: Callable[[], object]) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(fn: Callable[[], object], repeat: int, **extra) -> dict:
+    return dict(time=best_time(fn, repeat), peak_mem=peak_mem(fn), **extra)
+
+
+def git_commit() -> Optional[str]:
+    """The current commit's (short) SHA, suffixed with ``-dirty`` if the worktree has uncommitted changes."""
+    root = dirname(dirname(__file__))
+    proc = run([ 'git', 'rev-parse', '--short', 'HEAD' ], cwd=root, capture_output=True, text=True)
+    if proc.returncode:
+        return None
+    dirty = run([ 'git', 'diff', '--quiet', 'HEAD' ], cwd=root).returncode
+    return proc.stdout.strip() + ('-dirty' if dirty else '')
+
+
+def bench_parse(text: str, repeat: int) -> dict:
+    """Split the corpus into static runs and ``Block``s."""
+    num_blocks = sum(isinstance(item, Block) for item in split_doc(text))
+    return measure(lambda: list(split_doc(text)), repeat, blocks=num_blocks, lines=text.count('\n'))
+
+
+def bench_sched(num_blocks: int, jobs: Optional[int], repeat: int) -> dict:
+    """Run no-op "commands" through the scheduler (acquiring and releasing a job slot each), to isolate its overhead."""
+    async def noop() -> str:
+        return ''
+
+    async def run_all():
+        sched = Scheduler(jobs=jobs)
+        await asyncio.gather(*[ scheduled(sched, f'cmd {idx}', noop(), None) for idx in range(num_blocks) ])
+
+    result = measure(lambda: asyncio.run(run_all()), repeat, blocks=num_blocks)
+    result['per_block'] = result['time'] / num_blocks
+    return result
+
+
+def bench_process_path(path: str, jobs: Optional[int], repeat: int, memo: Optional[dict] = None) -> dict:
+    """Process the corpus end-to-end, running its commands (or, with ``memo``, only assembling the output)."""
+    size = 0
+
+    def write_fn(text: str):
+        nonlocal size
+        size += len(text) + 1
+
+    def process():
+        nonlocal size
+        size = 0
+        return asyncio.run(process_path(path, dry_run=False, patterns=None, write_fn=write_fn, jobs=jobs, memo=memo))
+
+    num_blocks = process()
+    result = measure(process, repeat, blocks=num_blocks, output_size=size)
+    result['blocks_per_sec'] = num_blocks / result['time']
+    result['bytes_per_sec'] = size / result['time']
+    return result
+
+
+def bench_toc(text: str, repeat: int) -> dict:
+    result = measure(lambda: generate_toc(text), repeat, lines=text.count('\n'))
+    result['lines_per_sec'] = result['lines'] / result['time']
+    return result
+
+
+def bench_bmd(num_lines: int, repeat: int) -> dict:
+    """Format ``yes | head -n <num_lines>`` (in the default, commented style)."""
+    out = StringIO()
+
+    def format():
+        out.seek(0)
+        out.truncate()
+        bmd.callback(command=('yes', '|', 'head', '-n', str(num_lines)), no_copy=True, file=out)
+
+    format()
+    size = len(out.getvalue())
+    result = measure(format, repeat, lines=num_lines, output_size=size)
+    result['bytes_per_sec'] = size / result['time']
+    return result
+
+
+def load_previous(out_path: str, params: dict) -> Optional[dict]:
+    """The most recent result in ``out_path`` with the same ``params``."""
+    if not exists(out_path):
+        return None
+    previous = None
+    with open(out_path, 'r') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry['params'] == params:
+                previous = entry
+    return previous
+
+
+def fmt_row(name: str, result: dict, prev: Optional[dict]) -> str:
+    time_ms = result['time'] * 1000
+    peak_kib = result['peak_mem'] / 1024
+    row = f'{name:<14} {time_ms:>10.1f} {peak_kib:>15.0f}'
+    if prev:
+        prev_ms = prev['time'] * 1000
+        prev_kib = prev['peak_mem'] / 1024
+        row += f' {prev_ms:>10.1f} {(time_ms / prev_ms - 1) * 100:>+7.1f}% {prev_kib:>15.0f}'
+    return row
+
+
+@command()
+@option('-b', '--blocks', 'num_blocks', type=int, default=100, help='Number of command blocks in the corpus')
+@option('-j', '--jobs', type=int, help='Max concurrent commands, for end-to-end `process_path` (default: number of CPUs)')
+@option('-l', '--lines', 'num_lines', type=int, default=10_000, help='Approximate number of lines in the corpus')
+@option('-n', '--bmd-lines', type=int, default=100_000, help='Lines of output for `bmd` to format')
+@option('-o', '--out-path', default=DEFAULT_OUT_PATH, help='Append results to this JSONL file (and compare against the previous results there)')
+@option('-r', '--repeat', type=int, default=3, help='Runs per benchmark (best time is reported)')
+def main(num_blocks: int, jobs: Optional[int], num_lines: int, bmd_lines: int, out_path: str, repeat: int):
+    params = dict(blocks=num_blocks, lines=num_lines, jobs=jobs, bmd_lines=bmd_lines, cmds=list(CMDS))
+    text = mk_corpus(num_blocks, num_lines)
+    results = {}
+    with TemporaryDirectory() as tmpdir:
+        path = join(tmpdir, 'corpus.md')
+        with open(path, 'w') as f:
+            f.write(text)
+        # Commands' outputs, so that assembly can be measured without running them
+        memo = { tuple(item.cmd): '' for item in split_doc(text) if isinstance(item, Block) }
+        results['parse'] = bench_parse(text, repeat)
+        results['sched'] = bench_sched(num_blocks, jobs, repeat)
+        results['assemble'] = bench_process_path(path, jobs, repeat, memo=memo)
+        results['process_path'] = bench_process_path(path, jobs, repeat)
+        results['generate_toc'] = bench_toc(text, repeat)
+        results['bmd'] = bench_bmd(bmd_lines, repeat)
+
+    previous = load_previous(out_path, params) if out_path else None
+    entry = dict(
+        commit=git_commit(),
+        date=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        params=params,
+        repeat=repeat,
+        results=results,
+    )
+    if out_path:
+        with open(out_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    print(f'{num_blocks} blocks, {text.count(chr(10))} lines; bmd: {bmd_lines} lines')
+    header = f'{"benchmark":<14} {"time (ms)":>10} {"peak mem (KiB)":>15}'
+    if previous:
+        header += f' {"prev (ms)":>10} {"change":>8} {"prev mem (KiB)":>15}'
+    print(header)
+    for name, result in results.items():
+        prev = previous['results'].get(name) if previous else None
+        print(fmt_row(name, result, prev))
+    sched = results['sched']
+    e2e = results['process_path']
+    print(f'scheduler overhead: {sched["per_block"] * 1e6:.1f}µs/block; end-to-end: {e2e["blocks_per_sec"]:.0f} blocks/s, {e2e["bytes_per_sec"] / 2**20:.1f}MiB/s')
+    if previous:
+        print(f'(compared with {previous["commit"]}, {previous["date"]})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""Benchmark ``toc.generate_toc`` on a large synthetic document, against its previous (``splitlines``-based,
+regex-recompiling) implementation; fails (exit 1) if it isn't faster than that (unless ``--no-speed-check``, which the
+test suite passes, since wall-clock ratios are noisy on loaded machines).
+
+The document is ``-s`` sections of prose, code fences (containing heading-like lines) and headings (with and without
+``<a id>`` anchors, some repeated). ``generate_toc`` is timed on the document as a string, memory-mapped, as an open
+file's lines, and with ``auto_ids``; ``toc.index.HeadingIndex`` is timed building an index, on an unchanged file, and
+after a one-section edit. Each timing is the best of ``REPEAT`` runs.
+
+Usage:
+    python bench/toc_gen.py [-s SECTIONS] [-r REPEAT] [--no-speed-check]
+"""
+import re
+import sys
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+
+from click import command, option
+
+from toc import format_toc, generate_toc, mapped
+from toc.index import HeadingIndex
+
+
+def legacy_generate_toc(content: str, indent_size: int = 4) -> str:
+    """``generate_toc``'s previous implementation (which didn't skip code fences)."""
+    lines = []
+    content_lines = content.splitlines()
+
+    TITLE_ID = r'(?P<title>.*) <a id="(?P<id>[^"]+)"></a>'
+    MD_RGX = re.compile(r'(?P<level>#{2,}) ' + TITLE_ID)
+    HTML_RGX = re.compile(r'<(?P<tag>h\d)>')
+    TITLE_ID_RGX = re.compile(TITLE_ID)
+
+    i = 0
+    while i < len(content_lines):
+        line = content_lines[i]
+        if m := MD_RGX.fullmatch(line):
+            level = len(m['level'])
+            title = m['title']
+            id = m['id']
+        elif m := HTML_RGX.fullmatch(line):
+            level = int(m['tag'][1])
+            if i + 2 < len(content_lines):
+                body = content_lines[i + 1]
+                close = content_lines[i + 2]
+                tag = m['tag']
+                if (m2 := TITLE_ID_RGX.fullmatch(body)) and close == f'</{tag}>':
+                    title = m2['title']
+                    id = m2['id']
+                    i += 2
+                else:
+                    i += 1
+                    continue
+            else:
+                i += 1
+                continue
+        else:
+            i += 1
+            continue
+
+        title = re.sub(r'\[([^]]+)](?:\([^)]+\))?', r'\1', title)
+        indent = ' ' * (indent_size * (level - 2))
+        lines.append(f'{indent}- [{title}](#{id})')
+        i += 1
+
+    return '\n'.join(lines)
+
+
+def mk_doc(sections: int) -> str:
+    """A document with ``sections`` sections, of 12 lines each."""
+    parts = []
+    for idx in range(sections):
+        kind = idx % 4
+        if kind == 0:
+            parts.append(f'## Section {idx} <a id="s{idx}"></a>\n')
+        elif kind == 1:
+            parts.append(f'### Sub-section {idx % 10} ([link](#s{idx - 1}))\n')
+        elif kind == 2:
+            parts.append(f'<h3>\nHTML section {idx} <a id="h{idx}"></a>\n</h3>\n')
+        else:
+            parts.append(f'#### `code` & punctuation, {idx}!\n')
+        parts.append(
+            '\n'
+            f'Some prose about section {idx}, with `inline code`, *emphasis* and a [link](https://example.com/{idx}).\n'
+            'More prose, continuing the paragraph, and ending it.\n'
+            '\n'
+            '```bash\n'
+            f'# a comment, not a heading {idx}\n'
+            f'echo {idx}\n'
+            '```\n'
+            '\n'
+        )
+    return ''.join(parts)
+
+
+def best_time(fn: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+@command()
+@option('-s', '--sections', type=int, default=10_000, help='Number of sections in the synthetic document')
+@option('-r', '--repeat', type=int, default=3, help='Runs per benchmark (best time is reported)')
+@option('--speed-check/--no-speed-check', default=True, help='Exit 1 if generate_toc is slower than the legacy implementation')
+def main(sections: int, repeat: int, speed_check: bool):
+    doc = mk_doc(sections)
+    num_lines = doc.count('\n')
+    assert generate_toc(doc) == legacy_generate_toc(doc)
+    with TemporaryDirectory() as tmpdir:
+        path = join(tmpdir, 'doc.md')
+        with open(path, 'w') as f:
+            f.write(doc)
+
+        def from_mmap():
+            with mapped(path) as mm:
+                return generate_toc(mm)
+
+        def from_lines():
+            with open(path, 'r') as f:
+                return generate_toc(f)
+
+        assert from_mmap() == from_lines() == generate_toc(doc)
+
+        # `HeadingIndex`: building a new index, re-reading an unchanged file's, and updating it after a one-section
+        # edit (which includes rewriting the file)
+        index_dirs = iter(range(2**20))
+
+        def index_cold():
+            return format_toc(HeadingIndex(root=join(tmpdir, f'index{next(index_dirs)}')).headings(path))
+
+        index = HeadingIndex(root=join(tmpdir, 'index'))
+        assert format_toc(index.headings(path)) == generate_toc(doc)
+        edits = [ doc, doc.replace('Some prose about section 5,', 'Edited prose about section 5,') ]
+
+        def index_edited():
+            edits.reverse()
+            with open(path, 'w') as f:
+                f.write(edits[0])
+            toc = format_toc(index.headings(path))
+            assert index.scanned == 1
+            return toc
+
+        results = {
+            'legacy': best_time(lambda: legacy_generate_toc(doc), repeat),
+            'generate_toc': best_time(lambda: generate_toc(doc), repeat),
+            'generate_toc (mmap)': best_time(from_mmap, repeat),
+            'generate_toc (lines)': best_time(from_lines, repeat),
+            'generate_toc (auto_ids)': best_time(lambda: generate_toc(doc, auto_ids=True), repeat),
+            'HeadingIndex (cold)': best_time(index_cold, repeat),
+            'HeadingIndex (unchanged)': best_time(lambda: format_toc(index.headings(path)), repeat),
+            'HeadingIndex (edited)': best_time(index_edited, repeat),
+        }
+    print(f'{num_lines} lines, {len(doc) / 2**20:.1f}MiB')
+    print(f'{"benchmark":<26} {"time (ms)":>10} {"klines/s":>9}')
+    for name, elapsed in results.items():
+        print(f'{name:<26} {elapsed * 1000:>10.1f} {num_lines / elapsed / 1000:>9.0f}')
+    legacy, new = results['legacy'], results['generate_toc']
+    print(f'generate_toc is {legacy / new:.2f}x as fast as the legacy implementation')
+    if speed_check and new >= legacy:
+        print('generate_toc is slower than the legacy implementation', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Strip ANSI escape sequences from a stream of text, or render their SGR ("Select Graphic Rendition") colors and styles as
+HTML ``<span>``s.
+
+Text can be fed in arbitrary chunks: a sequence split across chunks is held until it's completed. Recognized sequences:
+
+- CSI (``ESC [ <params> <intermediates> <final>``), e.g. SGR colors (``ESC [ 31 m``) and cursor movement
+- OSC / DCS / SOS / PM / APC strings (``ESC ] … BEL``, ``ESC P … ESC \\``, etc.), e.g. hyperlinks and window titles
+- other two- or three-byte escapes (e.g. ``ESC ( B``, ``ESC =``)
+
+A control character (e.g. ``\\n``) inside a sequence aborts it, and an ``ESC`` that doesn't begin a valid sequence is
+dropped; so sequences never span lines, and a line's output depends only on it (and, when rendering HTML, the style in
+effect at its start).
+"""
+from __future__ import annotations
+
+import re
+from html import escape
+from typing import Optional
+
+ESC = '\x1b'
+
+# A complete escape sequence
+SEQ_RGX = re.compile(r'''
+    \x1b (?:
+        \[ (?P<params>[0-?]*) (?P<intermediates>[ -/]*) (?P<final>[@-~])  # CSI
+      | [\]PX^_] [^\x00-\x1f\x7f]* (?:\x07|\x1b\\)                          # OSC, DCS, SOS, PM, APC; ended by BEL or ST
+      | [ -/]* [0-OQ-WYZ\\`-~]                                              # nF, Fp, Fe, Fs
+    )
+''', re.VERBOSE)
+
+# The start of an escape sequence that's incomplete (at the end of the text so far)
+PARTIAL_RGX = re.compile(r'\x1b(?:\[[0-?]*[ -/]*|[\]PX^_][^\x00-\x1f\x7f]*\x1b?|[ -/]*)\Z')
+
+# CSI parameter prefixes reserved for private (non-SGR) uses, e.g. ``ESC [ > 4 m``
+PRIVATE_PREFIXES = ('<', '=', '>', '?')
+
+# xterm's 16 standard colors
+COLORS_16 = (
+    '#000000', '#cd0000', '#00cd00', '#cdcd00', '#0000ee', '#cd00cd', '#00cdcd', '#e5e5e5',
+    '#7f7f7f', '#ff0000', '#00ff00', '#ffff00', '#5c5cff', '#ff00ff', '#00ffff', '#ffffff',
+)
+
+CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+
+
+def color_256(n: int) -> Optional[str]:
+    """CSS color for an xterm 256-color palette index."""
+    if 0 <= n < 16:
+        return COLORS_16[n]
+    if 16 <= n < 232:
+        n -= 16
+        r, g, b = CUBE_LEVELS[n // 36], CUBE_LEVELS[n // 6 % 6], CUBE_LEVELS[n % 6]
+        return f'#{r:02x}{g:02x}{b:02x}'
+    if 232 <= n < 256:
+        level = 8 + 10 * (n - 232)
+        return f'#{level:02x}{level:02x}{level:02x}'
+    return None
+
+
+class Style:
+    """Text attributes set by SGR sequences."""
+    __slots__ = ('fg', 'bg', 'bold', 'dim', 'italic', 'underline', 'strike')
+
+    def __init__(self):
+        self.reset()
+
+    @property
+    def state(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def load(cls, state: tuple) -> Style:
+        style = cls()
+        for name, value in zip(cls.__slots__, state):
+            setattr(style, name, value)
+        return style
+
+    def reset(self):
+        self.fg: Optional[str] = None
+        self.bg: Optional[str] = None
+        self.bold = self.dim = self.italic = self.underline = self.strike = False
+
+    def css(self) -> str:
+        decls = []
+        if self.fg:
+            decls.append(f'color:{self.fg}')
+        if self.bg:
+            decls.append(f'background-color:{self.bg}')
+        if self.bold:
+            decls.append('font-weight:bold')
+        if self.dim:
+            decls.append('opacity:0.5')
+        if self.italic:
+            decls.append('font-style:italic')
+        if self.underline or self.strike:
+            lines = [ 'underline' ] * self.underline + [ 'line-through' ] * self.strike
+            decls.append(f'text-decoration:{" ".join(lines)}')
+        return ';'.join(decls)
+
+    def apply(self, params: str):
+        """Update attributes from an SGR sequence's parameters (e.g. ``"1;38;5;208"``)."""
+        codes = [ int(code) if code.isdigit() else 0 for code in params.replace(':', ';').split(';') ]
+        idx = 0
+        while idx < len(codes):
+            code = codes[idx]
+            idx += 1
+            if code == 0:
+                self.reset()
+            elif code == 1:
+                self.bold = True
+            elif code == 2:
+                self.dim = True
+            elif code == 3:
+                self.italic = True
+            elif code == 4:
+                self.underline = True
+            elif code == 9:
+                self.strike = True
+            elif code == 22:
+                self.bold = self.dim = False
+            elif code == 23:
+                self.italic = False
+            elif code == 24:
+                self.underline = False
+            elif code == 29:
+                self.strike = False
+            elif 30 <= code <= 37:
+                self.fg = COLORS_16[code - 30]
+            elif 90 <= code <= 97:
+                self.fg = COLORS_16[code - 90 + 8]
+            elif 40 <= code <= 47:
+                self.bg = COLORS_16[code - 40]
+            elif 100 <= code <= 107:
+                self.bg = COLORS_16[code - 100 + 8]
+            elif code == 39:
+                self.fg = None
+            elif code == 49:
+                self.bg = None
+            elif code in (38, 48):
+                # Extended color: `5;<n>` (256-color palette) or `2;<r>;<g>;<b>` (truecolor)
+                color = None
+                if idx < len(codes) and codes[idx] == 5:
+                    if idx + 1 < len(codes):
+                        color = color_256(codes[idx + 1])
+                    idx += 2
+                elif idx < len(codes) and codes[idx] == 2:
+                    r, g, b = (codes[idx + 1:idx + 4] + [ 0, 0, 0 ])[:3]
+                    color = f'#{r % 256:02x}{g % 256:02x}{b % 256:02x}'
+                    idx += 4
+                if code == 38:
+                    self.fg = color
+                else:
+                    self.bg = color
+
+
+class AnsiStream:
+    """Remove ANSI escape sequences from text fed (via :meth:`feed`) in arbitrary chunks.
+
+    With ``html``, text is HTML-escaped, and SGR colors and styles are rendered as ``<span style="…">``s (other sequences
+    are removed). Spans are closed at the end of each line (and reopened at the start of the next, if a style is still in
+    effect), so each line is well-formed on its own.
+    """
+    def __init__(self, html: bool = False):
+        self.html = html
+        # An incomplete escape sequence, from the end of the last chunk
+        self.pending = ''
+        # The current style (see :attr:`Style.state`), and its opening ``<span>`` tag (empty for the default style)
+        self.state = Style().state
+        self.tag = ''
+        # Memoized SGR sequences' effects: (state, params) -> (state, tag)
+        self.transitions: dict[tuple[tuple, str], tuple[tuple, str]] = {}
+        self.open = False
+
+    def feed(self, text: str) -> str:
+        """Process a chunk of text, returning the output it completes."""
+        if self.pending:
+            text = self.pending + text
+            self.pending = ''
+        elif ESC not in text:
+            return self.text(text) if self.html else text
+        # Sequences can't span lines, so only the last one can hold the start of an incomplete sequence
+        if m := PARTIAL_RGX.search(text, text.rfind('\n') + 1):
+            text, self.pending = text[:m.start()], text[m.start():]
+        if not self.html:
+            # Removing complete sequences (in one pass), then any remaining (invalid) ``ESC``s
+            return SEQ_RGX.sub('', text).replace(ESC, '')
+        out = []
+        pos = 0
+        for m in SEQ_RGX.finditer(text):
+            out.append(self.text(text[pos:m.start()].replace(ESC, '')))
+            if m['final'] == 'm' and not m['intermediates'] and not m['params'].startswith(PRIVATE_PREFIXES):
+                self.sgr(m['params'], out)
+            pos = m.end()
+        out.append(self.text(text[pos:].replace(ESC, '')))
+        return ''.join(out)
+
+    def finish(self) -> str:
+        """Close any open ``<span>``, at EOF (an incomplete sequence is dropped)."""
+        self.pending = ''
+        if self.open:
+            self.open = False
+            return '</span>'
+        return ''
+
+    def sgr(self, params: str, out: list[str]):
+        key = (self.state, params)
+        if (transition := self.transitions.get(key)) is None:
+            style = Style.load(self.state)
+            style.apply(params)
+            css = style.css()
+            transition = self.transitions[key] = (style.state, f'<span style="{css}">' if css else '')
+        self.state, tag = transition
+        if tag != self.tag:
+            if self.open:
+                out.append('</span>')
+                self.open = False
+            self.tag = tag
+
+    def text(self, text: str) -> str:
+        if not text:
+            return ''
+        text = escape(text, quote=False)
+        tag = self.tag
+        if not tag:
+            return text
+        out = text.replace('\n', f'</span>\n{tag}')
+        if not self.open:
+            out = tag + out
+        if text.endswith('\n'):
+            out = out[:-len(tag)]
+            self.open = False
+        else:
+            self.open = True
+        return out
+
+
+def strip_ansi(text: str) -> str:
+    """Remove ANSI escape sequences (including incomplete ones at the end) from ``text``."""
+    stream = AnsiStream()
+    return stream.feed(text) + stream.finish()
@@ -0,0 +1,147 @@
+"""Render many commands in one process (``bmd --batch``): read command specs as JSONL, run them concurrently, and write
+each one's Markdown as JSONL.
+
+Each input line is a JSON object with a ``command`` (a list of args, or a string to ``shlex.split``), and optionally:
+
+- ``id``: echoed back in the command's output record
+- ``fence``: fence level (0-3, like passing ``-f`` that many times)
+- ``env``: env vars for the command (an object, or a list of ``k=v`` strings)
+- any other ``bmd`` param, by its Python name (e.g. ``workdir``, ``fence_type``, ``shell``, ``include_stderr``, ``head``)
+
+Values are converted by the corresponding Click params (as if passed on the command line, so e.g. ``"head": "3"`` is
+``3``).
+
+Params not set in a spec default to those passed to ``bmd --batch`` itself. Output records are written in input order,
+each as soon as it (and every record before it) is done: ``{"index": <line index>, ["id": …,] "markdown": "…"}``, or
+``"error": "…"`` (instead of ``"markdown"``) for a spec that's invalid or whose command couldn't be run (or failed a
+check, e.g. ``fail_on_diff``).
+"""
+from __future__ import annotations
+
+import json
+import os
+import shlex
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import StringIO
+from typing import Any, Callable, IO, Iterable, Iterator, Mapping, Optional
+
+from click import BadParameter, ClickException, Parameter
+
+# Spec keys that are named differently from the ``bmd`` params they set
+SPEC_ALIASES = {
+    'fence': 'fence_level',
+    'env': 'env_strs',
+}
+
+# ``bmd`` params that specs can't set
+UNSPECIFIABLE = {'batch_path', 'command', 'environ', 'file', 'jobs', 'no_copy'}
+
+Render = Callable[..., None]
+
+
+class SpecError(ValueError):
+    pass
+
+
+def parse_spec(line: str, params: Mapping[str, Parameter]) -> tuple[Any, dict]:
+    """Parse a line of JSONL into an ``id`` and ``bmd`` kwargs (converted by ``params``, ``bmd``'s Click params by
+    name)."""
+    try:
+        spec = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise SpecError(f'Invalid JSON: {e}')
+    if not isinstance(spec, dict):
+        raise SpecError(f'Expected a JSON object, got {type(spec).__name__}')
+    spec = dict(spec)
+    id = spec.pop('id', None)
+    command = spec.pop('command', None)
+    if isinstance(command, str):
+        command = shlex.split(command)
+    if not command or not isinstance(command, list) or not all(isinstance(arg, str) for arg in command):
+        raise SpecError('`command` must be a non-empty string, or list of strings')
+    kwargs = dict(command=tuple(command))
+    for key, value in spec.items():
+        param = SPEC_ALIASES.get(key, key)
+        if param not in params or param in UNSPECIFIABLE:
+            raise SpecError(f'Unrecognized key: {key}')
+        if param == 'env_strs' and isinstance(value, dict):
+            value = [ f'{k}={v}' for k, v in value.items() ]
+        try:
+            kwargs[param] = params[param].type_cast_value(None, value)
+        except BadParameter as e:
+            raise SpecError(f'Invalid value for {key}: {e.message}')
+    return id, kwargs
+
+
+def render_spec(
+    render: Render,
+    index: int,
+    line: str,
+    params: Mapping[str, Parameter],
+    defaults: Mapping[str, Any],
+    environ: Optional[Mapping[str, str]],
+) -> dict:
+    """Render one spec (via ``render``, i.e. ``bmd``'s callback) to an output record."""
+    record = dict(index=index)
+    try:
+        id, kwargs = parse_spec(line, params)
+        if id is not None:
+            record['id'] = id
+        out = StringIO()
+        render(**{ **defaults, **kwargs }, no_copy=True, file=out, environ=environ)
+        record['markdown'] = out.getvalue()
+    except (OSError, ValueError) as e:
+        record['error'] = str(e)
+    except ClickException as e:
+        # E.g. invalid combinations of params (`ansi_html` without `fence` 2 or 3), or `fail_on_diff` mismatches
+        record['error'] = e.format_message()
+    except Exception as e:
+        # Anything else fails just this spec, not the whole batch
+        record['error'] = f'{type(e).__name__}: {e}'
+    return record
+
+
+def iter_records(
+    render: Render,
+    lines: Iterable[str],
+    params: Mapping[str, Parameter],
+    defaults: Mapping[str, Any],
+    jobs: Optional[int] = None,
+    environ: Optional[Mapping[str, str]] = None,
+) -> Iterator[dict]:
+    """Render specs (one per non-blank line) with at most ``jobs`` running at once, yielding their records in order.
+
+    Specs are read lazily: at most ``2 * jobs`` are pending at once, so output starts before all input has been read.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        window = 2 * jobs
+        pending: deque[Future] = deque()
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            pending.append(executor.submit(render_spec, render, index, line, params, defaults, environ))
+            while pending and (pending[0].done() or len(pending) > window):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_batch(
+    render: Render,
+    input: IO[str],
+    output: IO[str],
+    params: Mapping[str, Parameter],
+    defaults: Mapping[str, Any],
+    jobs: Optional[int] = None,
+    environ: Optional[Mapping[str, str]] = None,
+) -> int:
+    """Write a JSONL record to ``output`` for each spec in ``input``, returning the number of errors."""
+    errors = 0
+    for record in iter_records(render, input, params, defaults, jobs=jobs, environ=environ):
+        if 'error' in record:
+            errors += 1
+        output.write(json.dumps(record) + '\n')
+        output.flush()
+    return errors
@@ -1,17 +1,16 @@
+import os
 import shlex
 import sys
-from os import chdir
-from subprocess import PIPE, Popen, CalledProcessError
+from hashlib import sha256
+from os import environ as env
 from sys import stdout
-from typing import Optional, Tuple, Any, IO
+from typing import Optional, Tuple, Any, IO, Iterable, Iterator, Mapping
 
-from click import argument, command, option, get_current_context, echo
-from utz import env, proc
-from utz.process import pipeline
-from utz.process.cmd import Cmd
+from click import argument, command, option, get_current_context, echo, open_file as click_open, ClickException, UsageError
 
-from bmdf import utils
-from bmdf.utils import COPY_BINARIES, details, fence, quote
+from bmdf.ansi import AnsiStream
+from bmdf.pipeline import Args, Cancel, Pipeline, Usage
+from bmdf.utils import BMDF_CLIPBOARD_VAR, BMDF_OMITTED_FMT_VAR, COPY_BINARIES, OMITTED_FMT, details, expandvars as expand_vars, fence, fmt_stats, fmt_timings, pre, quote, truncate
 
 BMDF_ERR_FMT_VAR = 'BMDF_ERR_FMT'
 BMDF_ERR_FMT = env.get(BMDF_ERR_FMT_VAR)
@@ -27,53 +26,121 @@ BMDF_EXPANDVARS_VAR = 'BMDF_EXPANDVARS'
 
 BMDF_INCLUDE_STDERR_VAR = 'BMDF_INCLUDE_STDERR'
 
+BMDF_STATS_VAR = 'BMDF_STATS'
+
 
 @command("fence", no_args_is_help=True)
+@option('-a', '--ansi-html', is_flag=True, help='Render ANSI colors and styles in the output as HTML <span>s, in a <pre> block (instead of a plain fence); other escape sequences are removed. Requires -f/--fence 2 or 3')
 @option('-A', '--strip-ansi', is_flag=True, help='Strip ANSI escape sequences from output')
-@option('-C', '--no-copy', is_flag=True, help=f'Disable copying output to clipboard (normally uses first available executable from {COPY_BINARIES}')
-@option('-e', '--error-fmt', default=BMDF_ERR_FMT, help=f'If the wrapped command exits non-zero, append a line of output formatted with this string. One "%d" placeholder may be used, for the returncode. Defaults to ${BMDF_ERR_FMT_VAR}{BMDF_ERR_FMT_HELP_STR}')
+@option('-b', '--batch', 'batch_path', help='Read command specs (one JSON object per line; see `bmdf.batch`) from this file ("-" for stdin), run them concurrently, and write each one\'s rendered Markdown as a line of JSON. Other options set defaults for every spec. Exits 1 if any spec failed')
+@option('-c', '--clipboard', help=f'Clipboard backend to copy output with: "auto" (first available executable from {COPY_BINARIES}), "osc52" (an escape sequence written to the terminal), "none", or a command to pipe output to (e.g. "xclip -selection clipboard"); falls back to ${BMDF_CLIPBOARD_VAR}, else "auto"')
+@option('-C', '--no-copy', is_flag=True, help='Disable copying output to clipboard (see -c/--clipboard)')
+@option('-d', '--fail-on-diff', is_flag=True, help='With -n/--repeat, exit 1 if any run\'s output differs from the first\'s')
+@option('-e', '--error-fmt', help=f'If the wrapped command exits non-zero, append a line of output formatted with this string. One "%d" placeholder may be used, for the returncode. Defaults to ${BMDF_ERR_FMT_VAR}{BMDF_ERR_FMT_HELP_STR}')
 @option('-E', '--env', 'env_strs', multiple=True, help="k=v env vars to set, for the wrapped command")
 @option('-f', '--fence', 'fence_level', count=True, help='Pass 0-3x to configure output style: 0x: print output lines, prepended by "# "; 1x: print a "```bash" fence block including the <command> and commented output lines; 2x: print a bash-fenced command followed by plain-fenced output lines; 3x: print a <details/> block, with command <summary/> and collapsed output lines in a plain fence.')
+@option('-H', '--head', type=int, help='Only print the first this many lines of output (followed by a line noting how many were omitted; see -O/--omitted-fmt). The rest are still drained, so the command runs to completion, and its exit status is preserved')
 @option('-i/-I', '--include-stderr/--no-include-stderr', is_flag=True, default=None, help=f'Capture and interleave both stdout and stderr streams; falls back to ${BMDF_INCLUDE_STDERR_VAR}')
+@option('-j', '--jobs', type=int, help='With -b/--batch, max commands to run at once (default: number of CPUs)')
+@option('-n', '--repeat', type=int, help='Run the command this many times, printing the first run\'s output, and the mean, standard deviation, min and max of their wall times (after the output, or, with -fff, in the <details> summary)')
+@option('-O', '--omitted-fmt', help=f'With -H/--head or -T/--tail, format of the line that replaces omitted output lines; one "%d" placeholder may be used, for the number of lines omitted. Falls back to ${BMDF_OMITTED_FMT_VAR}, or "{OMITTED_FMT}"')
+@option('-r/-R', '--stats/--no-stats', is_flag=True, default=None, help=f'Measure the command\'s (whole pipeline\'s) wall time, user and system CPU time, max RSS and block I/O counts (via `wait4`), and append them as a footer line (or, with -fff, in the <details> summary); falls back to ${BMDF_STATS_VAR}')
 @option('-s/-S', '--shell/--no-shell', is_flag=True, default=None, help=f'Disable "shell" mode for the command; falls back to ${BMDF_SHELL_VAR}, but defaults to True if neither is set')
 @option('-t', '--fence-type', help="When -f/--fence is 2 or 3, this customizes the fence syntax type that the output is wrapped in")
+@option('-T', '--tail', type=int, help='Only print the last this many lines of output (preceded by a line noting how many were omitted; see -O/--omitted-fmt); may be combined with -H/--head. Only this many lines are held in memory')
 @option('-u/-U', '--expanduser/--no-expanduser', is_flag=True, default=None, help=f'Pass commands through `os.path.expanduser` before `subprocess`; falls back to ${BMDF_EXPANDUSER_VAR}')
 @option('-v/-V', '--expandvars/--no-expandvars', is_flag=True, default=None, help=f'Pass commands through `os.path.expandvars` before `subprocess`; falls back to ${BMDF_EXPANDVARS_VAR}')
 @option('-w', '--workdir', help=f'`cd` to this directory before executing (falls back to ${BMDF_WORKDIR_VAR}')
-@option('-x', '--executable', help="`shell_executable` to pass to Popen pipelines (default: $SHELL)")
-@argument('command', required=True, nargs=-1)
+@option('-W', '--warmup', type=int, default=0, help='With -n/--repeat, first run the command this many times without timing it')
+@option('-x', '--executable', help="Shell to run the command (and any pipeline, as a whole) with, in shell mode (default: $SHELL)")
+@argument('command', required=False, nargs=-1)
 def bmd(
     command: Tuple[str, ...],
+    ansi_html: bool = False,
     strip_ansi: bool = False,
+    batch_path: Optional[str] = None,
+    clipboard: Optional[str] = None,
     no_copy: bool = False,
+    fail_on_diff: bool = False,
     error_fmt: Optional[str] = None,
     env_strs: Tuple[str, ...] = (),
     fence_level: int = 0,
+    head: Optional[int] = None,
     include_stderr: bool = False,
+    jobs: Optional[int] = None,
+    repeat: Optional[int] = None,
+    omitted_fmt: Optional[str] = None,
+    stats: Optional[bool] = None,
     shell: Optional[bool] = None,
     fence_type: Optional[str] = None,
+    tail: Optional[int] = None,
     expanduser: Optional[bool] = None,
     expandvars: Optional[bool] = None,
     workdir: Optional[str] = None,
+    warmup: int = 0,
     executable: Optional[str] = None,
     file: Optional[IO[Any]] = None,
+    environ: Optional[Mapping[str, str]] = None,
+    cancel: Optional[Cancel] = None,
+    stdin: Optional[int] = None,
+    usage: Optional[Usage] = None,
 ):
     """Format a command and its output to markdown, either in a `bash`-fence or <details> block, and copy it to the clipboard."""
+    if batch_path:
+        if command:
+            raise UsageError('Pass <command> xor -b/--batch')
+        batch(
+            batch_path,
+            jobs=jobs,
+            defaults=dict(
+                ansi_html=ansi_html,
+                strip_ansi=strip_ansi,
+                fail_on_diff=fail_on_diff,
+                error_fmt=error_fmt,
+                env_strs=env_strs,
+                fence_level=fence_level,
+                head=head,
+                include_stderr=include_stderr,
+                repeat=repeat,
+                omitted_fmt=omitted_fmt,
+                stats=stats,
+                shell=shell,
+                fence_type=fence_type,
+                tail=tail,
+                expanduser=expanduser,
+                expandvars=expandvars,
+                workdir=workdir,
+                warmup=warmup,
+                executable=executable,
+            ),
+            file=file,
+            environ=environ,
+        )
+        return
+
     if not command:
         ctx = get_current_context()
         echo(ctx.get_help())
         ctx.exit()
 
+    # Doesn't modify the process' env or cwd, so that it can be called concurrently (e.g. by `mdcmd`, in-process)
+    if environ is None:
+        environ = env
+
+    if error_fmt is None:
+        error_fmt = environ.get(BMDF_ERR_FMT_VAR)
+
+    if omitted_fmt is None:
+        omitted_fmt = environ.get(BMDF_OMITTED_FMT_VAR, OMITTED_FMT)
+
     if workdir is None:
-        workdir = env.get(BMDF_WORKDIR_VAR)
-    if workdir:
-        chdir(workdir)
+        workdir = environ.get(BMDF_WORKDIR_VAR)
 
     if shell is None:
-        shell = bool(env.get(BMDF_SHELL_VAR, True))
+        shell = bool(environ.get(BMDF_SHELL_VAR, True))
 
     if shell and executable is None:
-        executable = env.get('SHELL')
+        executable = environ.get('SHELL')
 
     if command[0] == 'time':
         # Without `-p`, `time`'s output is not POSIX-compliant, doesn't get parsed properly
@@ -84,75 +151,48 @@ def bmd(
         kv.split('=', 1)
         for kv in env_strs
     )
-    proc_env = { **env, **env_opts, }
+    proc_env = { **environ, **env_opts, }
 
     if expanduser is None:
-        expanduser = env.get(BMDF_EXPANDUSER_VAR)
+        expanduser = environ.get(BMDF_EXPANDUSER_VAR)
 
     if expandvars is None:
-        expandvars = env.get(BMDF_EXPANDVARS_VAR)
+        expandvars = environ.get(BMDF_EXPANDVARS_VAR)
 
     if include_stderr is None:
-        include_stderr = env.get(BMDF_INCLUDE_STDERR_VAR, True)
-
-    cmds: list[Cmd] = []
-    start_idx = 0
-    def mk_cmd(idx: int):
-        nonlocal start_idx
-        args = command[start_idx:idx]
-        if shell:
-            args = ' '.join([
-                quote(arg)
-                for arg in args
-            ])
-        cmd = Cmd.mk(
-            args,
-            **{
-                'env': proc_env,
-                'shell': shell,
-                'expanduser': expanduser,
-                'expandvars': expandvars,
-                **(dict(executable=executable) if shell else {}),
-            }
-        )
-        cmds.append(cmd)
-        start_idx = idx + 1
-
-    n = len(command)
-    for idx, arg in enumerate(command):
-        if arg == "|":
-            mk_cmd(idx)
-    if start_idx < n:
-        mk_cmd(n)
-
-    try:
-        with env(env_opts):
-            output = pipeline(cmds, both=include_stderr)
-            returncode = 0
-    except CalledProcessError as e:
-        output = e.output
-        if isinstance(output, bytes):
-            output = output.decode()
-        returncode = e.returncode
-
-    lines = [
-        line.rstrip('\n')
-        for line in
-        output.split('\n')
-    ]
-    if lines and not lines[-1]:
-        lines = lines[:-1]
-    if returncode and error_fmt:
-        try:
-            error_line = error_fmt % returncode
-        except TypeError:
-            error_line = error_fmt
-        lines.append(error_line)
-
-    if len(cmds) == 1:
+        include_stderr = environ.get(BMDF_INCLUDE_STDERR_VAR, True)
+
+    if stats is None:
+        stats = bool(environ.get(BMDF_STATS_VAR))
+
+    # Split the command into pipeline stages, on literal "|" args
+    stages: list[list[str]] = [ [] ]
+    for arg in command:
+        if arg == '|':
+            stages.append([])
+        else:
+            stages[-1].append(arg)
+    stages = [ args for args in stages if args ]
+
+    if shell:
+        if expanduser or expandvars:
+            raise ValueError("Can't `expand{user,vars}` in shell mode")
+        # One shell runs the whole pipeline
+        cmd_strs = [ ' '.join([ quote(arg) for arg in args ]) for args in stages ]
+        cmds: list[Args] = [ ' | '.join(cmd_strs) ]
+    else:
+        if expandvars:
+            # Expand against `proc_env`, rather than `os.environ`
+            stages = [ [ expand_vars(arg, proc_env) for arg in args ] for args in stages ]
+        cmd_strs = [ shlex.join(args) for args in stages ]
+        if expanduser:
+            stages = [ [ os.path.expanduser(arg) for arg in args ] for args in stages ]
+        cmds = stages
+
+    if len(stages) == 1:
         cmd_str = shlex.join(command)
     else:
-        cmd_str = " | ".join([ str(cmd) for cmd in cmds ])
+        cmd_str = " | ".join(cmd_strs)
     cmd_str = " ".join([
         *[
             f'"{env_str}"' if ' ' in env_str else env_str
@@ -161,49 +201,154 @@ def bmd(
         cmd_str,
     ])
 
-    out_lines = []
-
-    def log(line=''):
-        out_lines.append(utils.strip_ansi(line) if strip_ansi else line)
-
-    def print_commented_lines():
-        for line in lines:
-            log(f'# {line}' if line else '#')
-
-    def print_fenced_lines(typ: str = None):
-        with fence(typ=typ, log=log):
-            for line in lines:
-                log(line)
-
-    if not fence_level:
-        print_commented_lines()
-    elif fence_level == 1:
-        with fence('bash', log=log):
-            log(cmd_str)
-            print_commented_lines()
-    elif fence_level == 2:
-        with fence('bash', log=log):
-            log(cmd_str)
-        print_fenced_lines(typ=fence_type)
-    elif fence_level == 3:
-        with details(code=cmd_str, log=log):
-            print_fenced_lines(typ=fence_type)
-    else:
-        raise ValueError(f"Pass -f/--fence at most 3x")
-
-    output = '\n'.join(out_lines)
+    file = file or stdout
+    copy = None
     if not no_copy:
-        copy_cmd = None
-        for cmd in COPY_BINARIES:
-            if proc.check('which', cmd, log=None):
-                copy_cmd = cmd
-                break
-        if copy_cmd:
-            p = Popen([copy_cmd], stdin=PIPE, stdout=PIPE, stderr=PIPE, text=True)
-            p.communicate(input=output)
+        from bmdf.clipboard import open_copy
+        copy = open_copy(clipboard, environ)
+
+    # Output is written (and copied) in batches of lines, as the command produces them, so memory use doesn't grow with
+    # the size of its output
+    num_lines = 0
+    # Lines held back until the command has finished (for a <details> summary that includes its stats or timings)
+    held: Optional[list[str]] = None
+
+    def log_lines(lines: list[str]):
+        nonlocal num_lines
+        if held is not None:
+            held.extend(lines)
+            return
+        text = '\n'.join(lines)
+        file.write(f'{text}\n')
+        if copy:
+            copy.write(f'\n{text}' if num_lines else text)
+        num_lines += len(lines)
 
-    file = file or stdout
-    print(output, file=file)
+    def log(line=''):
+        log_lines([ line ])
+
+    def commented_lines(lines: list[str]):
+        log_lines([ f'# {line}' if line else '#' for line in lines ])
+
+    if ansi_html and fence_level < 2:
+        raise UsageError('-a/--ansi-html requires -f/--fence 2 or 3')
+
+    # Escape sequences are removed (or rendered as HTML) from the command's output lines
+    ansi = AnsiStream(html=ansi_html) if strip_ansi or ansi_html else None
+
+    def render(lines: list[str]) -> list[str]:
+        if not ansi:
+            return lines
+        return ansi.feed('\n'.join(lines) + '\n')[:-1].split('\n')
+
+    def mk_pipeline() -> Pipeline:
+        return Pipeline(cmds, both=include_stderr, env=proc_env, cwd=workdir or None, executable=executable, cancel=cancel, stdin=stdin)
+
+    def digested(batches: Iterable[list[str]], digest) -> Iterator[list[str]]:
+        for lines in batches:
+            digest.update(('\n'.join(lines) + '\n').encode())
+            yield lines
+
+    def drain(digest=None) -> Pipeline:
+        """Run the command without printing its output (optionally hashing it into ``digest``)."""
+        with mk_pipeline() as pipeline:
+            for _ in digested(pipeline.line_batches(), digest) if digest else pipeline.line_batches():
+                pass
+        return pipeline
+
+    # Lines summarizing the run(s) (--stats, --repeat), printed after the output (or, with -fff, in the <details> summary)
+    footers: list[str] = []
+    # The (1-based) index of a run whose output differed from the first one's (with --fail-on-diff)
+    differing_run: Optional[int] = None
+
+    def print_lines(pipeline: Pipeline, log_batch=log_lines):
+        nonlocal differing_run
+        batches = pipeline.line_batches()
+        digest = sha256() if repeat and fail_on_diff else None
+        if digest:
+            batches = digested(batches, digest)
+        for lines in truncate(batches, head=head, tail=tail, omitted_fmt=omitted_fmt):
+            log_batch(render(lines))
+        returncode = pipeline.wait()
+        if usage is not None:
+            # E.g. for `mdcmd --report`, when run in-process
+            usage.exit_code = returncode
+            usage.merge(pipeline.usage)
+        if returncode and error_fmt:
+            try:
+                error_line = error_fmt % returncode
+            except TypeError:
+                error_line = error_fmt
+            log_batch(render([ error_line ]))
+        if stats:
+            footers.append(fmt_stats(pipeline.wall, pipeline.usage))
+        if repeat:
+            times = [ pipeline.wall ]
+            for idx in range(2, repeat + 1):
+                run_digest = sha256() if digest else None
+                times.append(drain(run_digest).wall)
+                if digest and differing_run is None and run_digest.digest() != digest.digest():
+                    differing_run = idx
+            footers.append(fmt_timings(times))
+        if fence_level < 3:
+            for footer in footers:
+                log_batch([ footer ])
+
+    def print_fenced_lines(pipeline: Pipeline, typ: str = None):
+        # HTML isn't rendered inside a fence
+        with pre(log=log) if ansi_html else fence(typ=typ, log=log):
+            print_lines(pipeline)
+
+    for _ in range(warmup if repeat else 0):
+        drain()
+
+    with mk_pipeline() as pipeline:
+        if not fence_level:
+            print_lines(pipeline, commented_lines)
+        elif fence_level == 1:
+            with fence('bash', log=log):
+                log(cmd_str)
+                print_lines(pipeline, commented_lines)
+        elif fence_level == 2:
+            with fence('bash', log=log):
+                log(cmd_str)
+            print_fenced_lines(pipeline, typ=fence_type)
+        elif fence_level == 3:
+            if stats or repeat:
+                held = []
+                print_fenced_lines(pipeline, typ=fence_type)
+                lines, held = held, None
+                with details(summary=f'<code>{cmd_str}</code> ({"; ".join(footers)})', log=log):
+                    log_lines(lines)
+            else:
+                with details(code=cmd_str, log=log):
+                    print_fenced_lines(pipeline, typ=fence_type)
+        else:
+            raise ValueError(f"Pass -f/--fence at most 3x")
+
+    if not num_lines:
+        print(file=file)
+    if copy:
+        copy.close()
+    if differing_run:
+        raise ClickException(f'Output of run {differing_run} (of {repeat}) differed from run 1\'s')
+
+
+def batch(
+    path: str,
+    defaults: Mapping[str, Any],
+    jobs: Optional[int] = None,
+    file: Optional[IO[Any]] = None,
+    environ: Optional[Mapping[str, str]] = None,
+):
+    """Run ``bmd --batch``: render each command spec in ``path`` with :func:`bmd`'s callback (see :mod:`bmdf.batch`)."""
+    from bmdf.batch import run_batch
+
+    params = { param.name: param for param in bmd.params }
+    with click_open(path, 'r') as input:
+        errors = run_batch(bmd.callback, input, file or sys.stdout, params, defaults, jobs=jobs, environ=environ)
+    if errors:
+        sys.exit(1)
 
 
 def bmd_f():
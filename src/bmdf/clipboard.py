@@ -0,0 +1,137 @@
+"""Clipboard backends, that ``bmd`` copies its output with.
+
+A backend is selected by a "spec" (``bmd -c/--clipboard``, or ``$BMDF_CLIPBOARD``):
+
+- ``auto`` (default): the first of :data:`~bmdf.utils.COPY_BINARIES` found on the ``$PATH``
+- ``osc52``: an OSC 52 escape sequence, written to the terminal (no subprocess; works over SSH, in terminals that
+  support it)
+- ``none``: don't copy
+- anything else: a command (split like a shell would) that reads the text to copy from its stdin, e.g.
+  ``xclip -selection clipboard``
+
+Detection results are cached (per spec and ``$PATH``) for the life of the process, e.g. across all the commands run by
+an ``mdcmd-server``. Copying runs in the background: text is streamed to the copy command as it's written, and the
+command isn't waited for (some, like ``xclip``, linger until another program claims the selection).
+"""
+from __future__ import annotations
+
+import os
+import shlex
+import sys
+import threading
+from abc import ABC, abstractmethod
+from base64 import b64encode
+from functools import lru_cache, partial
+from shutil import which
+from subprocess import DEVNULL, PIPE, Popen
+from typing import Callable, IO, Mapping, Optional
+
+from bmdf.utils import BMDF_CLIPBOARD_VAR, COPY_BINARIES
+
+AUTO = 'auto'
+NONE = 'none'
+OSC52 = 'osc52'
+
+
+class Copy(ABC):
+    """An in-progress copy: text is :meth:`write`-n to it, then it's :meth:`close`-d."""
+    @abstractmethod
+    def write(self, text: str):
+        ...
+
+    @abstractmethod
+    def close(self):
+        ...
+
+
+class CommandCopy(Copy):
+    """Stream text to a copy command's stdin."""
+    def __init__(self, args: list[str], environ: Mapping[str, str]):
+        # In its own session, with no pipes but stdin, so that a command that lingers (or forks a child that does) can't
+        # hold up this process (or receive its signals)
+        self.proc = Popen(args, stdin=PIPE, stdout=DEVNULL, stderr=DEVNULL, text=True, env=environ, start_new_session=True)
+
+    def write(self, text: str):
+        if self.proc.stdin.closed:
+            return
+        try:
+            self.proc.stdin.write(text)
+        except OSError:
+            # E.g. the command exited early; the copy is abandoned, not the output
+            self.close()
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        # Reap the command once it exits, without waiting for it
+        threading.Thread(target=self.proc.wait, daemon=True).start()
+
+
+def tty() -> Optional[IO[str]]:
+    """The terminal to write escape sequences to: stderr (if it's a terminal; e.g. when this process' stdout is piped, or
+    when run by an ``mdcmd-server``, which receives its clients' stdio), else the controlling terminal (if any)."""
+    if sys.stderr.isatty():
+        return sys.stderr
+    try:
+        return open('/dev/tty', 'w')
+    except OSError:
+        return None
+
+
+class Osc52Copy(Copy):
+    """Copy via an OSC 52 escape sequence ("set clipboard"), written to the terminal once all text has been received (so
+    that it's not interleaved with output going to the same terminal)."""
+    def __init__(self, environ: Mapping[str, str]):
+        self.chunks: list[str] = []
+
+    def write(self, text: str):
+        self.chunks.append(text)
+
+    def close(self):
+        if not (out := tty()):
+            return
+        payload = b64encode(''.join(self.chunks).encode()).decode()
+        self.chunks = []
+        try:
+            out.write(f'\x1b]52;c;{payload}\x07')
+            out.flush()
+        except OSError:
+            pass
+        finally:
+            if out is not sys.stderr:
+                out.close()
+
+
+Backend = Callable[[Mapping[str, str]], Copy]
+
+
+@lru_cache
+def detect(spec: str, path: Optional[str]) -> Optional[Backend]:
+    """Resolve a backend ``spec`` (see module docstring), against ``path`` (the ``$PATH`` to find commands on)."""
+    if spec == NONE:
+        return None
+    if spec == OSC52:
+        return Osc52Copy
+    if spec == AUTO:
+        binary = next(( found for cmd in COPY_BINARIES if (found := which(cmd, path=path)) ), None)
+        if not binary:
+            return None
+        args = [ binary ]
+    else:
+        args = shlex.split(spec)
+        if not args or not (binary := which(args[0], path=path)):
+            return None
+        args = [ binary, *args[1:] ]
+    return partial(CommandCopy, args)
+
+
+def open_copy(spec: Optional[str] = None, environ: Optional[Mapping[str, str]] = None) -> Optional[Copy]:
+    """Start a copy with the backend for ``spec`` (default: ``$BMDF_CLIPBOARD``, else "auto"), or return ``None`` if it's
+    ``none``, or unavailable. Copy commands are found on, and run with, ``environ`` (default: ``os.environ``)."""
+    if environ is None:
+        environ = os.environ
+    spec = spec or environ.get(BMDF_CLIPBOARD_VAR) or AUTO
+    backend = detect(spec, environ.get('PATH'))
+    return backend(environ) if backend else None
@@ -0,0 +1,278 @@
+"""Run a pipeline of commands, streaming its output line by line (so that memory use is independent of how much output
+there is)."""
+from __future__ import annotations
+
+import codecs
+import os
+import sys
+from dataclasses import dataclass
+from signal import SIGKILL
+from subprocess import DEVNULL, STDOUT, Popen
+from time import perf_counter
+from typing import IO, Iterator, Mapping, Optional, Union
+
+CHUNK_SIZE = 64 * 1024
+
+# `ru_maxrss` is in KiB on Linux, bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# A pipeline stage: a ``str`` is run by a shell, a ``list`` is exec'd directly
+Args = Union[str, list[str]]
+
+
+@dataclass
+class Usage:
+    """Exit code and resource usage of a command (including any descendants it waited for)."""
+    exit_code: Optional[int] = None
+    user: float = 0.
+    sys: float = 0.
+    max_rss: int = 0  # bytes
+    in_blocks: int = 0
+    out_blocks: int = 0
+
+    def add(self, rusage: os.struct_rusage) -> Usage:
+        """Add a (reaped) process' ``rusage``: CPU times and block I/O counts are summed, max RSS is the max of the
+        processes'."""
+        self.user += rusage.ru_utime
+        self.sys += rusage.ru_stime
+        self.max_rss = max(self.max_rss, rusage.ru_maxrss * MAXRSS_UNIT)
+        self.in_blocks += rusage.ru_inblock
+        self.out_blocks += rusage.ru_oublock
+        return self
+
+    def merge(self, other: Usage) -> Usage:
+        """Add another command's usage (as in :meth:`add`); the exit code is unchanged."""
+        self.user += other.user
+        self.sys += other.sys
+        self.max_rss = max(self.max_rss, other.max_rss)
+        self.in_blocks += other.in_blocks
+        self.out_blocks += other.out_blocks
+        return self
+
+
+class Cancelled(Exception):
+    """Raised when starting a :class:`Pipeline` whose :class:`Cancel` has been triggered."""
+
+
+class Cancel:
+    """Let another thread kill the pipelines that a (threaded) caller runs, and stop it from starting more.
+
+    Pipelines created with a ``Cancel`` run each command in its own session (and process group), so that everything a
+    command started is signaled along with it.
+    """
+    def __init__(self):
+        self.cancelled = False
+        self.pipelines: set[Pipeline] = set()
+
+    def add(self, pipeline: Pipeline):
+        self.pipelines.add(pipeline)
+        # Checked after each command is spawned; `cancel` sets the flag before signaling, so any command is either
+        # signaled by it, or killed here
+        if self.cancelled:
+            raise Cancelled
+
+    def discard(self, pipeline: Pipeline):
+        self.pipelines.discard(pipeline)
+
+    def cancel(self, sig: int):
+        """Send ``sig`` to the process groups of every command in running pipelines; pipelines started later raise
+        :class:`Cancelled`."""
+        self.cancelled = True
+        for pipeline in list(self.pipelines):
+            pipeline.signal(sig)
+
+
+class LineDecoder:
+    """Decode a stream's bytes incrementally (as UTF-8, replacing invalid sequences), splitting them into lines (without
+    their ``\\n``s)."""
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        # Pieces of the current (incomplete) line
+        self.pending: list[str] = []
+
+    def feed(self, chunk: bytes) -> list[str]:
+        """Decode ``chunk``, returning the lines it completes."""
+        *lines, last = self.decoder.decode(chunk).split('\n')
+        if lines:
+            lines[0] = ''.join([ *self.pending, lines[0] ])
+            self.pending = []
+        if last:
+            self.pending.append(last)
+        return lines
+
+    def finish(self) -> list[str]:
+        """The final, unterminated line (if any), at EOF."""
+        last = ''.join([ *self.pending, self.decoder.decode(b'', final=True) ])
+        self.pending = []
+        return [ last ] if last else []
+
+
+def iter_line_batches(fd: IO[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[list[str]]:
+    """Yield the lines (see :class:`LineDecoder`) completed by each chunk read from ``fd``; a final, unterminated line is
+    yielded at EOF.
+
+    Reads return as soon as any bytes are available, so lines are yielded as the writer produces them.
+    """
+    decoder = LineDecoder()
+    while chunk := fd.read1(chunk_size):
+        if lines := decoder.feed(chunk):
+            yield lines
+    if lines := decoder.finish():
+        yield lines
+
+
+class Pipeline:
+    """Run ``stages`` connected stdout-to-stdin by OS pipes, reading the last one's stdout via :meth:`line_batches`.
+
+    With ``both``, each stage's stderr is redirected to its stdout (like ``2>&1``), so that the OS interleaves the two
+    streams' lines in the order they're written; otherwise, stderr is discarded.
+
+    A ``str`` stage is run by a shell (``executable``, or ``/bin/sh``); pass a single ``str`` containing ``|``s to have
+    one shell run a whole pipeline (in which case only the shell's exit status is known).
+
+    Commands are reaped with ``wait4``, recording each one's resource usage (see :attr:`usages`, and :attr:`usage` for
+    the whole pipeline), and the pipeline's wall time (from spawning the first command to reaping the last).
+
+    The first command reads from ``stdin`` (a file descriptor, or e.g. ``DEVNULL``; default: inherited).
+
+    Use as a context manager: on exit, all commands are waited for (or killed, if exiting due to an exception). With
+    ``cancel``, each command runs in its own process group, which is killed instead (see :class:`Cancel`).
+    """
+    def __init__(
+        self,
+        stages: list[Args],
+        both: bool = False,
+        env: Optional[Mapping[str, str]] = None,
+        cwd: Optional[str] = None,
+        executable: Optional[str] = None,
+        cancel: Optional[Cancel] = None,
+        stdin: Optional[int] = None,
+    ):
+        if not stages:
+            raise ValueError('Empty pipeline')
+        self.cancel = cancel
+        self.start = perf_counter()
+        self.wall: Optional[float] = None
+        self.procs: list[Popen] = []
+        self.usages: list[Usage] = []
+        out_r, out_w = os.pipe()
+        self.out: Optional[IO[bytes]] = open(out_r, 'rb')
+        try:
+            for idx, args in enumerate(stages):
+                if idx + 1 < len(stages):
+                    next_stdin, stdout = os.pipe()
+                else:
+                    next_stdin, stdout = None, out_w
+                try:
+                    shell = isinstance(args, str)
+                    self.procs.append(Popen(
+                        args,
+                        stdin=stdin,
+                        stdout=stdout,
+                        stderr=STDOUT if both else DEVNULL,
+                        shell=shell,
+                        executable=executable if shell else None,
+                        env=env,
+                        cwd=cwd,
+                        start_new_session=cancel is not None,
+                    ))
+                    if cancel:
+                        cancel.add(self)
+                except BaseException:
+                    if next_stdin is not None:
+                        os.close(next_stdin)
+                    raise
+                finally:
+                    # The commands hold their own copies of the pipes' ends (the first one's `stdin` is the caller's)
+                    if idx:
+                        os.close(stdin)
+                    if stdout != out_w:
+                        os.close(stdout)
+                stdin = next_stdin
+        except BaseException:
+            self.close()
+            self.kill()
+            if cancel:
+                cancel.discard(self)
+            raise
+        finally:
+            os.close(out_w)
+
+    def line_batches(self) -> Iterator[list[str]]:
+        """Yield batches of output lines as they arrive, until the output reaches EOF."""
+        try:
+            yield from iter_line_batches(self.out)
+        finally:
+            self.close()
+
+    @property
+    def returncodes(self) -> list[Optional[int]]:
+        """Each stage's exit status (``None`` while it's running)."""
+        return [ proc.returncode for proc in self.procs ]
+
+    @property
+    def usage(self) -> Usage:
+        """Resource usage of the whole pipeline (exit status of the last command)."""
+        usage = Usage(exit_code=self.procs[-1].returncode)
+        for stage in self.usages:
+            usage.merge(stage)
+        return usage
+
+    def wait(self) -> int:
+        """Wait for all commands to exit, returning the last one's exit status."""
+        self.close()
+        if self.wall is None:
+            self.usages = [ self.reap(proc) for proc in self.procs ]
+            self.wall = perf_counter() - self.start
+        return self.procs[-1].returncode
+
+    @staticmethod
+    def reap(proc: Popen) -> Usage:
+        if proc.returncode is None:
+            try:
+                _, status, rusage = os.wait4(proc.pid, 0)
+            except ChildProcessError:
+                # Already reaped (e.g. by `Popen.poll`)
+                proc.wait()
+            else:
+                # Let `Popen` know the process has been reaped
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                return Usage(exit_code=proc.returncode).add(rusage)
+        return Usage(exit_code=proc.returncode)
+
+    def close(self):
+        """Close the read end of the output pipe (any command still writing to it gets ``SIGPIPE``)."""
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+
+    def signal(self, sig: int):
+        """Send ``sig`` to each running command, or, if they have their own process groups (see :class:`Cancel`), to
+        those (which may outlive the commands themselves)."""
+        for proc in self.procs:
+            if self.cancel:
+                try:
+                    os.killpg(proc.pid, sig)
+                except ProcessLookupError:
+                    pass
+            elif proc.returncode is None:
+                proc.send_signal(sig)
+
+    def kill(self):
+        self.signal(SIGKILL)
+        for proc in self.procs:
+            proc.wait()
+
+    def __enter__(self) -> Pipeline:
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type:
+                self.close()
+                self.kill()
+            else:
+                self.wait()
+        finally:
+            if self.cancel:
+                self.cancel.discard(self)
@@ -1,16 +1,28 @@
 import re
+import sys
+from collections import deque
 from contextlib import contextmanager
-from typing import Callable
+from functools import partial
+from typing import Callable, Iterable, Iterator, Mapping, Optional, TYPE_CHECKING
 
 from click import option
-from utz import check, err, esc, process
+
+# Re-exported: `strip_ansi` was defined here, before `bmdf.ansi`
+from bmdf.ansi import strip_ansi  # noqa: F401
+
+if TYPE_CHECKING:
+    from bmdf.pipeline import Usage
+
+# `utz` is imported lazily (by the functions below that use it): importing any of it loads all of it, which would
+# dominate the startup time of every console script
+err = partial(print, file=sys.stderr)
 
 Log = Callable[..., None]
 
 
 def quote(arg: str) -> str:
     if ' ' in arg:
-        return '"%s"' % esc(arg, '"')
+        return '"%s"' % arg.replace('\\', '\\\\').replace('"', '\\"')
     else:
         return arg
 
@@ -22,6 +34,13 @@ def fence(typ: str = None, log: Log = print):
     log('```')
 
 
+@contextmanager
+def pre(log: Log = print):
+    log('<pre>')
+    yield
+    log('</pre>')
+
+
 @contextmanager
 def details(summary: str = None, code: str = None, log: Log = print):
     if summary:
@@ -35,7 +54,36 @@ def details(summary: str = None, code: str = None, log: Log = print):
     log('</details>')
 
 
+def fmt_stats(wall: float, usage: 'Usage') -> str:
+    """One line summarizing a command's wall time and resource usage."""
+    return (
+        f'real {wall:.2f}s, user {usage.user:.2f}s, sys {usage.sys:.2f}s, '
+        f'max RSS {usage.max_rss / 2**20:.1f}MiB, '
+        f'block I/O {usage.in_blocks} in / {usage.out_blocks} out'
+    )
+
+
+def fmt_duration(secs: float) -> str:
+    if secs >= 1:
+        return f'{secs:.3f}s'
+    if secs >= 1e-3:
+        return f'{secs * 1e3:.1f}ms'
+    return f'{secs * 1e6:.0f}µs'
+
+
+def fmt_timings(times: list[float]) -> str:
+    """One line summarizing repeated runs' wall times (mean ± standard deviation, and range)."""
+    from statistics import mean, stdev
+    avg = mean(times)
+    dev = stdev(times) if len(times) > 1 else 0.
+    return (
+        f'{len(times)} runs: {fmt_duration(avg)} ± {fmt_duration(dev)} '
+        f'(min {fmt_duration(min(times))}, max {fmt_duration(max(times))})'
+    )
+
+
 COPY_BINARIES = [ 'pbcopy', 'xclip', 'clip', ]
+BMDF_CLIPBOARD_VAR = 'BMDF_CLIPBOARD'
 
 
 amend_opt = option('-a', '--amend', is_flag=True, help="Squash changes onto the previous Git commit; suitable for use with `git rebase -x`")
@@ -45,12 +93,14 @@ no_cwd_tmpdir_opt = option('-T', '--no-cwd-tmpdir', is_flag=True, help="In in-pl
 
 def amend_check(amend: bool):
     if amend:
+        from utz import check
         if not check('git', 'diff', '--quiet', 'HEAD'):
             raise RuntimeError("Require clean Git worktree for `-a/--amend`")
 
 
 def amend_run(amend: bool) -> None:
     if amend:
+        from utz import check, process
         if not check('git', 'diff', '--quiet', 'HEAD'):
             err("Squashing changes onto HEAD")
             process.run('git', 'commit', '-a', '--amend', '--no-edit')
@@ -58,5 +108,54 @@ def amend_run(amend: bool) -> None:
             err("No changes found")
 
 
-def strip_ansi(text):
-    return re.sub(r'\x1b\[[^m]*m|\x1b\[\d*[ABCDEFGJKST]', '', text)
+VAR_RGX = re.compile(r'\$(\w+|\{[^}]*\})', re.ASCII)
+
+
+def expandvars(text: str, environ: Mapping[str, str]) -> str:
+    """Like ``os.path.expandvars``, but expand against ``environ`` (instead of ``os.environ``)."""
+    def repl(m: re.Match) -> str:
+        name = m[1]
+        if name.startswith('{') and name.endswith('}'):
+            name = name[1:-1]
+        return environ.get(name, m[0])
+    return VAR_RGX.sub(repl, text)
+
+
+BMDF_OMITTED_FMT_VAR = 'BMDF_OMITTED_FMT'
+OMITTED_FMT = '… %d lines omitted …'
+
+
+def truncate(
+    batches: Iterable[list[str]],
+    head: Optional[int] = None,
+    tail: Optional[int] = None,
+    omitted_fmt: str = OMITTED_FMT,
+) -> Iterator[list[str]]:
+    """Pass through the first ``head`` and last ``tail`` lines of ``batches`` (if either is set), replacing the lines
+    between them with one formatted from ``omitted_fmt`` (a "%d" placeholder receives the number of lines omitted).
+
+    Head lines are passed through as they arrive; the rest are drained, keeping only the last ``tail`` in a ring buffer,
+    so memory use doesn't depend on the number of lines.
+    """
+    if head is None and tail is None:
+        yield from batches
+        return
+    remaining = head or 0
+    ring = deque(maxlen=tail or 0)
+    num_rest = 0
+    for lines in batches:
+        if remaining:
+            if head_lines := lines[:remaining]:
+                yield head_lines
+            remaining -= len(head_lines)
+            lines = lines[len(head_lines):]
+        num_rest += len(lines)
+        if tail:
+            ring.extend(lines[-tail:])
+    if num_omitted := num_rest - len(ring):
+        try:
+            yield [ omitted_fmt % num_omitted ]
+        except TypeError:
+            yield [ omitted_fmt ]
+    if ring:
+        yield list(ring)
@@ -0,0 +1,205 @@
+"""Index the ``<!-- `cmd` -->`` command blocks in a Markdown document.
+
+A command block is a "marker" line (``<!-- `cmd` -->``), the previous output of ``cmd`` ("content"), and the line that
+closes it ("close"). The form of the block is determined by the line after the marker:
+
+- an HTML tag (e.g. ``<details>``): the close is the matching ``</tag>`` line;
+- a code fence (```` ``` ````): the close is the next ```` ``` ```` line (for ``bmdff`` blocks, which contain two
+  fences, the second fence's closing line);
+- a list item (``- ``): the content is the list's items (and continuation lines); the close is the line following
+  them (normally blank);
+- a blank line: the content is empty, and the close is the blank line;
+- the end of the document: the content and close are empty.
+
+List, blank and empty blocks are "open": a blank line is re-emitted after their new content.
+
+:func:`index_blocks` finds each marker with one regex search, and each close by searching for the closing line (or
+matching the run of list lines), so that documents are indexed in time linear in their size. It accepts ``str``s or
+``bytes``; spans' offsets are in the same units (bytes, for ``bytes``). :func:`skip_block` applies the same rules to a
+stream of lines.
+"""
+from __future__ import annotations
+
+import re
+import shlex
+from functools import lru_cache
+from typing import Callable, Iterator, NamedTuple, Optional, Union
+
+CMD_LINE_RGX = re.compile(r'<!-- `(?P<cmd>.+)`(?P<opts>(?: +\w+=\S+)*) -->')
+# `CMD_LINE_RGX`, matched at the start of any line of a multi-line string
+CMD_MARKER_RGX = re.compile(r'^' + CMD_LINE_RGX.pattern, re.M)
+CMD_MARKER_BYTES_RGX = re.compile(CMD_MARKER_RGX.pattern.encode(), re.M)
+HTML_OPEN_RGX = re.compile(r'<(?P<tag>\w+)(?: +\w+(?:="[^"]*")?)* *>.*')
+LIST_CONTINUATION_RGX = re.compile(r'^ {2,}')
+# The start of a line that isn't a list item / continuation line (which ends a list)
+LIST_END_RGX = re.compile(r'^(?!- |  )', re.M)
+LIST_END_BYTES_RGX = re.compile(LIST_END_RGX.pattern.encode(), re.M)
+
+# Block forms (see module docstring)
+HTML = 'html'
+FENCE = 'fence'
+LIST = 'list'
+BLANK = 'blank'
+EMPTY = 'empty'
+OPEN_KINDS = (LIST, BLANK, EMPTY)
+
+Text = Union[str, bytes]
+Select = Callable[[str], bool]
+
+
+class Span(NamedTuple):
+    """A run of whole lines: ``[start, end)`` offsets (past the last line's newline, if any), and ``[line, end_line)``
+    (1-based) line numbers. Empty spans have ``start == end`` and ``line == end_line``."""
+    start: int
+    end: int
+    line: int
+    end_line: int
+
+
+class BlockSpans(NamedTuple):
+    """A command block's marker line, content and close (see module docstring).
+
+    ``opts_str`` is the (unparsed) ``key=value`` options following the command, if any.
+    """
+    cmd_str: str
+    opts_str: str
+    kind: str
+    marker: Span
+    content: Span
+    close: Span
+
+    @property
+    def trailing_blank(self) -> bool:
+        """Whether a blank line should be re-emitted after the block's new content."""
+        return self.kind in OPEN_KINDS
+
+    @property
+    def old(self) -> Span:
+        """The block's old contents (content and close), which are replaced by the command's output."""
+        return Span(self.content.start, self.close.end, self.content.line, self.close.end_line)
+
+
+@lru_cache
+def close_rgx(close: str, is_bytes: bool = False) -> re.Pattern:
+    """Match a whole line that is ``close`` (a regex): anywhere in a multi-line text (``.search``), or as a line
+    (``.match``)."""
+    pattern = rf'^(?:{close})\r?$'
+    return re.compile(pattern.encode() if is_bytes else pattern, re.M)
+
+
+def open_block(cmd_str: str, line: str) -> tuple[str, tuple[str, ...]]:
+    """Classify a block by the ``line`` following its ``<!-- `cmd` -->`` marker.
+
+    Returns the block's kind, and the regexes of the lines that close it (matched in order, each on a later line than
+    the previous); open blocks have none. Raises ``ValueError`` if ``line`` doesn't start a block.
+    """
+    if html_match := HTML_OPEN_RGX.fullmatch(line):
+        return HTML, (f'</{html_match["tag"]}>',)
+    elif line.startswith('```'):
+        if cmd_str.split(maxsplit=1)[:1] == ['bmdff']:
+            # Skip two fences: the command's, and its output's
+            return FENCE, ('```', r'```\w*', '```')
+        return FENCE, ('```',)
+    elif line.startswith('- '):
+        return LIST, ()
+    elif not line:
+        return BLANK, ()
+    else:
+        raise ValueError(f'Unexpected block start line under cmd {shlex.split(cmd_str)}: {line}')
+
+
+def unclosed(cmd_str: str, line: int, close: str) -> ValueError:
+    return ValueError(f'Unclosed block under cmd {shlex.split(cmd_str)} (line {line}): expected a line matching {close!r}')
+
+
+def index_blocks(text: Text, select: Optional[Select] = None) -> Iterator[BlockSpans]:
+    """Yield the spans of each (selected) command block in ``text``.
+
+    Markers whose command isn't selected (``select(cmd_str)`` is falsy) are skipped, and the lines after them are
+    treated as static text.
+    """
+    is_bytes = not isinstance(text, str)
+    nl = b'\n' if is_bytes else '\n'
+    marker_rgx = CMD_MARKER_BYTES_RGX if is_bytes else CMD_MARKER_RGX
+    list_end_rgx = LIST_END_BYTES_RGX if is_bytes else LIST_END_RGX
+    decode = (lambda s: s.decode()) if is_bytes else (lambda s: s)
+    n = len(text)
+    # `line` is the number of the line starting at `line_pos`; both only move forward, so that counting lines is linear
+    line, line_pos = 1, 0
+
+    def line_no(pos: int) -> int:
+        nonlocal line, line_pos
+        line += text.count(nl, line_pos, pos)
+        line_pos = pos
+        return line
+
+    def line_end(pos: int) -> int:
+        """The offset past the newline ending the line at ``pos`` (or the end of ``text``)."""
+        end = text.find(nl, pos)
+        return n if end < 0 else end + 1
+
+    def span(start: int, end: int) -> Span:
+        return Span(start, end, line_no(start), line_no(end))
+
+    pos = 0
+    while m := marker_rgx.search(text, pos):
+        marker_end = line_end(m.end())
+        pos = marker_end
+        cmd_str = decode(m['cmd'])
+        if select and not select(cmd_str):
+            continue
+        marker = span(m.start(), marker_end)
+        start = marker_end
+        if start >= n:
+            kind, content, close = EMPTY, span(n, n), span(n, n)
+        else:
+            first_end = line_end(start)
+            first = decode(text[start:first_end].rstrip(nl))
+            kind, closes = open_block(cmd_str, first)
+            if kind == LIST:
+                end = list_end.start() if (list_end := list_end_rgx.search(text, first_end)) else n
+                content = span(start, end)
+                # The line that ended the list (if any) closes the block
+                close = span(end, line_end(end) if end < n else n)
+            elif kind == BLANK:
+                content = span(start, start)
+                close = span(start, first_end)
+            else:
+                end = first_end
+                for close_pattern in closes:
+                    if not (close_match := close_rgx(close_pattern, is_bytes).search(text, end)):
+                        raise unclosed(cmd_str, marker.line, close_pattern)
+                    close_start = close_match.start()
+                    end = line_end(close_match.end())
+                content = span(start, close_start)
+                close = span(close_start, end)
+        pos = close.end
+        yield BlockSpans(cmd_str, decode(m['opts']), kind, marker, content, close)
+
+
+def skip_block(cmd_str: str, lines: Iterator[str], line: int = 0) -> bool:
+    """Consume the old contents of a command block from ``lines`` (which starts just after the ``<!-- `cmd` -->`` line,
+    numbered ``line``), following the same rules as :func:`index_blocks`.
+
+    Returns whether the block is open (see :attr:`BlockSpans.trailing_blank`).
+    """
+    try:
+        cur = next(lines)
+    except StopIteration:
+        return True
+    kind, closes = open_block(cmd_str, cur)
+    if kind == LIST:
+        while cur and (cur.startswith('- ') or LIST_CONTINUATION_RGX.match(cur)):
+            try:
+                cur = next(lines)
+            except StopIteration:
+                break
+    for close in closes:
+        rgx = close_rgx(close)
+        try:
+            cur = next(lines)
+            while not rgx.match(cur):
+                cur = next(lines)
+        except StopIteration:
+            raise unclosed(cmd_str, line, close)
+    return not closes
@@ -0,0 +1,142 @@
+"""Commands that ``mdcmd`` can run in-process, instead of spawning a subprocess."""
+from __future__ import annotations
+
+import asyncio
+from functools import partial
+from io import StringIO
+from signal import SIGKILL, SIGTERM
+from subprocess import DEVNULL
+from typing import Awaitable, Callable, Optional
+
+from click import Command, Context
+from click.exceptions import ClickException, Exit
+
+from bmdf.pipeline import Usage
+from mdcmd.parse import STDIN
+
+
+class Fallback(Exception):
+    """Raised by a builtin that can't handle its args in-process; the command is run as a subprocess instead."""
+
+
+class Doc:
+    """The Markdown document a block belongs to.
+
+    Its text is set by the parser once it's been fully read (e.g. at EOF, when streaming stdin); files whose text wasn't
+    set are read on demand.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._text: Optional[asyncio.Future] = None
+
+    def _future(self) -> asyncio.Future:
+        if self._text is None:
+            self._text = asyncio.get_running_loop().create_future()
+        return self._text
+
+    def set_text(self, text: str):
+        self._future().set_result(text)
+
+    async def text(self) -> str:
+        future = self._future()
+        if not future.done() and self.path != STDIN:
+            with open(self.path, 'r') as f:
+                future.set_result(f.read())
+        return await asyncio.shield(future)
+
+
+# Builtins are passed the command's args, base env, document, and a `Usage` to populate with the exit code and resource
+# usage of any command they run (which is left unset otherwise)
+Builtin = Callable[[list[str], dict, Doc, Usage], Awaitable[str]]
+
+
+def make_context(cmd: Command, name: str, args: list[str]) -> Context:
+    """Parse ``args`` for a Click command, deferring anything that would print or exit (e.g. ``--help``, usage errors)
+    to a real subprocess."""
+    if '--help' in args[:args.index('--') if '--' in args else len(args)]:
+        raise Fallback
+    try:
+        return cmd.make_context(name, list(args))
+    except (ClickException, Exit) as e:
+        raise Fallback from e
+
+
+async def toc(args: list[str], env: dict, doc: Doc, usage: Usage) -> str:
+    """``toc``, reading the document's already-loaded text instead of re-reading ``$MDCMD_FILE``."""
+    from toc import format_toc, generate_toc, main
+    from toc.index import HeadingIndex, TOC_INDEX_VAR
+
+    ctx = make_context(main, 'toc', args)
+    indent_size = ctx.params['indent_size']
+    auto_ids = ctx.params['auto_ids']
+    if tree := ctx.params['tree']:
+        if ctx.params['check_links'] or ctx.params['path']:
+            # Exits non-zero (or errors)
+            raise Fallback
+        from toc.tree import format_tree, scan_tree
+        files = await asyncio.to_thread(scan_tree, tree, ctx.params['procs'])
+        return format_tree(files, indent_size=indent_size, auto_ids=auto_ids) + '\n'
+    index = ctx.params['index']
+    if index is None:
+        index = bool(env.get(TOC_INDEX_VAR))
+    if index and (path := ctx.params['path'] or (doc.path if doc.path != STDIN else None)):
+        headings = await asyncio.to_thread(HeadingIndex().headings, path)
+        return format_toc(headings, indent_size=indent_size, auto_ids=auto_ids) + '\n'
+    if path := ctx.params['path']:
+        with open(path, 'r') as f:
+            text = f.read()
+    else:
+        text = await doc.text()
+    return generate_toc(text, indent_size=indent_size, auto_ids=auto_ids) + '\n'
+
+
+async def bmd(flags: tuple[str, ...], args: list[str], env: dict, doc: Doc, usage: Usage) -> str:
+    """``bmd`` (and ``bmdf``, etc.), run in a worker thread, with ``env`` as the wrapped command's base environment, and
+its exit code and resource usage recorded in ``usage``.
+
+    The wrapped command's stdin is inherited, unless the document is read from stdin (which, like a subprocess', it
+    mustn't compete with the parser for).
+
+    If cancelled (e.g. on timeout, or by ``-F/--fail-fast``), the wrapped command's process group is SIGTERM'd (then
+    SIGKILL'd, if the thread hasn't finished after :data:`KILL_GRACE` seconds), and the thread is waited for.
+    """
+    from bmdf.cli import bmd as bmd_cmd
+    from bmdf.pipeline import Cancel
+    from mdcmd.subproc import KILL_GRACE
+
+    ctx = make_context(bmd_cmd, 'bmd', [ *flags, *args ])
+    out = StringIO()
+    cancel = Cancel()
+    stdin = DEVNULL if doc.path == STDIN else None
+    thread = asyncio.ensure_future(asyncio.to_thread(
+        bmd_cmd.callback, **ctx.params, file=out, environ=env, cancel=cancel, stdin=stdin, usage=usage,
+    ))
+
+    async def stop():
+        cancel.cancel(SIGTERM)
+        done, _ = await asyncio.wait([thread], timeout=KILL_GRACE)
+        if not done:
+            cancel.cancel(SIGKILL)
+            await asyncio.wait([thread])
+        if not thread.cancelled():
+            # Mark any error as retrieved; the cancellation is what's propagated
+            thread.exception()
+
+    try:
+        await asyncio.shield(thread)
+    except asyncio.CancelledError:
+        await asyncio.shield(stop())
+        raise
+    return out.getvalue()
+
+
+# `bmd` and its aliases
+BMD_CMDS = {'bmd', 'bmdf', 'bmdff', 'bmdfff'}
+
+BUILTINS: dict[str, Builtin] = {
+    'toc': toc,
+    'bmd': partial(bmd, ()),
+    'bmdf': partial(bmd, ('-f',)),
+    'bmdff': partial(bmd, ('-ff',)),
+    'bmdfff': partial(bmd, ('-fff',)),
+}
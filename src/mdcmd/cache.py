@@ -0,0 +1,179 @@
+"""Content-addressed, size-capped on-disk cache of ``mdcmd`` block outputs."""
+from __future__ import annotations
+
+import json
+import re
+from glob import glob
+from hashlib import sha256
+from os import environ as env, getcwd, listdir, makedirs, remove, replace, stat, utime
+from os.path import abspath, exists, expanduser, isdir, join
+from tempfile import NamedTemporaryFile
+from typing import Iterable, Optional, Union
+
+MDCMD_CACHE_VAR = 'MDCMD_CACHE'
+MDCMD_CACHE_DIR_VAR = 'MDCMD_CACHE_DIR'
+MDCMD_CACHE_ENV_VAR = 'MDCMD_CACHE_ENV'
+MDCMD_CACHE_MAX_SIZE_VAR = 'MDCMD_CACHE_MAX_SIZE'
+
+DEFAULT_MAX_SIZE = 64 * 2 ** 20
+
+# Commands whose output depends on the contents of ``$MDCMD_FILE`` itself (not just its path)
+FILE_DEPENDENT_CMDS = { 'toc' }
+# An arg that runs (or may run) one of them, e.g. `bmdf toc`, `sh -c 'toc -n 2'`, or refers to `$MDCMD_FILE`
+FILE_DEPENDENT_ARG_RGX = re.compile(r'\b(?:%s)\b|MDCMD_FILE' % '|'.join(FILE_DEPENDENT_CMDS))
+
+
+def file_dependent(cmd: Union[str, list[str]]) -> bool:
+    """Whether ``cmd``'s output may depend on the file it's in: conservatively, if any arg mentions a
+    :data:`FILE_DEPENDENT_CMDS` command, or ``MDCMD_FILE``. Scripts that read ``$MDCMD_FILE`` without mentioning it in
+    their args can't be detected."""
+    args = [ cmd ] if isinstance(cmd, str) else cmd
+    return any( FILE_DEPENDENT_ARG_RGX.search(arg) for arg in args )
+
+EXPORT_VERSION = 1
+
+
+def default_dir() -> str:
+    if cache_dir := env.get(MDCMD_CACHE_DIR_VAR):
+        return cache_dir
+    xdg = env.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    return join(xdg, 'mdcmd')
+
+
+def hash_file(path: str) -> str:
+    h = sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Cache:
+    """Map block keys (command, ``$MDCMD_FILE``, selected env vars, input-file hashes) to command output.
+
+    Entries are stored one per file under ``<root>/<key[:2]>/<key>``; an entry's mtime is bumped on every hit, and the
+    least-recently-used entries are evicted whenever the total size exceeds ``max_size``.
+    """
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        env_vars: Iterable[str] = (),
+        inputs: Iterable[str] = (),
+        max_size: Optional[int] = None,
+    ):
+        self.root = root or default_dir()
+        if not env_vars and (env_vars_str := env.get(MDCMD_CACHE_ENV_VAR)):
+            env_vars = [ v for v in env_vars_str.split(',') if v ]
+        self.env_vars = sorted(set(env_vars))
+        if max_size is None:
+            max_size = int(env.get(MDCMD_CACHE_MAX_SIZE_VAR, DEFAULT_MAX_SIZE))
+        self.max_size = max_size
+        paths = sorted({
+            abspath(path)
+            for pattern in inputs
+            for path in (glob(pattern, recursive=True) or [pattern])
+        })
+        self.inputs = { path: hash_file(path) for path in paths if exists(path) }
+        self.hits = 0
+        self.misses = 0
+
+    def key(
+        self,
+        cmd: str | list[str],
+        path: str,
+        cmd_env: Optional[dict] = None,
+        opts: Optional[dict] = None,
+    ) -> str:
+        cmd_env = env if cmd_env is None else cmd_env
+        obj = dict(
+            cmd=cmd,
+            file=path,
+            cwd=getcwd(),
+            env={ k: cmd_env.get(k) for k in self.env_vars },
+            inputs=self.inputs,
+        )
+        if opts:
+            # Block options that affect the cached output (e.g. `head=`/`tail=`)
+            obj['opts'] = opts
+        if file_dependent(cmd) and exists(path):
+            obj['file_hash'] = hash_file(path)
+        return sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[str]:
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        utime(entry_path)
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str, mtime: Optional[float] = None):
+        entry_path = self.entry_path(key)
+        entry_dir = join(self.root, key[:2])
+        makedirs(entry_dir, exist_ok=True)
+        # Write to a sibling temp file and rename, so that concurrent readers never see partial entries
+        with NamedTemporaryFile('w', dir=entry_dir, delete=False, encoding='utf-8') as f:
+            f.write(text)
+        replace(f.name, entry_path)
+        if mtime is not None:
+            utime(entry_path, (mtime, mtime))
+
+    def entries(self) -> list[tuple[str, float, int]]:
+        """Return ``(key, mtime, size)`` for each entry, least-recently-used first."""
+        entries = []
+        if not isdir(self.root):
+            return entries
+        for prefix in listdir(self.root):
+            prefix_dir = join(self.root, prefix)
+            if len(prefix) != 2 or not isdir(prefix_dir):
+                continue
+            for key in listdir(prefix_dir):
+                if not key.startswith(prefix):
+                    continue
+                st = stat(join(prefix_dir, key))
+                entries.append((key, st.st_mtime, st.st_size))
+        return sorted(entries, key=lambda e: e[1])
+
+    def evict(self) -> int:
+        """Remove least-recently-used entries until the cache fits in ``max_size``; return the number removed."""
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        for key, _, size in entries:
+            if total <= self.max_size:
+                break
+            remove(self.entry_path(key))
+            total -= size
+            removed += 1
+        return removed
+
+    def export(self, path: str):
+        """Write all entries (and their LRU timestamps) to a single JSON file."""
+        entries = {}
+        for key, mtime, _ in self.entries():
+            with open(self.entry_path(key), 'r', encoding='utf-8') as f:
+                entries[key] = dict(mtime=mtime, text=f.read())
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(version=EXPORT_VERSION, entries=entries), f)
+        replace(tmp_path, path)
+
+    def import_(self, path: str) -> int:
+        """Load entries from a file written by :meth:`export`; return the number of entries imported."""
+        with open(path, 'r', encoding='utf-8') as f:
+            obj = json.load(f)
+        version = obj.get('version')
+        if version != EXPORT_VERSION:
+            raise ValueError(f'Unsupported cache export version {version} in {path}')
+        entries = obj['entries']
+        for key, entry in entries.items():
+            self.put(key, entry['text'], mtime=entry['mtime'])
+        self.evict()
+        return len(entries)
@@ -1,169 +1,184 @@
 from __future__ import annotations
 
-import asyncio
-from asyncio import gather
 import re
-import shlex
-from collections.abc import Coroutine
+import sys
 from contextlib import contextmanager
-from functools import partial
-from os import environ as env, rename, getcwd
-from os.path import basename, exists, join
-from tempfile import TemporaryDirectory
-from typing import Any, Callable, Generator, Optional
+from glob import glob, has_magic
+from os import cpu_count, environ as env, getcwd
+from os.path import exists, isdir, join
+from typing import TYPE_CHECKING, Generator, Optional
 
-from click import command, option, argument
-from utz import err, Patterns, proc
-from utz.cli import inc_exc, multi
+from click import command, option, argument, UsageError
 
-from bmdf.utils import amend_opt, amend_check, amend_run, inplace_opt, no_cwd_tmpdir_opt
+from bmdf.utils import amend_opt, amend_check, amend_run, err, inplace_opt, no_cwd_tmpdir_opt
 
-CMD_LINE_RGX = re.compile(r'<!-- `(?P<cmd>.+)` -->')
-HTML_OPEN_RGX = re.compile(r'<(?P<tag>\w+)(?: +\w+(?:="[^"]*")?)* *>.*')
-Write = Callable[[str], None]
+if TYPE_CHECKING:
+    from mdcmd.parse import Select
+    from mdcmd.report import Report
+
+# The command-block engine (``asyncio``, subprocesses, etc.) lives in `mdcmd.engine`, and is only imported once `main`
+# runs, keeping `mdcmd --help` (and usage errors) fast
+
+# Names that used to be defined here, and are imported from their new modules on first access (see `__getattr__`)
+MOVED = {
+    'async_text': 'mdcmd.engine',
+    'out_fd': 'mdcmd.engine',
+    'process_path': 'mdcmd.engine',
+    'CMD_LINE_RGX': 'mdcmd.blocks',
+    'HTML_OPEN_RGX': 'mdcmd.blocks',
+}
 
 DEFAULT_FILE_ENV_VAR = 'MDCMD_DEFAULT_PATH'
 DEFAULT_FILE = 'README.md'
 
+MDCMD_PROCS_VAR = 'MDCMD_PROCS'
+MDCMD_JOBS_VAR = 'MDCMD_JOBS'
+MDCMD_NO_BUILTINS_VAR = 'MDCMD_NO_BUILTINS'
+MDCMD_TIMEOUT_VAR = 'MDCMD_TIMEOUT'
 
-async def async_text(cmd: str | list[str], env: dict | None = None) -> str:
-    text = await proc.aio.text(cmd, env=env)
-    return text.rstrip('\n')
 
+def __getattr__(name: str):
+    if module := MOVED.get(name):
+        from importlib import import_module
+        return getattr(import_module(module), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-async def async_line(arg: str) -> str:
-    return arg
 
-
-async def process_path(
-    path: str,
-    dry_run: bool,
-    patterns: Patterns,
-    write_fn: Write,
-    concurrent: bool = True,
-):
-    blocks: list[Coroutine[None, None, str]] = []
-    def write(arg: str | Coroutine[Any, Any, str]):
-        blocks.append(async_line(arg) if isinstance(arg, str) else arg)
-
-    with open(path, 'r') as fd:
-        lines = map(lambda line: line.rstrip('\n'), fd)
-        for line in lines:
-            write(line)
-            if not (m := CMD_LINE_RGX.match(line)):
-                continue
-
-            cmd_str = m.group('cmd')
-            if patterns and not patterns(cmd_str):
-                continue
-
-            if dry_run:
-                err(f"Would run: {cmd_str}")
-                continue
-
-            cmd = shlex.split(cmd_str)
-            # Set environment variable for the current markdown file
-            import os
-            cmd_env = os.environ.copy()
-            cmd_env['MDCMD_FILE'] = path
-
-            try:
-                line = next(lines)
-                if html_match := HTML_OPEN_RGX.fullmatch(line):
-                    tag = html_match['tag']
-                    close_lines = [f"</{tag}>"]
-                elif line.startswith("```"):
-                    if cmd[0] == "bmdff":
-                        close_lines = ["```", re.compile(r"```\w+"), "```"]  # Skip two fences
-                    else:
-                        close_lines = ["```"]
-                elif line.startswith("- "):
-                    # Markdown list block - skip all list items
-                    skip_lines = []
-                    while line and (line.startswith("- ") or re.match(r"^ {2,}", line)):
-                        skip_lines.append(line)
-                        try:
-                            line = next(lines)
-                        except StopIteration:
-                            break
-                    close_lines = None
-                elif not line:
-                    close_lines = None
-                else:
-                    raise ValueError(f'Unexpected block start line under cmd {cmd}: {line}')
-            except StopIteration:
-                close_lines = None
-
-            while close_lines:
-                close, *close_lines = close_lines
-                line = next(lines)
-                while close.fullmatch(line) if isinstance(close, re.Pattern) else line != close:
-                    line = next(lines)
-
-            write(async_text(cmd, env=cmd_env))
-            if close_lines is None:
-                write("")
-
-    if concurrent:
-        gathered = await gather(*blocks)
-        for line in gathered:
-            write_fn(line)
-    else:
-        for block in blocks:
-            line = await block
-            write_fn(line)
+def mk_patterns(includes: tuple[str, ...], excludes: tuple[str, ...]) -> Optional[Select]:
+    """Predicate selecting the commands to execute, from ``-x/--execute`` or ``-X/--exclude`` regexs (each of which may
+    be a comma-delimited list); ``None`` if neither was passed."""
+    includes = [ pat for pats in includes for pat in pats.split(',') ]
+    excludes = [ pat for pats in excludes for pat in pats.split(',') ]
+    if includes and excludes:
+        raise UsageError('Pass -x/--execute xor -X/--exclude')
+    rgxs = [ re.compile(pat) for pat in includes or excludes ]
+    if not rgxs:
+        return None
+    include = bool(includes)
+    return lambda cmd_str: any(rgx.search(cmd_str) for rgx in rgxs) == include
 
 
 @contextmanager
-def out_fd(
-    inplace: bool,
-    path: str,
-    out_path: Optional[str],
-    dir: Optional[str] = None,
-) -> Generator[Write, None, None]:
-    if inplace:
-        if out_path:
-            raise ValueError('Cannot specify both --inplace and an output path')
-        with TemporaryDirectory(dir=dir) as tmpdir:
-            tmp_path = join(tmpdir, basename(path))
-            with open(tmp_path, 'w') as f:
-                yield partial(print, file=f)
-            rename(tmp_path, path)
-    else:
-        if not out_path or out_path == '-':
-            yield print
+def reporting(path: Optional[str]) -> Generator[Optional[Report], None, None]:
+    """Collect a :class:`Report` (if ``path`` is set), writing it to ``path`` (and a summary table to stderr) on exit,
+    even if a command failed."""
+    if not path:
+        yield None
+        return
+    from mdcmd.report import Report
+
+    report = Report()
+    try:
+        yield report
+    finally:
+        report.write(path)
+        err(report.table())
+
+
+def expand_paths(paths: tuple[str, ...]) -> list[str]:
+    """Expand directories (to the ``*.md`` files under them) and globs; de-duplicate, preserving order."""
+    expanded = []
+    for path in paths:
+        if isdir(path):
+            expanded += sorted(glob(join(path, '**', '*.md'), recursive=True))
+        elif has_magic(path):
+            expanded += sorted(glob(path, recursive=True))
         else:
-            with open(out_path, 'w') as f:
-                yield partial(print, file=f)
+            expanded.append(path)
+    return list(dict.fromkeys(expanded))
+
 
+def is_multi(paths: tuple[str, ...], inplace: Optional[bool]) -> bool:
+    """Whether ``paths`` are all inputs (processed in-place), as opposed to ``[PATH] [OUT_PATH]``."""
+    return (
+        len(paths) > 2
+        or (bool(inplace) and len(paths) > 1)
+        or any(isdir(path) or has_magic(path) for path in paths)
+    )
 
 @command('mdcmd')
 @amend_opt
+@option('-B', '--no-builtins', is_flag=True, help=f'Run `toc` and `bmd*` commands as subprocesses (by default, they are run in-process); falls back to ${MDCMD_NO_BUILTINS_VAR}')
+@option('--cache/--no-cache', is_flag=True, default=None, help='Reuse cached outputs of commands whose inputs haven\'t changed; falls back to $MDCMD_CACHE')
+@option('--cache-dir', help='Cache directory (default: $MDCMD_CACHE_DIR, or $XDG_CACHE_HOME/mdcmd)')
+@option('--cache-env', 'cache_env_vars', multiple=True, help='Env var names whose values are part of each cache key (default: comma-separated $MDCMD_CACHE_ENV)')
+@option('--cache-export', help='After running, write the cache to this file (implies --cache)')
+@option('--cache-import', help='Before running, load cache entries from this file (implies --cache)')
+@option('--cache-input', 'cache_inputs', multiple=True, help='Files (or globs) whose contents are part of each cache key')
+@option('--cache-max-size', type=int, help='Evict least-recently-used cache entries beyond this many bytes (default: $MDCMD_CACHE_MAX_SIZE, or 64MiB)')
+@option('-c', '--check', is_flag=True, help="Don't write any files; print a unified diff of blocks whose output is out of date, and exit 1 if there are any")
 @option('-C', '--no-concurrent', is_flag=True, help='Run commands in sequence (by default, they are run concurrently)')
+@option('-d', '--diff', is_flag=True, help="Like -c/--check, but exit 0 even if blocks are out of date")
+@option('-F', '--fail-fast', is_flag=True, help="Cancel all running commands as soon as one fails (by default, the first failure is reported once the blocks before it have completed); with -c/--check or -d/--diff, also stop at the first out-of-date block")
+@option('-g', '--group', 'group_strs', multiple=True, help='<regex>=<limit>: run at most <limit> commands matching <regex> at a time, e.g. `-g "^cargo=1"` to serialize `cargo` commands')
 @inplace_opt
+@option('-j', '--jobs', type=int, help=f'Run at most this many commands at a time (default: ${MDCMD_JOBS_VAR}, or the number of CPUs)')
 @option('-n', '--dry-run', is_flag=True, help="Print the commands that would be run, but don't execute them")
+@option('-p', '--procs', type=int, help=f'In multi-file mode, process files across this many worker processes (default: ${MDCMD_PROCS_VAR}, or the number of CPUs)')
+@option('-r', '--report', 'report_path', help='Write per-block timing and resource usage (wall / queued / running time, child CPU time and max RSS, output size, exit code) to this JSON file, and print a summary table (slowest blocks first) to stderr')
+@option('-t', '--timeout', type=float, help=f'Kill commands (and their process groups) that run for longer than this many seconds (default: ${MDCMD_TIMEOUT_VAR}); a block\'s own `timeout=<seconds>` option takes precedence')
 @no_cwd_tmpdir_opt
-@inc_exc(
-    multi('-x', '--execute', help='Only execute commands that match these regular expressions'),
-    multi('-X', '--exclude', help="Only execute commands that don't match these regular expressions"),
-)
-@argument('path', required=False)
-@argument('out_path', required=False)
+@option('-x', '--execute', 'includes', multiple=True, help='Only execute commands that match these regular expressions')
+@option('-X', '--exclude', 'excludes', multiple=True, help="Only execute commands that don't match these regular expressions")
+@argument('paths', nargs=-1)
 def main(
     amend: bool,
+    no_builtins: bool,
+    cache: Optional[bool],
+    cache_dir: Optional[str],
+    cache_env_vars: tuple[str, ...],
+    cache_export: Optional[str],
+    cache_import: Optional[str],
+    cache_inputs: tuple[str, ...],
+    cache_max_size: Optional[int],
+    check: bool,
     no_concurrent: bool,
+    diff: bool,
+    fail_fast: bool,
+    group_strs: tuple[str, ...],
     inplace: Optional[bool],
+    jobs: Optional[int],
     dry_run: bool,
+    procs: Optional[int],
+    report_path: Optional[str],
+    timeout: Optional[float],
     no_cwd_tmpdir: bool,
-    patterns: Patterns,
-    path: str,
-    out_path: Optional[str],
+    includes: tuple[str, ...],
+    excludes: tuple[str, ...],
+    paths: tuple[str, ...],
 ):
     """Parse a Markdown file, updating blocks preceded by <!-- `[cmd...]` --> delimiters.
 
-    If no paths are provided, will look for a README.md, and operate "in-place" (same as ``mdcmd -i README.md``).
+    PATHS is ``[PATH] [OUT_PATH]``, by default; either may be ``-`` (stdin / stdout, e.g. ``mdcmd - -`` as a filter).
+    Output is written in document order, as soon as each preceding block completes. If no paths are provided, will look
+    for a README.md, and operate "in-place" (same as ``mdcmd -i README.md``).
+
+    If more than two PATHS are provided (or more than one, with ``-i``), or any is a directory or glob, all are treated as
+    inputs (directories are searched for ``*.md`` files), and are updated in-place, across a pool of worker processes.
+
+    With ``-c/--check`` (or ``-d/--diff``), no files are written; each block's new output is compared with its existing
+    contents, and a diff of out-of-date blocks is printed.
+
+    Each command runs in its own process group, which is killed if the command times out (``-t/--timeout``, or a block's
+    ``timeout=`` option) or is cancelled (e.g. by ``-F/--fail-fast``, or Ctrl-C).
     """
-    if not path:
+    import asyncio
+
+    from mdcmd.cache import Cache, MDCMD_CACHE_VAR
+    from mdcmd.engine import check_path, file_diff, out_fd, process_files, process_path
+    from mdcmd.sched import Group
+
+    patterns = mk_patterns(includes, excludes)
+    multi_file = is_multi(paths, inplace)
+    if multi_file:
+        if inplace is False:
+            raise UsageError('Multiple input paths are only supported in-place')
+        path, out_path = None, None
+    else:
+        path = paths[0] if paths else None
+        out_path = paths[1] if len(paths) > 1 else None
+
+    if not path and not multi_file:
         path = env.get(DEFAULT_FILE_ENV_VAR, DEFAULT_FILE)
         if not exists(path):
             raise ValueError(f'{path} not found')
@@ -172,20 +187,117 @@ def main(
 
     amend_check(amend)
 
+    builtins = not (no_builtins or env.get(MDCMD_NO_BUILTINS_VAR))
+
+    if jobs is None and (jobs_str := env.get(MDCMD_JOBS_VAR)):
+        jobs = int(jobs_str)
+    if timeout is None and (timeout_str := env.get(MDCMD_TIMEOUT_VAR)):
+        timeout = float(timeout_str)
+    try:
+        groups = tuple( Group.parse(group_str) for group_str in group_strs )
+    except ValueError as e:
+        raise UsageError(str(e))
+
+    if cache is None:
+        cache = bool(env.get(MDCMD_CACHE_VAR)) or bool(cache_export or cache_import)
+    block_cache = None
+    if cache:
+        block_cache = Cache(
+            root=cache_dir,
+            env_vars=cache_env_vars,
+            inputs=cache_inputs,
+            max_size=cache_max_size,
+        )
+        if cache_import:
+            block_cache.import_(cache_import)
+
     tmpdir = None if no_cwd_tmpdir else getcwd()
-    with out_fd(inplace, path, out_path, dir=tmpdir) as write:
-        asyncio.run(
-            process_path(
-                path=path,
+    check_mode = check or diff
+    failed = False
+    num_stale = 0
+    with reporting(report_path) as report:
+        if multi_file:
+            in_paths = expand_paths(paths)
+            if procs is None:
+                procs = int(env.get(MDCMD_PROCS_VAR) or cpu_count() or 1)
+            results = process_files(
+                in_paths,
                 dry_run=dry_run,
                 patterns=patterns,
-                write_fn=write,
                 concurrent=not no_concurrent,
+                cache=block_cache,
+                procs=procs,
+                tmpdir=tmpdir,
+                jobs=jobs,
+                groups=groups,
+                builtins=builtins,
+                timeout=timeout,
+                check=check_mode,
+                fail_fast=fail_fast,
+                report=report,
             )
-        )
+            failed = any(result.error for result in results)
+            for result in results:
+                if result.diff:
+                    print(result.diff)
+            num_stale = sum(result.stale for result in results)
+        elif check_mode:
+            _, stale = asyncio.run(
+                check_path(
+                    path=path,
+                    patterns=patterns,
+                    concurrent=not no_concurrent,
+                    fail_fast=fail_fast,
+                    cache=block_cache,
+                    jobs=jobs,
+                    groups=groups,
+                    builtins=builtins,
+                    timeout=timeout,
+                    report=report,
+                )
+            )
+            if stale:
+                print(file_diff(path, stale))
+            num_stale = len(stale)
+        else:
+            to_stdout = not inplace and (not out_path or out_path == '-')
+            with out_fd(inplace, path, out_path, dir=tmpdir) as write:
+                asyncio.run(
+                    process_path(
+                        path=path,
+                        dry_run=dry_run,
+                        patterns=patterns,
+                        write_fn=write,
+                        concurrent=not no_concurrent,
+                        cache=block_cache,
+                        jobs=jobs,
+                        groups=groups,
+                        flush_fn=sys.stdout.flush if to_stdout else None,
+                        fail_fast=fail_fast,
+                        builtins=builtins,
+                        timeout=timeout,
+                        report=report,
+                    )
+                )
+
+    if block_cache:
+        block_cache.evict()
+        if cache_export:
+            block_cache.export(cache_export)
+
+    if failed:
+        sys.exit(1)
+
+    if check_mode:
+        if num_stale:
+            err(f'{num_stale} block{"" if num_stale == 1 else "s"} out of date')
+            if check:
+                sys.exit(1)
+        return
 
     amend_run(amend)
 
 
 if __name__ == '__main__':
     main()
+
@@ -0,0 +1,187 @@
+"""Console-script entry points, which forward invocations to a running ``mdcmd-server`` (see :mod:`mdcmd.server`), or
+run them in-process if there isn't one.
+
+Forwarding avoids paying Python and ``utz`` / ``click`` import costs on every invocation, so this module only imports
+(cheap) stdlib modules; the command itself is only imported when running in-process.
+
+Invocations carry this process' env and stdio, so they're only forwarded to a server run by the same user (checked via
+``SO_PEERCRED``, where supported), on a socket in a directory that only that user can access (see :func:`private_dir`),
+and running the same Python and ``mdcmd`` version (checked by the server; see :func:`runtime`).
+"""
+from __future__ import annotations
+
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+from importlib import import_module
+from os.path import dirname, join
+from typing import Optional
+
+from mdcmd import __version__
+
+MDCMD_SERVER_SOCKET_VAR = 'MDCMD_SERVER_SOCKET'
+MDCMD_NO_SERVER_VAR = 'MDCMD_NO_SERVER'
+
+# Console scripts that can be forwarded: name -> (module, attribute)
+PROGS = {
+    'bmd': ('bmdf.cli', 'bmd'),
+    'bmdf': ('bmdf.cli', 'bmd_f'),
+    'bmdff': ('bmdf.cli', 'bmd_ff'),
+    'bmdfff': ('bmdf.cli', 'bmd_fff'),
+    'mdcmd': ('mdcmd.cli', 'main'),
+    'mktoc': ('toc.mktoc', 'main'),
+    'toc': ('toc', 'main'),
+}
+
+# Signals that are relayed to a forwarded invocation (e.g. Ctrl-C)
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT)
+
+
+def socket_path() -> str:
+    """``$MDCMD_SERVER_SOCKET``, or ``mdcmd.sock`` in ``$XDG_RUNTIME_DIR`` (or a per-user directory under ``$TMPDIR``)."""
+    if path := os.environ.get(MDCMD_SERVER_SOCKET_VAR):
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or join(os.environ.get('TMPDIR', '/tmp'), f'mdcmd-{os.getuid()}')
+    return join(runtime_dir, 'mdcmd.sock')
+
+
+def private_dir(path: str) -> bool:
+    """Whether ``path`` is a directory (not a symlink to one) owned by this user, with mode 0700."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and stat.S_IMODE(st.st_mode) == 0o700
+
+
+def peer_uid(conn: socket.socket) -> Optional[int]:
+    """The uid of the process on the other end of ``conn`` (where ``SO_PEERCRED`` is supported)."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', creds)
+    return uid
+
+
+def runtime() -> dict:
+    """Identify the code an invocation should run with: a server running a different Python (e.g. from another venv)
+    or ``mdcmd`` version refuses it."""
+    return dict(executable=sys.executable, version=__version__)
+
+
+def connect(path: Optional[str] = None) -> Optional[socket.socket]:
+    """Connect to the server at ``path`` (default: :func:`socket_path`), or return ``None`` if it's not running (or its
+    socket's directory, or the server process, doesn't belong to this user)."""
+    path = path or socket_path()
+    if not os.path.exists(path) or not private_dir(dirname(path)):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    if (uid := peer_uid(sock)) is not None and uid != os.getuid():
+        sock.close()
+        return None
+    return sock
+
+
+def send(sock: socket.socket, msg: dict, fds: tuple[int, ...] = ()):
+    """Send a request: one byte (carrying ``fds``), then ``msg`` as a line of JSON."""
+    socket.send_fds(sock, [b'\0'], list(fds))
+    sock.sendall(json.dumps(msg).encode() + b'\n')
+
+
+def request(msg: dict, path: Optional[str] = None) -> Optional[dict]:
+    """Send a (non-``run``) request to the server, returning its response (or ``None`` if it's not running)."""
+    sock = connect(path)
+    if not sock:
+        return None
+    with sock, sock.makefile('rb') as f:
+        send(sock, msg)
+        line = f.readline()
+    return json.loads(line) if line else None
+
+
+def forward(prog: str, args: list[str], path: Optional[str] = None) -> Optional[int]:
+    """Run ``prog`` (with ``args``, and this process' cwd, env, and stdio) in the server, returning its exit code.
+
+    Returns ``None`` if there's no server to forward to (or it didn't accept the invocation), in which case ``prog``
+    should be run in-process.
+    """
+    if os.environ.get(MDCMD_NO_SERVER_VAR):
+        return None
+    sock = connect(path)
+    if not sock:
+        return None
+    with sock, sock.makefile('rb') as f:
+        msg = dict(op='run', prog=prog, args=args, cwd=os.getcwd(), env=dict(os.environ), **runtime())
+        try:
+            send(sock, msg, fds=(0, 1, 2))
+        except OSError:
+            # E.g. one of our stdio fds is closed
+            return None
+        line = f.readline()
+        if not line:
+            # Refused (e.g. the server is running a different Python or `mdcmd` version)
+            return None
+        pid = json.loads(line)['pid']
+
+        def relay(sig, frame):
+            try:
+                os.killpg(pid, sig)
+            except ProcessLookupError:
+                pass
+
+        for sig in FORWARDED_SIGNALS:
+            signal.signal(sig, relay)
+        line = f.readline()
+    if not line:
+        # The server-side process died without reporting an exit code
+        return 1
+    return json.loads(line)['exit']
+
+
+def load(prog: str):
+    module, attr = PROGS[prog]
+    return getattr(import_module(module), attr)
+
+
+def run(prog: str):
+    code = forward(prog, sys.argv[1:])
+    if code is None:
+        return load(prog)()
+    sys.exit(code)
+
+
+def bmd():
+    run('bmd')
+
+
+def bmdf():
+    run('bmdf')
+
+
+def bmdff():
+    run('bmdff')
+
+
+def bmdfff():
+    run('bmdfff')
+
+
+def mdcmd():
+    run('mdcmd')
+
+
+def mktoc():
+    run('mktoc')
+
+
+def toc():
+    run('toc')
@@ -0,0 +1,630 @@
+"""Run Markdown documents' command blocks, and splice their outputs into the documents (the core of ``mdcmd``).
+
+Kept separate from :mod:`mdcmd.cli`, so that ``asyncio``, the subprocess machinery, etc. are only imported once
+``mdcmd`` actually processes a file (not for ``--help``, or usage errors).
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import shlex
+from asyncio import gather
+from collections import Counter, deque
+from collections.abc import AsyncIterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from difflib import unified_diff
+from functools import partial
+from itertools import islice
+from os import environ as env, rename
+from os.path import basename, join
+from subprocess import CalledProcessError, DEVNULL
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter
+from typing import Awaitable, Callable, Generator, Iterable, Optional
+
+from bmdf.utils import BMDF_OMITTED_FMT_VAR, OMITTED_FMT, err, truncate
+from mdcmd.builtins import BMD_CMDS, BUILTINS, Doc, Fallback
+from mdcmd.cache import Cache, file_dependent
+from mdcmd.parse import Block, Select, STDIN, iter_blocks, iter_doc, read_lines, read_text, split_doc
+from mdcmd.report import BUILTIN, CACHE, SHARED, SUBPROCESS, BlockStats, Report
+from mdcmd.sched import Group, Scheduler, default_jobs
+from mdcmd.subproc import BlockTimeout, Usage, run_text
+
+Write = Callable[[str], None]
+
+
+async def async_text(
+    cmd: list[str],
+    env: dict | None = None,
+    stdin: int | None = None,
+    timeout: float | None = None,
+    usage: Usage | None = None,
+    truncation: dict[str, int] | None = None,
+) -> str:
+    omitted_fmt = (env or {}).get(BMDF_OMITTED_FMT_VAR, OMITTED_FMT)
+    text = await run_text(cmd, env=env, stdin=stdin, timeout=timeout, usage=usage, omitted_fmt=omitted_fmt, **(truncation or {}))
+    return text.rstrip('\n')
+
+
+def truncate_text(text: str, truncation: dict[str, int] | None, env: dict) -> str:
+    """Apply a block's ``head=`` / ``tail=`` options to output that was produced in-process."""
+    if not truncation:
+        return text
+    omitted_fmt = env.get(BMDF_OMITTED_FMT_VAR, OMITTED_FMT)
+    return '\n'.join([ line for lines in truncate([ text.split('\n') ], omitted_fmt=omitted_fmt, **truncation) for line in lines ])
+
+
+async def run_cmd(
+    cmd: list[str],
+    env: dict,
+    stdin: int | None = None,
+    doc: Optional[Doc] = None,
+    timeout: float | None = None,
+    stats: Optional[BlockStats] = None,
+    truncation: dict[str, int] | None = None,
+) -> str:
+    """Run a block's command; if ``doc`` is passed, :data:`BUILTINS` are run in-process (with access to ``doc``).
+
+    Commands that run longer than ``timeout`` seconds are killed (along with their process groups), raising
+    :class:`BlockTimeout`. How the command was run (and, for subprocesses, its resource usage) is recorded in ``stats``.
+    Output is truncated according to the block's ``truncation`` options (see :attr:`Block.truncation`).
+    """
+    if truncation and cmd[0] in BMD_CMDS:
+        # `bmd*` truncate their wrapped commands' output themselves (inside any fence or <details> they print)
+        cmd = [ cmd[0], *[ f'--{opt}={lines}' for opt, lines in truncation.items() ], *cmd[1:] ]
+        truncation = None
+    if doc and (builtin := BUILTINS.get(cmd[0])):
+        if stats:
+            stats.source = BUILTIN
+        err(f'Running: {shlex.join(cmd)}')
+        usage = Usage()
+        try:
+            text = await asyncio.wait_for(builtin(cmd[1:], env, doc, usage), timeout)
+            if stats and usage.exit_code is not None:
+                # The builtin ran a command (e.g. `bmd*`)
+                stats.usage = usage
+            return truncate_text(text.rstrip('\n'), truncation, env)
+        except Fallback:
+            pass
+        except asyncio.TimeoutError:
+            raise BlockTimeout(cmd, timeout)
+    usage = None
+    if stats:
+        stats.source = SUBPROCESS
+        stats.usage = usage = Usage()
+    return await async_text(cmd, env=env, stdin=stdin, timeout=timeout, usage=usage, truncation=truncation)
+
+
+async def cached_text(
+    cmd: list[str],
+    env: dict,
+    cache: Cache,
+    key: str,
+    stdin: int | None = None,
+    doc: Optional[Doc] = None,
+    timeout: float | None = None,
+    stats: Optional[BlockStats] = None,
+    truncation: dict[str, int] | None = None,
+) -> str:
+    text = cache.get(key)
+    if text is None:
+        text = await run_cmd(cmd, env=env, stdin=stdin, doc=doc, timeout=timeout, stats=stats, truncation=truncation)
+        cache.put(key, text)
+    elif stats:
+        stats.source = CACHE
+    return text
+
+
+async def aiter_doc(
+    path: str,
+    select: Select,
+    doc: Optional[Doc] = None,
+) -> AsyncIterator[str | Block]:
+    """Yield runs of static text and ``Block``s from ``path``, setting ``doc``'s text once it's been fully read.
+
+    Files are read whole and split with :func:`split_doc`. Stdin (``path == '-'``) is read and parsed line-by-line in a
+    background thread, so that blocks' commands can run (and finished output can be written) while more input is still
+    arriving.
+    """
+    if path != STDIN:
+        text = read_text(path)
+        if doc:
+            doc.set_text(text)
+        for item in split_doc(text, select):
+            yield item
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    def produce():
+        lines = []
+        def tee():
+            for line in read_lines(path):
+                lines.append(line)
+                yield line
+        try:
+            for item in iter_doc(tee() if doc else read_lines(path), select):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            if doc:
+                text = ''.join(f'{line}\n' for line in lines)
+                loop.call_soon_threadsafe(doc.set_text, text)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    Thread(target=produce, daemon=True).start()
+    while (item := await queue.get()) is not done:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+async def measure(aw: Awaitable[str], stats: Optional[BlockStats]) -> str:
+    """Await a block's output, recording its running time, size, and any error in ``stats``."""
+    if not stats:
+        return await aw
+    start = perf_counter()
+    try:
+        output = await aw
+    except BaseException as e:
+        stats.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        stats.running = perf_counter() - start
+    stats.output_size = len(output.encode())
+    return output
+
+
+async def scheduled(sched: Scheduler, cmd_str: str, aw: Awaitable[str], stats: Optional[BlockStats]) -> str:
+    """Await a block's output once ``sched`` grants it a job slot, recording the time spent waiting in ``stats``."""
+    start = perf_counter()
+    async with sched.slot(cmd_str):
+        if stats:
+            stats.queued = perf_counter() - start
+        return await measure(aw, stats)
+
+
+async def cancel_all(tasks: Iterable) -> None:
+    """Cancel the unfinished ``asyncio.Task``s among ``tasks``, and wait for them to unwind (killing and reaping any
+    commands they were running)."""
+    tasks = [ task for task in tasks if isinstance(task, asyncio.Task) and not task.done() ]
+    for task in tasks:
+        task.cancel()
+    await gather(*tasks, return_exceptions=True)
+
+
+def shared_key(cmd: list[str], truncation: Optional[dict[str, int]] = None) -> Optional[tuple]:
+    """Key under which a command's output can be shared across files, or ``None`` if it may depend on the file it's in
+    (see :func:`file_dependent`).
+
+    That's the command's args, followed by any ``(opt, lines)`` truncation options (which can't be confused with args).
+    """
+    if file_dependent(cmd):
+        return None
+    return (*cmd, *sorted((truncation or {}).items()))
+
+
+def mk_select(patterns: Optional[Select], dry_run: bool = False) -> Select:
+    def select(cmd_str: str) -> bool:
+        if patterns and not patterns(cmd_str):
+            return False
+        if dry_run:
+            err(f"Would run: {cmd_str}")
+            return False
+        return True
+    return select
+
+
+class BlockRunner:
+    """Produce the outputs of one document's command blocks.
+
+    At most ``jobs`` commands (default: the number of CPUs) run at a time, subject also to the limits of any concurrency
+    ``groups`` they match. Outputs found in ``memo`` (keyed by :func:`shared_key`) or ``cache`` are reused instead of
+    re-running the corresponding commands. If ``builtins`` is set, :data:`BUILTINS` (``toc``, ``bmd*``) are run
+    in-process, instead of as subprocesses. Commands are killed if they run for longer than their block's ``timeout=``
+    option, or ``timeout`` seconds (not counting time spent waiting for a job slot). Each block's timing and resource
+    usage is added to ``report``, if provided.
+
+    Must be constructed inside the event loop it's used in.
+    """
+    def __init__(
+        self,
+        path: str,
+        cache: Optional[Cache] = None,
+        memo: Optional[dict[tuple, str]] = None,
+        jobs: Optional[int] = None,
+        groups: tuple[Group, ...] = (),
+        builtins: bool = True,
+        timeout: Optional[float] = None,
+        report: Optional[Report] = None,
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.report = report
+        self.cache = cache
+        self.memo = memo
+        self.sched = Scheduler(jobs=jobs, groups=groups)
+        self.doc = Doc(path) if builtins else None
+        # Commands mustn't compete with the parser for mdcmd's stdin
+        self.stdin = DEVNULL if path == STDIN else None
+
+    def stats(self, block: Block) -> Optional[BlockStats]:
+        return self.report.add(self.path, block.line, block.cmd_str) if self.report else None
+
+    def output(self, block: Block, stats: Optional[BlockStats] = None) -> str | Awaitable[str]:
+        """Return ``block``'s output (if it's already known), or an awaitable that runs its command (unscheduled)."""
+        cmd = block.cmd
+        truncation = block.truncation
+        if self.memo and (key := shared_key(cmd, truncation)) in self.memo:
+            output = self.memo[key]
+            if stats:
+                stats.source = SHARED
+                stats.output_size = len(output.encode())
+            return output
+        # Set environment variable for the current markdown file
+        cmd_env = env.copy()
+        cmd_env['MDCMD_FILE'] = self.path
+        timeout = self.timeout if block.timeout is None else block.timeout
+        if self.cache:
+            key = self.cache.key(cmd, self.path, cmd_env, opts=truncation)
+            return cached_text(cmd, env=cmd_env, cache=self.cache, key=key, stdin=self.stdin, doc=self.doc, timeout=timeout, stats=stats, truncation=truncation)
+        return run_cmd(cmd, env=cmd_env, stdin=self.stdin, doc=self.doc, timeout=timeout, stats=stats, truncation=truncation)
+
+    def schedule(self, block: Block) -> str | asyncio.Task:
+        """Start running ``block``'s command (subject to the scheduler's limits), unless its output is already known."""
+        stats = self.stats(block)
+        output = self.output(block, stats)
+        if isinstance(output, str):
+            return output
+        return asyncio.ensure_future(scheduled(self.sched, block.cmd_str, output, stats))
+
+    async def run(self, block: Block) -> str:
+        stats = self.stats(block)
+        output = self.output(block, stats)
+        return output if isinstance(output, str) else await measure(output, stats)
+
+
+async def process_path(
+    path: str,
+    dry_run: bool,
+    patterns: Optional[Select],
+    write_fn: Write,
+    concurrent: bool = True,
+    flush_fn: Optional[Callable[[], None]] = None,
+    fail_fast: bool = False,
+    **runner_kwargs,
+) -> int:
+    """Write ``path``'s lines to ``write_fn``, replacing command blocks with their commands' outputs.
+
+    Output is streamed in document order: each run of static lines is passed to ``write_fn`` (as one ``\\n``-joined
+    string) as soon as every block before it has completed (after which ``flush_fn``, if provided, is called). ``path``
+    may be ``-``, to read from stdin.
+
+    Block outputs are produced by a :class:`BlockRunner` (constructed with ``runner_kwargs``); in ``concurrent`` mode,
+    its commands run concurrently, otherwise one at a time. Returns the number of command blocks processed.
+
+    If a command fails, its error is raised once the blocks before it have been written; with ``fail_fast``, every
+    in-flight command is cancelled as soon as any one fails, and its error is raised immediately. Either way, no
+    commands are left running on return.
+    """
+    runner = BlockRunner(path, **runner_kwargs)
+    pending: deque[str | asyncio.Task] = deque()
+    failures: list[asyncio.Task] = []
+
+    def on_done(task: asyncio.Task):
+        if failures or task.cancelled() or task.exception() is None:
+            return
+        failures.append(task)
+        for other in pending:
+            if isinstance(other, asyncio.Task):
+                other.cancel()
+
+    def flush():
+        if failures:
+            failures[0].result()
+        wrote = False
+        while pending:
+            head = pending[0]
+            if isinstance(head, str):
+                write_fn(head)
+            elif head.done():
+                write_fn(head.result())
+            else:
+                break
+            pending.popleft()
+            wrote = True
+        if wrote and flush_fn:
+            flush_fn()
+
+    num_blocks = 0
+    try:
+        async for item in aiter_doc(path, mk_select(patterns, dry_run), runner.doc):
+            if isinstance(item, str):
+                pending.append(item)
+                flush()
+                continue
+
+            num_blocks += 1
+            if concurrent:
+                output = runner.schedule(item)
+                if fail_fast and isinstance(output, asyncio.Task):
+                    output.add_done_callback(on_done)
+                pending.append(output)
+            else:
+                flush()
+                pending.append(await runner.run(item))
+            if item.trailing_blank:
+                pending.append("")
+            flush()
+
+        while pending:
+            if isinstance(head := pending[0], asyncio.Task):
+                # Don't raise here: if `head` was cancelled by `on_done`, `flush` raises the failure that caused it
+                await asyncio.wait([head])
+            flush()
+    finally:
+        await cancel_all(pending)
+
+    return num_blocks
+
+
+Stale = tuple[Block, str]
+
+
+async def check_path(
+    path: str,
+    patterns: Optional[Select],
+    concurrent: bool = True,
+    fail_fast: bool = False,
+    **runner_kwargs,
+) -> tuple[int, list[Stale]]:
+    """Run ``path``'s command blocks, comparing each one's output to the block's existing contents as it completes.
+
+    Returns the number of blocks checked, and the ``(block, output)`` pairs that are stale (in document order). The first
+    command to fail raises its error (cancelling the rest); with ``fail_fast``, remaining blocks are also cancelled as
+    soon as one is found to be stale.
+    """
+    runner = BlockRunner(path, **runner_kwargs)
+    stale: list[Stale] = []
+    tasks: dict[asyncio.Task, Block] = {}
+
+    def check(block: Block, output: str) -> bool:
+        if block.new_lines(output) != block.old_lines:
+            stale.append((block, output))
+            return True
+        return False
+
+    num_blocks = 0
+    try:
+        async for item in aiter_doc(path, mk_select(patterns), runner.doc):
+            if isinstance(item, str):
+                continue
+            num_blocks += 1
+            if concurrent:
+                output = runner.schedule(item)
+                if isinstance(output, asyncio.Task):
+                    tasks[output] = item
+                    continue
+            else:
+                output = await runner.run(item)
+            if check(item, output) and fail_fast:
+                return num_blocks, stale
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if check(tasks[task], task.result()) and fail_fast:
+                    return num_blocks, stale
+    finally:
+        await cancel_all(tasks)
+
+    return num_blocks, sorted(stale, key=lambda s: s[0].line)
+
+
+HUNK_RGX = re.compile(r'@@ -(?P<a>\d+)(?P<a_len>,\d+)? \+(?P<b>\d+)(?P<b_len>,\d+)? @@')
+
+
+def file_diff(path: str, stale: list[Stale]) -> str:
+    """Unified diff of a file's stale blocks (line numbers are relative to the original file)."""
+    lines = [ f'--- {path}', f'+++ {path}' ]
+    for block, output in stale:
+        hunks = unified_diff(block.old_lines, block.new_lines(output), lineterm='')
+        for line in islice(hunks, 2, None):
+            if m := HUNK_RGX.fullmatch(line):
+                a, b = int(m['a']) + block.line, int(m['b']) + block.line
+                line = f"@@ -{a}{m['a_len'] or ''} +{b}{m['b_len'] or ''} @@ {block.cmd_str}"
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+@contextmanager
+def out_fd(
+    inplace: bool,
+    path: str,
+    out_path: Optional[str],
+    dir: Optional[str] = None,
+) -> Generator[Write, None, None]:
+    if inplace:
+        if out_path:
+            raise ValueError('Cannot specify both --inplace and an output path')
+        with TemporaryDirectory(dir=dir) as tmpdir:
+            tmp_path = join(tmpdir, basename(path))
+            with open(tmp_path, 'w') as f:
+                yield partial(print, file=f)
+            rename(tmp_path, path)
+    else:
+        if not out_path or out_path == '-':
+            yield print
+        else:
+            with open(out_path, 'w') as f:
+                yield partial(print, file=f)
+
+
+
+async def run_shared(
+    paths: list[str],
+    patterns: Optional[Select],
+    cache: Optional[Cache] = None,
+    jobs: Optional[int] = None,
+    groups: tuple[Group, ...] = (),
+    builtins: bool = True,
+    timeout: Optional[float] = None,
+    report: Optional[Report] = None,
+) -> dict[tuple, str]:
+    """Run each command that appears in more than one of ``paths`` once, returning outputs by :func:`shared_key`."""
+    select = (lambda cmd_str: patterns(cmd_str)) if patterns else None
+    counts = Counter()
+    first_blocks: dict[tuple, tuple[str, Block]] = {}
+    for path in paths:
+        blocks = { key: block for block in iter_blocks(path, select) if (key := shared_key(block.cmd, block.truncation)) }
+        for key, block in blocks.items():
+            counts[key] += 1
+            first_blocks.setdefault(key, (path, block))
+    keys = [ key for key, n in counts.items() if n > 1 ]
+    sched = Scheduler(jobs=jobs, groups=groups)
+
+    async def run(key: tuple) -> str:
+        cmd_env = env.copy()
+        path, block = first_blocks[key]
+        cmd, truncation = block.cmd, block.truncation
+        cmd_env['MDCMD_FILE'] = path
+        doc = Doc(path) if builtins else None
+        block_timeout = timeout if block.timeout is None else block.timeout
+        stats = report.add(path, block.line, block.cmd_str) if report else None
+        if cache:
+            key = cache.key(cmd, path, cmd_env, opts=truncation)
+            aw = cached_text(cmd, env=cmd_env, cache=cache, key=key, doc=doc, timeout=block_timeout, stats=stats, truncation=truncation)
+        else:
+            aw = run_cmd(cmd, env=cmd_env, doc=doc, timeout=block_timeout, stats=stats, truncation=truncation)
+        return await scheduled(sched, shlex.join(cmd), aw, stats)
+
+    outputs = await gather(*[ run(key) for key in keys ], return_exceptions=True)
+    # Failed commands are left to be re-run (and reported) per-file
+    return {
+        key: output
+        for key, output in zip(keys, outputs)
+        if isinstance(output, str)
+    }
+
+
+@dataclass
+class FileResult:
+    path: str
+    blocks: int = 0
+    changed: bool = False
+    stale: int = 0
+    diff: Optional[str] = None
+    error: Optional[str] = None
+    stats: list[BlockStats] = field(default_factory=list)
+
+
+def process_file(
+    path: str,
+    dry_run: bool,
+    patterns: Optional[Select],
+    tmpdir: Optional[str],
+    check: bool = False,
+    fail_fast: bool = False,
+    report: bool = False,
+    **kwargs,
+) -> FileResult:
+    """Process (or, with ``check``, check) one file in-place (in a worker process, in multi-file mode).
+
+    With ``report``, each block's :class:`BlockStats` are returned in the result.
+    """
+    result = FileResult(path)
+    block_report = kwargs['report'] = Report() if report else None
+    try:
+        if check:
+            result.blocks, stale = asyncio.run(check_path(path, patterns, fail_fast=fail_fast, **kwargs))
+            result.stale = len(stale)
+            if stale:
+                result.diff = file_diff(path, stale)
+            return result
+        with open(path, 'r') as f:
+            before = f.read()
+        run = partial(process_path, path=path, dry_run=dry_run, patterns=patterns, fail_fast=fail_fast, **kwargs)
+        if dry_run:
+            result.blocks = asyncio.run(run(write_fn=lambda line: None))
+        else:
+            with out_fd(True, path, None, dir=tmpdir) as write:
+                result.blocks = asyncio.run(run(write_fn=write))
+        with open(path, 'r') as f:
+            result.changed = f.read() != before
+    except (CalledProcessError, OSError, ValueError, RuntimeError) as e:
+        result.error = f'{type(e).__name__}: {e}'
+    finally:
+        if block_report:
+            result.stats = block_report.blocks
+    return result
+
+
+def process_files(
+    paths: list[str],
+    dry_run: bool,
+    patterns: Optional[Select],
+    procs: int,
+    cache: Optional[Cache] = None,
+    jobs: Optional[int] = None,
+    groups: tuple[Group, ...] = (),
+    builtins: bool = True,
+    timeout: Optional[float] = None,
+    report: Optional[Report] = None,
+    **kwargs,
+) -> list[FileResult]:
+    """Process ``paths`` in-place across a pool of ``procs`` worker processes (see :func:`process_file`).
+
+    Commands that appear in several files are first run once (see :func:`run_shared`). The ``jobs`` limit is divided
+    among the worker processes. Blocks' timing and resource usage (from all workers) are added to ``report``.
+    """
+    jobs = jobs or default_jobs()
+    memo = {} if dry_run else asyncio.run(run_shared(paths, patterns, cache=cache, jobs=jobs, groups=groups, builtins=builtins, timeout=timeout, report=report))
+    procs = min(procs, len(paths))
+    kwargs = dict(
+        dry_run=dry_run,
+        patterns=patterns,
+        cache=cache,
+        memo=memo,
+        jobs=max(1, jobs // max(procs, 1)),
+        groups=groups,
+        builtins=builtins,
+        timeout=timeout,
+        report=report is not None,
+        **kwargs,
+    )
+    if procs <= 1:
+        results = [ process_file(path, **kwargs) for path in paths ]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=procs) as executor:
+            results = list(executor.map(partial(process_file, **kwargs), paths))
+
+    check = kwargs.get('check')
+    for result in results:
+        if report:
+            report.extend(result.stats)
+        if result.error:
+            err(f'{result.path}: failed ({result.error})')
+        elif check:
+            status = f'{result.stale} stale' if result.stale else 'up to date'
+            err(f'{result.path}: {result.blocks} blocks, {status}')
+        else:
+            status = 'updated' if result.changed else 'unchanged'
+            err(f'{result.path}: {result.blocks} blocks, {status}')
+    num_failed = sum(bool(result.error) for result in results)
+    num_blocks = sum(result.blocks for result in results)
+    if check:
+        num_stale = sum(bool(result.stale) for result in results)
+        summary = f'{num_stale} stale'
+    else:
+        num_changed = sum(result.changed for result in results)
+        summary = f'{num_changed} updated'
+    err(f'{len(results)} files ({summary}, {num_failed} failed), {num_blocks} blocks ({len(memo)} shared commands run once)')
+    return results
+
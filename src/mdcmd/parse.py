@@ -0,0 +1,185 @@
+"""Split Markdown lines into static text and ``<!-- `cmd` -->`` command blocks (see :mod:`mdcmd.blocks`)."""
+from __future__ import annotations
+
+import shlex
+import sys
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional
+
+from mdcmd.blocks import BlockSpans, CMD_LINE_RGX, Select, index_blocks, skip_block
+
+STDIN = '-'
+
+# Options that may follow a block's command, e.g. <!-- `cmd` timeout=30 -->
+BLOCK_OPTS = {'timeout', 'head', 'tail'}
+# Block options that truncate the command's output (to its first / last this-many lines)
+TRUNCATE_OPTS = ('head', 'tail')
+
+
+@lru_cache(maxsize=1024)
+def split_cmd(cmd_str: str) -> tuple[str, ...]:
+    """``shlex.split`` a block's command (memoized: documents tend to repeat commands, and splitting is relatively slow)."""
+    return tuple(shlex.split(cmd_str))
+
+
+def parse_opts(opts_str: Optional[str]) -> dict[str, str]:
+    """Parse the ``key=value`` options following a ``<!-- `cmd` -->`` line's command."""
+    opts = {}
+    for opt in (opts_str or '').split():
+        key, value = opt.split('=', 1)
+        if key not in BLOCK_OPTS:
+            raise ValueError(f'Unrecognized block option {key!r} (expected one of: {", ".join(sorted(BLOCK_OPTS))})')
+        if key == 'timeout':
+            try:
+                float(value)
+            except ValueError:
+                raise ValueError(f'Invalid block timeout (expected seconds): {value!r}')
+        elif key in TRUNCATE_OPTS:
+            if not value.isdigit():
+                raise ValueError(f'Invalid block {key} (expected a number of lines): {value!r}')
+        opts[key] = value
+    return opts
+
+
+@dataclass
+class Block:
+    """A command block, whose previous output (following the ``<!-- `cmd` -->`` line) has been consumed.
+
+    ``trailing_blank`` is set when the block is terminated by a blank line (or EOF), which is re-emitted after the
+    command's output. ``line`` is the (1-based) line number of the ``<!-- `cmd` -->`` line, and ``old_lines`` are the
+    lines that were consumed after it. ``opts`` are any ``key=value`` options that followed the command (see
+    :data:`BLOCK_OPTS`). ``spans`` locates the block in the document's text (:func:`split_doc` only).
+    """
+    cmd_str: str
+    cmd: list[str]
+    trailing_blank: bool
+    line: int = 0
+    old_lines: list[str] = field(default_factory=list)
+    opts: dict[str, str] = field(default_factory=dict)
+    spans: Optional[BlockSpans] = None
+
+    @property
+    def timeout(self) -> Optional[float]:
+        """Seconds the block's command may run for (``timeout=<seconds>``), if set."""
+        timeout = self.opts.get('timeout')
+        return None if timeout is None else float(timeout)
+
+    @property
+    def truncation(self) -> dict[str, int]:
+        """Lines of the command's output to keep (``head=<lines>``, ``tail=<lines>``), if set."""
+        return { key: int(self.opts[key]) for key in TRUNCATE_OPTS if key in self.opts }
+
+    def new_lines(self, output: str) -> list[str]:
+        """The lines that will replace ``old_lines``, given the command's ``output``."""
+        lines = output.split('\n')
+        if self.trailing_blank:
+            lines.append('')
+        return lines
+
+
+class Recorder:
+    """Wrap a line iterator, recording the lines read from it."""
+    def __init__(self, lines: Iterator[str]):
+        self.lines = lines
+        self.read: list[str] = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = next(self.lines)
+        self.read.append(line)
+        return line
+
+
+def iter_doc(
+    lines: Iterable[str],
+    select: Optional[Select] = None,
+) -> Iterator[str | Block]:
+    """Yield each line of a document, replacing the old contents of selected command blocks with ``Block``s.
+
+    Each ``<!-- `cmd` -->`` line is yielded verbatim; if ``select(cmd_str)`` is falsy, the lines after it are passed
+    through unchanged, otherwise they are consumed up to the end of the block they start, and a ``Block`` is yielded in
+    their place.
+    """
+    lines = iter(lines)
+    line_no = 0
+    for line in lines:
+        line_no += 1
+        yield line
+        if not (m := CMD_LINE_RGX.match(line)):
+            continue
+
+        cmd_str = m.group('cmd')
+        if select and not select(cmd_str):
+            continue
+
+        cmd = list(split_cmd(cmd_str))
+        opts = parse_opts(m['opts'])
+        recorder = Recorder(lines)
+        trailing_blank = skip_block(cmd_str, recorder, line_no)
+        yield Block(cmd_str=cmd_str, cmd=cmd, trailing_blank=trailing_blank, line=line_no, old_lines=recorder.read, opts=opts)
+        line_no += len(recorder.read)
+
+
+def split_doc(
+    text: str,
+    select: Optional[Select] = None,
+) -> Iterator[str | Block]:
+    """Equivalent to :func:`iter_doc` over ``text``'s lines, but yield each run of static lines as one ``str``.
+
+    Runs are ``\\n``-joined slices of ``text`` (without a trailing newline), so writing each item followed by a newline
+    reproduces the document; blocks are found by :func:`~mdcmd.blocks.index_blocks`.
+    """
+    n = len(text)
+    run_start = 0
+    for spans in index_blocks(text, select):
+        cmd = list(split_cmd(spans.cmd_str))
+        opts = parse_opts(spans.opts_str)
+        marker_end = spans.marker.end
+        yield text[run_start:marker_end - 1 if text[marker_end - 1] == '\n' else marker_end]
+        old = spans.old
+        old_lines = text[old.start:old.end].split('\n')
+        if old_lines[-1] == '':
+            old_lines.pop()
+        yield Block(
+            cmd_str=spans.cmd_str,
+            cmd=cmd,
+            trailing_blank=spans.trailing_blank,
+            line=spans.marker.line,
+            old_lines=old_lines,
+            opts=opts,
+            spans=spans,
+        )
+        run_start = old.end
+
+    if run_start < n:
+        end = n - 1 if text.endswith('\n') else n
+        yield text[run_start:end]
+
+
+def read_lines(path: str) -> Iterator[str]:
+    """Yield a file's lines (without trailing newlines); ``-`` reads from stdin."""
+    if path == STDIN:
+        for line in sys.stdin:
+            yield line.rstrip('\n')
+        return
+    with open(path, 'r') as fd:
+        for line in fd:
+            yield line.rstrip('\n')
+
+
+def read_text(path: str) -> str:
+    """Read a file's contents; ``-`` reads from stdin."""
+    if path == STDIN:
+        return sys.stdin.read()
+    with open(path, 'r') as fd:
+        return fd.read()
+
+
+def iter_blocks(path: str, select: Optional[Select] = None) -> Iterator[Block]:
+    """Yield the (selected) command blocks in a Markdown file."""
+    for item in split_doc(read_text(path), select):
+        if isinstance(item, Block):
+            yield item
@@ -0,0 +1,133 @@
+"""Per-block timing and resource-usage reports for ``mdcmd`` runs (``mdcmd --report``)."""
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+
+from mdcmd.subproc import Usage
+
+# How a block's output was produced
+SUBPROCESS = 'subprocess'
+BUILTIN = 'builtin'
+CACHE = 'cache'
+SHARED = 'shared'
+
+
+@dataclass
+class BlockStats:
+    """Timing and resource usage of one command block.
+
+    ``queued`` is the time spent waiting for a job slot, ``running`` the time spent producing the block's output after
+    that, and ``wall`` their sum. ``usage`` is only set for blocks that ran a command (as a subprocess, or in-process, for
+    ``bmd*``; see ``source``), and is reported as ``null`` otherwise; note that on Linux, a child's max RSS is never
+    less than ``mdcmd``'s own RSS when it was spawned.
+    """
+    path: str
+    line: int
+    cmd: str
+    source: str = SUBPROCESS
+    queued: float = 0.
+    running: float = 0.
+    output_size: Optional[int] = None
+    usage: Optional[Usage] = None
+    error: Optional[str] = None
+
+    @property
+    def wall(self) -> float:
+        return self.queued + self.running
+
+    @property
+    def exit_code(self) -> Optional[int]:
+        return self.usage.exit_code if self.usage else None
+
+    def to_dict(self) -> dict:
+        usage = self.usage
+        return dict(
+            path=self.path,
+            line=self.line,
+            cmd=self.cmd,
+            source=self.source,
+            wall=self.wall,
+            queued=self.queued,
+            running=self.running,
+            user=usage.user if usage else None,
+            sys=usage.sys if usage else None,
+            max_rss=usage.max_rss if usage else None,
+            output_size=self.output_size,
+            exit_code=self.exit_code,
+            error=self.error,
+        )
+
+
+@dataclass
+class Report:
+    blocks: list[BlockStats] = field(default_factory=list)
+
+    def add(self, path: str, line: int, cmd: str) -> BlockStats:
+        stats = BlockStats(path=path, line=line, cmd=cmd)
+        self.blocks.append(stats)
+        return stats
+
+    def extend(self, blocks: list[BlockStats]):
+        self.blocks.extend(blocks)
+
+    def sorted(self) -> list[BlockStats]:
+        """Blocks in descending order of wall time."""
+        return sorted(self.blocks, key=lambda stats: -stats.wall)
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({ 'blocks': [ stats.to_dict() for stats in self.sorted() ] }, f, indent=2)
+            f.write('\n')
+
+    def table(self) -> str:
+        """Summary table (slowest blocks first), with a totals row."""
+        header = ('wall', 'queued', 'running', 'user', 'sys', 'max_rss', 'output', 'exit', 'source', 'block')
+        rows = [
+            (
+                fmt_secs(stats.wall),
+                fmt_secs(stats.queued),
+                fmt_secs(stats.running),
+                fmt_secs(stats.usage.user) if stats.usage else '-',
+                fmt_secs(stats.usage.sys) if stats.usage else '-',
+                fmt_bytes(stats.usage.max_rss) if stats.usage else '-',
+                '-' if stats.output_size is None else fmt_bytes(stats.output_size),
+                '-' if stats.exit_code is None else str(stats.exit_code),
+                stats.source,
+                f'{stats.path}:{stats.line} {stats.cmd}',
+            )
+            for stats in self.sorted()
+        ]
+        usages = [ stats.usage for stats in self.blocks if stats.usage ]
+        rows.append((
+            fmt_secs(sum(stats.wall for stats in self.blocks)),
+            fmt_secs(sum(stats.queued for stats in self.blocks)),
+            fmt_secs(sum(stats.running for stats in self.blocks)),
+            fmt_secs(sum(usage.user for usage in usages)),
+            fmt_secs(sum(usage.sys for usage in usages)),
+            fmt_bytes(max((usage.max_rss for usage in usages), default=0)),
+            fmt_bytes(sum(stats.output_size or 0 for stats in self.blocks)),
+            '',
+            '',
+            f'total ({len(self.blocks)} blocks)',
+        ))
+        widths = [ max(len(row[i]) for row in [ header, *rows ]) for i in range(len(header) - 1) ]
+
+        def fmt_row(row: tuple[str, ...]) -> str:
+            *cols, block = row
+            return '  '.join([ col.rjust(width) for col, width in zip(cols, widths) ] + [ block ]).rstrip()
+
+        return '\n'.join(fmt_row(row) for row in [ header, *rows ])
+
+
+def fmt_secs(secs: float) -> str:
+    return f'{secs:.2f}s'
+
+
+def fmt_bytes(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}GiB'
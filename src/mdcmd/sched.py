@@ -0,0 +1,64 @@
+"""Bounded-concurrency scheduling of ``mdcmd`` command blocks."""
+from __future__ import annotations
+
+import re
+from asyncio import Semaphore
+from collections.abc import Awaitable
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from os import cpu_count
+from typing import AsyncIterator, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+@dataclass
+class Group:
+    """Commands matching ``pattern`` may run at most ``limit`` at a time (in addition to the global job limit)."""
+    pattern: re.Pattern
+    limit: int
+
+    @staticmethod
+    def parse(spec: str) -> 'Group':
+        """Parse a ``<regex>=<limit>`` string, e.g. ``^cargo=1``."""
+        if '=' not in spec:
+            raise ValueError(f'Expected <regex>=<limit>: {spec}')
+        pattern, limit = spec.rsplit('=', 1)
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError(f'Group limit must be positive: {spec}')
+        return Group(re.compile(pattern), limit)
+
+
+def default_jobs() -> int:
+    return cpu_count() or 1
+
+
+class Scheduler:
+    """Run coroutines subject to a global ``jobs`` limit, and the limits of any ``groups`` their commands match.
+
+    Must be constructed inside the event loop it's used in. Group slots are acquired before the global slot, so a block
+    waiting on a busy group doesn't hold up unrelated blocks.
+    """
+    def __init__(
+        self,
+        jobs: Optional[int] = None,
+        groups: tuple[Group, ...] | list[Group] = (),
+    ):
+        self.jobs = jobs or default_jobs()
+        self.sem = Semaphore(self.jobs)
+        self.groups = [ (group, Semaphore(group.limit)) for group in groups ]
+
+    @asynccontextmanager
+    async def slot(self, cmd_str: str) -> AsyncIterator[None]:
+        """Wait for (and hold) a job slot for ``cmd_str``."""
+        async with AsyncExitStack() as stack:
+            for group, sem in self.groups:
+                if group.pattern.search(cmd_str):
+                    await stack.enter_async_context(sem)
+            async with self.sem:
+                yield
+
+    async def run(self, cmd_str: str, aw: Awaitable[T]) -> T:
+        async with self.slot(cmd_str):
+            return await aw
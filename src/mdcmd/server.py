@@ -0,0 +1,256 @@
+"""``mdcmd-server``: a long-lived process that keeps ``mdcmd``, ``bmd*`` and ``toc``'s modules loaded (and caches warm),
+and runs console-script invocations forwarded to it by :mod:`mdcmd.client` over a Unix socket.
+
+Each invocation runs in a child forked from the server, with the client's stdio file descriptors (passed over the
+socket), argv, cwd, and env; its exit code is sent back to the client.
+"""
+from __future__ import annotations
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import traceback
+from os.path import dirname, exists
+from time import monotonic, sleep
+from types import ModuleType
+from typing import Optional
+
+from click import group, option, echo
+
+from mdcmd.client import PROGS, connect, load, peer_uid, private_dir, request, runtime, socket_path
+
+
+def exit_code(e: SystemExit) -> int:
+    code = e.code
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def run_forwarded(conn: socket.socket, fds: list[int], msg: dict) -> int:
+    """Run a forwarded invocation (in a forked child of the server), returning its exit code."""
+    for sig in (signal.SIGTERM, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # The client relays signals (e.g. Ctrl-C) to this process' group
+    os.setpgid(0, 0)
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    for stream in (sys.stdout, sys.stderr):
+        stream.reconfigure(line_buffering=stream.isatty())
+    os.chdir(msg['cwd'])
+    os.environ.clear()
+    os.environ.update(msg['env'])
+    prog = msg['prog']
+    sys.argv = [ prog, *msg['args'] ]
+    # As if run from a console script (Click derives `--help`'s program name from `__main__`)
+    sys.modules['__main__'] = ModuleType('__main__')
+    conn.sendall(json.dumps(dict(pid=os.getpid())).encode() + b'\n')
+    try:
+        load(prog)()
+        return 0
+    except SystemExit as e:
+        return exit_code(e)
+    except KeyboardInterrupt:
+        return 128 + signal.SIGINT
+    except BaseException:
+        traceback.print_exc()
+        return 1
+
+
+class Server:
+    """Accept connections on ``path``, handling ``run``, ``status`` and ``stop`` requests. Exits after ``idle_timeout``
+    seconds without a request, if set."""
+    def __init__(self, path: str, idle_timeout: Optional[float] = None):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.started = monotonic()
+        self.last_request = self.started
+        self.served = 0
+        self.running = True
+
+    def reap(self):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+
+    def handle(self, sock: socket.socket, conn: socket.socket):
+        if (uid := peer_uid(conn)) is not None and uid != os.getuid():
+            return
+        _, fds, _, _ = socket.recv_fds(conn, 1, 3)
+        try:
+            with conn.makefile('rb') as f:
+                line = f.readline()
+            if not line:
+                return
+            msg = json.loads(line)
+            op = msg.get('op')
+            if op == 'run':
+                if len(fds) != 3 or msg.get('prog') not in PROGS:
+                    return
+                if any( msg.get(key) != value for key, value in runtime().items() ):
+                    # The client runs it in-process instead
+                    return
+                pid = os.fork()
+                if pid == 0:
+                    code = 1
+                    try:
+                        sock.close()
+                        code = run_forwarded(conn, fds, msg)
+                    finally:
+                        for stream in (sys.stdout, sys.stderr):
+                            try:
+                                stream.flush()
+                            except Exception:
+                                pass
+                        try:
+                            conn.sendall(json.dumps(dict(exit=code)).encode() + b'\n')
+                        except OSError:
+                            pass
+                        os._exit(code)
+                self.served += 1
+            elif op == 'status':
+                conn.sendall(json.dumps(self.status()).encode() + b'\n')
+            elif op == 'stop':
+                conn.sendall(json.dumps(self.status()).encode() + b'\n')
+                self.running = False
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def status(self) -> dict:
+        return dict(
+            pid=os.getpid(),
+            socket=self.path,
+            uptime=monotonic() - self.started,
+            served=self.served,
+        )
+
+    def serve(self):
+        # Import everything a forwarded invocation might need up front, in the server
+        for prog in PROGS:
+            load(prog)
+
+        if exists(self.path):
+            if sock := connect(self.path):
+                sock.close()
+                raise RuntimeError(f'mdcmd-server already running on {self.path}')
+            os.unlink(self.path)
+        socket_dir = dirname(self.path)
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        if not private_dir(socket_dir):
+            raise RuntimeError(f'Socket directory {socket_dir} must be owned by this user, with mode 0700 (and not a symlink)')
+
+        def stop(sig, frame):
+            self.running = False
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(self.path)
+            os.chmod(self.path, 0o600)
+            sock.listen(64)
+            sock.settimeout(1)
+            try:
+                while self.running:
+                    self.reap()
+                    if self.idle_timeout and monotonic() - self.last_request > self.idle_timeout:
+                        break
+                    try:
+                        conn, _ = sock.accept()
+                    except (socket.timeout, InterruptedError):
+                        continue
+                    self.last_request = monotonic()
+                    with conn:
+                        conn.settimeout(None)
+                        try:
+                            self.handle(sock, conn)
+                        except (OSError, ValueError) as e:
+                            print(f'Error handling request: {e}', file=sys.stderr)
+            finally:
+                if exists(self.path):
+                    os.unlink(self.path)
+
+
+socket_opt = option('-s', '--socket', 'path', help='Unix socket path (default: $MDCMD_SERVER_SOCKET, or mdcmd.sock in $XDG_RUNTIME_DIR)')
+
+
+@group('mdcmd-server')
+def main():
+    """Long-lived server that `mdcmd`, `bmd*`, `toc` and `mktoc` forward invocations to (when it's running), to avoid
+    paying interpreter startup and import costs on each one. Set $MDCMD_NO_SERVER to disable forwarding."""
+
+
+@main.command()
+@option('-t', '--idle-timeout', type=float, help='Exit after this many seconds without a request')
+@socket_opt
+def run(idle_timeout: Optional[float], path: Optional[str]):
+    """Run the server in the foreground."""
+    Server(path or socket_path(), idle_timeout=idle_timeout).serve()
+
+
+@main.command()
+@option('-t', '--idle-timeout', type=float, help='Exit after this many seconds without a request')
+@socket_opt
+def start(idle_timeout: Optional[float], path: Optional[str]):
+    """Start the server in the background (if it's not already running)."""
+    path = path or socket_path()
+    if status := request(dict(op='status'), path):
+        echo(f'mdcmd-server already running (pid {status["pid"]})')
+        return
+    cmd = [ sys.executable, '-m', 'mdcmd.server', 'run', '-s', path ]
+    if idle_timeout:
+        cmd += [ '-t', str(idle_timeout) ]
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = monotonic() + 10
+    while monotonic() < deadline:
+        if status := request(dict(op='status'), path):
+            echo(f'mdcmd-server started (pid {status["pid"]})')
+            return
+        if proc.poll() is not None:
+            break
+        sleep(0.05)
+    raise RuntimeError(f'mdcmd-server failed to start on {path}')
+
+
+@main.command()
+@socket_opt
+def status(path: Optional[str]):
+    """Print the server's pid, uptime, and number of invocations served; exit 1 if it's not running."""
+    status = request(dict(op='status'), path)
+    if not status:
+        echo('mdcmd-server not running')
+        sys.exit(1)
+    echo(f'mdcmd-server running (pid {status["pid"]}, socket {status["socket"]}, up {status["uptime"]:.0f}s, served {status["served"]})')
+
+
+@main.command()
+@socket_opt
+def stop(path: Optional[str]):
+    """Stop the server."""
+    status = request(dict(op='stop'), path)
+    if not status:
+        echo('mdcmd-server not running')
+        return
+    echo(f'mdcmd-server stopped (pid {status["pid"]}, served {status["served"]})')
+
+
+if __name__ == '__main__':
+    main()
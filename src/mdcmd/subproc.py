@@ -0,0 +1,132 @@
+"""Run block commands as subprocesses, each in its own process group, so that timeouts and cancellations can kill
+everything a command started."""
+from __future__ import annotations
+
+import asyncio
+import shlex
+from functools import partial
+from os import killpg, wait4, waitstatus_to_exitcode
+from signal import SIGKILL, SIGTERM
+from subprocess import CalledProcessError, PIPE, Popen
+from threading import Thread
+from typing import Callable, IO, Optional
+
+from bmdf.pipeline import Usage, iter_line_batches
+from bmdf.utils import OMITTED_FMT, err, truncate
+
+# Seconds between SIGTERM and SIGKILL, when killing a command's process group
+KILL_GRACE = 2
+
+
+class BlockTimeout(TimeoutError):
+    def __init__(self, cmd: list[str], timeout: float):
+        self.cmd = cmd
+        self.timeout = timeout
+        super().__init__(f'Command timed out after {timeout}s: {shlex.join(cmd)}')
+
+
+def kill_group(proc: Popen, sig: int):
+    try:
+        killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def read_stdout(
+    stdout: IO[bytes],
+    head: Optional[int] = None,
+    tail: Optional[int] = None,
+    omitted_fmt: str = OMITTED_FMT,
+) -> str:
+    """Read a command's stdout to EOF; with ``head`` / ``tail``, only the lines that are kept (see
+    :func:`bmdf.utils.truncate`) are held in memory."""
+    if head is None and tail is None:
+        return stdout.read().decode()
+    batches = truncate(iter_line_batches(stdout), head=head, tail=tail, omitted_fmt=omitted_fmt)
+    return '\n'.join([ line for lines in batches for line in lines ])
+
+
+def reap(proc: Popen, usage: Optional[Usage], read: Callable[[IO[bytes]], str] = read_stdout) -> str:
+    """Read ``proc``'s stdout to EOF (with ``read``), then reap it with ``wait4`` (recording its resource usage)."""
+    output = read(proc.stdout)
+    proc.stdout.close()
+    _, status, rusage = wait4(proc.pid, 0)
+    # Let `Popen` know the process has been reaped
+    proc.returncode = waitstatus_to_exitcode(status)
+    if usage:
+        usage.exit_code = proc.returncode
+        usage.add(rusage)
+    return output
+
+
+def start_reaper(proc: Popen, usage: Optional[Usage], read: Callable[[IO[bytes]], str] = read_stdout) -> asyncio.Future:
+    """Wait for ``proc`` in a background thread (one per command, so that long-running commands can't starve each other
+    of executor workers); returns a future that resolves to ``proc``'s stdout once it's been reaped."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(result: Optional[str], exc: Optional[BaseException]):
+        if future.done():
+            return
+        if exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    def target():
+        try:
+            result, exc = reap(proc, usage, read), None
+        except BaseException as e:
+            result, exc = None, e
+        try:
+            loop.call_soon_threadsafe(resolve, result, exc)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    Thread(target=target, daemon=True).start()
+    return future
+
+
+async def terminate(proc: Popen, reaped: asyncio.Future, grace: float = KILL_GRACE):
+    """SIGTERM ``proc``'s process group, SIGKILL it if ``proc`` hasn't exited after ``grace`` seconds, and wait for it to
+    be reaped."""
+    kill_group(proc, SIGTERM)
+    try:
+        await asyncio.wait_for(asyncio.shield(reaped), grace)
+    except asyncio.TimeoutError:
+        kill_group(proc, SIGKILL)
+        await asyncio.wait([reaped])
+
+
+async def run_text(
+    cmd: list[str],
+    env: Optional[dict] = None,
+    stdin: Optional[int] = None,
+    timeout: Optional[float] = None,
+    usage: Optional[Usage] = None,
+    head: Optional[int] = None,
+    tail: Optional[int] = None,
+    omitted_fmt: str = OMITTED_FMT,
+) -> str:
+    """Run ``cmd``, returning its stdout; raise ``CalledProcessError`` if it fails, or :class:`BlockTimeout` if it runs
+    longer than ``timeout`` seconds. If ``usage`` is passed, it's populated with the command's exit code and resource
+    usage. With ``head`` / ``tail``, only the first / last that-many lines of output are kept (see :func:`read_stdout`).
+
+    The command runs in a new session (and process group); on timeout or cancellation, the whole group is killed and the
+    command is reaped before this returns.
+    """
+    err(f'Running: {shlex.join(cmd)}')
+    proc = Popen(cmd, stdin=stdin, stdout=PIPE, env=env, start_new_session=True)
+    reaped = start_reaper(proc, usage, partial(read_stdout, head=head, tail=tail, omitted_fmt=omitted_fmt))
+    try:
+        output = await asyncio.wait_for(asyncio.shield(reaped), timeout)
+    except asyncio.TimeoutError:
+        await asyncio.shield(terminate(proc, reaped))
+        raise BlockTimeout(cmd, timeout)
+    except BaseException:
+        await asyncio.shield(terminate(proc, reaped))
+        raise
+    if proc.returncode:
+        raise CalledProcessError(proc.returncode, cmd, output=output)
+    return output
@@ -1,80 +1,356 @@
 #!/usr/bin/env python3
-"""Generate a table of contents for a markdown file."""
+"""Generate a table of contents for a markdown file.
 
+Headings are found in a single pass over the document, which can be a string, an iterable of lines (e.g. an open file),
+or bytes (e.g. a memory-mapped file, see :func:`mapped`). Headings inside fenced code blocks are skipped. By default,
+only headings with explicit ``<a id="..."></a>`` anchors are included; with ``auto_ids``, other ``##``+ headings are
+included too, linking to the ids GitHub generates for them (see :func:`slugify`).
+"""
+
+import mmap
 import re
 import sys
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain, islice
 from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
 
 import click
 from click import command, option, argument
 
+# Lines that can be (or start) a heading, or open or close a code fence. Each is matched along with the newline before
+# it, which lets `re` skip to candidate lines quickly (a `^` anchor is tried at every position).
+LINE_RGX = re.compile(r'''
+    \n(?:
+        # HTML heading: `<hN>`, a title/id line, and `</hN>`
+        <(?P<tag>h\d)>\r?\n(?P<html_title>.*)\ <a\ id="(?P<html_id>[^"]+)"></a>\r?\n</(?P=tag)>\r?$
+        # Markdown (ATX) heading: up to 3 spaces of indentation, `#`s, and a title (which may end with an `<a id>`
+        # anchor, and/or a closing sequence of `#`s; see `parse_heading`)
+      | (?P<heading>[ ]{0,3}(?P<hashes>\#+)(?P<title>[ \t].*)?\r?$)
+        # Code fence (at any indentation, so that fences in list items are recognized too), and its contents, through
+        # the closing fence (if it's in the text being scanned)
+      | [ \t]*(?P<fence>(?P<fc>[`~])(?P=fc){2,})(?P<info>.*)$
+        (?P<block>(?:\n.*)*?\n[ \t]*(?P=fence)(?P=fc)*[ \t]*\r?$)?
+    )
+''', re.M | re.X)
+LINE_BYTES_RGX = re.compile(LINE_RGX.pattern.encode(), re.M | re.X)
+LINK_RGX = re.compile(r'\[([^]]+)](?:\([^)]+\))?')
+HTML_TAG_RGX = re.compile(r'<[^>]*>')
+# Characters GitHub drops when slugifying a heading (everything but letters, digits, `_`, `-` and spaces)
+SLUG_DROP_RGX = re.compile(r'[^\w\- ]')
 
-def generate_toc(content: str, indent_size: int = 4) -> str:
-    """Generate TOC from markdown content, matching mktoc's behavior."""
-    lines = []
-    content_lines = content.splitlines()
-
-    # Regex patterns from mktoc
-    TITLE_ID = r'(?P<title>.*) <a id="(?P<id>[^"]+)"></a>'
-    MD_RGX = re.compile(r'(?P<level>#{2,}) ' + TITLE_ID)
-    HTML_RGX = re.compile(r'<(?P<tag>h\d)>')
-    TITLE_ID_RGX = re.compile(TITLE_ID)
-
-    i = 0
-    while i < len(content_lines):
-        line = content_lines[i]
-
-        # Check for markdown headers with <a id="..."></a>
-        if m := MD_RGX.fullmatch(line):
-            level = len(m['level'])
-            title = m['title']
-            id = m['id']
-        # Check for HTML headers (e.g., <h2>)
-        elif m := HTML_RGX.fullmatch(line):
-            level = int(m['tag'][1])
-            # Next line should have the title and id
-            if i + 2 < len(content_lines):
-                body = content_lines[i + 1]
-                close = content_lines[i + 2]
-                tag = m['tag']
-                if (m2 := TITLE_ID_RGX.fullmatch(body)) and close == f'</{tag}>':
-                    title = m2['title']
-                    id = m2['id']
-                    i += 2  # Skip the body and closing tag
-                else:
-                    i += 1
-                    continue
+# Bytes (or lines, for iterables of lines) to decode / join and scan at a time
+CHUNK_SIZE = 2**20
+CHUNK_LINES = 2**14
+
+Source = Union[str, bytes, mmap.mmap, Iterable[str]]
+
+
+def slugify(title: str) -> str:
+    """GitHub's "id" for a heading with text ``title``: HTML tags and link targets are removed, and the text is
+    lower-cased, stripped of punctuation (except ``-`` and ``_``), and has spaces replaced with ``-``."""
+    text = strip_links(HTML_TAG_RGX.sub('', title)).strip()
+    return SLUG_DROP_RGX.sub('', text.lower()).replace(' ', '-')
+
+
+def strip_links(title: str) -> str:
+    """Replace Markdown links in ``title`` with their text."""
+    return LINK_RGX.sub(r'\1', title) if '[' in title else title
+
+
+class Slugger:
+    """Dedupe slugs the way GitHub does: repeats of a slug get ``-1``, ``-2``, etc. appended."""
+    def __init__(self):
+        self.seen: dict[str, int] = {}
+
+    def __call__(self, slug: str) -> str:
+        if slug not in self.seen:
+            self.seen[slug] = 0
+            return slug
+        base = slug
+        while slug in self.seen:
+            self.seen[base] += 1
+            slug = f'{base}-{self.seen[base]}'
+        self.seen[slug] = 0
+        return slug
+
+
+class Heading(NamedTuple):
+    level: int
+    title: str
+    id: Optional[str]  # `<a id>` anchor (if any); set to the GitHub-generated id by `iter_headings` (with `auto_ids`)
+    line: int  # 0-based index of the heading's (first) line
+    offset: int  # Offset of the heading's (first) line, in the source's units (bytes for bytes sources, else characters)
+    html: bool = False  # `<hN>` heading (GitHub doesn't generate ids for these)
+
+
+def iter_chunks(source: Source) -> Iterator[Union[str, bytes]]:
+    """Split ``source`` into chunks of whole lines (each ending with a newline, except possibly the last); bytes sources
+    are split into (un-decoded) bytes chunks, others into strings."""
+    if isinstance(source, str):
+        yield source
+    elif isinstance(source, (bytes, bytearray, mmap.mmap)):
+        pos, size = 0, len(source)
+        while pos < size:
+            end = source.find(b'\n', pos + CHUNK_SIZE)
+            end = size if end < 0 else end + 1
+            yield bytes(source[pos:end])
+            pos = end
+    else:
+        lines = iter(source)
+        while batch := list(islice(lines, CHUNK_LINES)):
+            yield ''.join(batch) if batch[0].endswith('\n') else '\n'.join(batch) + '\n'
+
+
+class Scanner:
+    """Find headings (of all levels, with or without anchors) in a document, skipping code fences.
+
+    ``fence`` is the code fence (if any) open at the start of the document; after :meth:`scan`, it's the one open at
+    the end (which lets a document be scanned in independent pieces, as :mod:`toc.index` does). If ``fences`` is set,
+    the ``(start, end)`` offsets of fenced code blocks (from their opening line through their closing line) are
+    appended to :attr:`fences`.
+    """
+    def __init__(self, fence: Optional[str] = None, fences: bool = False):
+        self.fence = fence
+        self.fences: Optional[list[tuple[int, int]]] = [] if fences else None
+        # Offset of the open fence's opening line
+        self.fence_start = 0
+
+    def scan(self, source: Source) -> Iterator[Heading]:
+        """Yield the headings in ``source``, in one pass."""
+        # Unscanned text, from the newline before its first line (whose index is `line`, and offset `base + 1`)
+        carry, line, base = None, 0, -1
+        for chunk in chain(iter_chunks(source), [ None ]):
+            if chunk is None:
+                if carry is None:
+                    return
+                text = carry
+                cut = len(text)
+            else:
+                if carry is None:
+                    carry = b'\n' if isinstance(chunk, bytes) else '\n'
+                text = carry + chunk
+                # The last two lines may be the start of an HTML heading, and are scanned with the next chunk
+                cut = len(text)
+                for _ in range(3):
+                    cut = text.rfind(carry[:1], 0, cut)
+                    if cut <= 0:
+                        cut = 0
+                        break
+            yield from self.scan_text(text, line, base, cut)
+            if chunk is None and self.fence and self.fences is not None:
+                # Unclosed fences run to the end of the document
+                self.fences.append((self.fence_start, base + len(text)))
+            base += self.stop
+            line = self.stop_line
+            carry = text[self.stop:]
+
+    def scan_text(self, text: Union[str, bytes], line: int, base: int, cut: int) -> Iterator[Heading]:
+        """Yield headings from lines of ``text`` (which starts with the newline before its first line) that start
+        before ``cut``; then set :attr:`stop` (the position scanning stopped at) and :attr:`stop_line` (its line)."""
+        is_bytes = not isinstance(text, str)
+        rgx, nl = (LINE_BYTES_RGX, b'\n') if is_bytes else (LINE_RGX, '\n')
+        # Search from `pos`; lines have been counted through `lpos`
+        pos, lpos, end = 0, 0, 0
+        if self.fence:
+            # Skip to the end of the fence open at the start of `text`
+            if m := close_fence_rgx(self.fence, is_bytes).search(text):
+                self.fence = None
+                pos = end = m.end()
+                if self.fences is not None:
+                    self.fences.append((self.fence_start, base + end))
             else:
-                i += 1
+                pos = len(text)
+        search = rgx.search
+        while m := search(text, pos):
+            start = m.start()
+            if start >= cut:
+                break
+            pos = m.end()
+            # The last group matched identifies the alternative: `html_id`, `heading`, `block` (fence, and its contents)
+            # or `info` (a fence that isn't closed in `text`)
+            kind = m.lastgroup
+            if kind == 'block' or kind == 'info':
+                fence, info = m.group('fence', 'info')
+                if is_bytes:
+                    fence, info = fence.decode(), info.decode()
+                if fence[0] == '`' and '`' in info:
+                    # Backtick fences' info strings can't contain backticks (that's inline code); resume after this line
+                    pos = m.end('info')
+                    continue
+                if kind == 'block':
+                    end = pos
+                    if self.fences is not None:
+                        self.fences.append((base + start + 1, base + end))
+                    continue
+                # The rest of `text` is fenced
+                self.fence = fence
+                self.fence_start = base + start + 1
+                pos = len(text)
+                break
+            line += text.count(nl, lpos, start)
+            lpos = start
+            offset = base + start + 1
+            if kind == 'html_id':
+                end = pos
+                title, id = m.group('html_title', 'html_id')
+                if is_bytes:
+                    title, id = title.decode(), id.decode()
+                yield Heading(int(m['tag'][1:]), title, id, line, offset, True)
                 continue
-        else:
-            i += 1
+            hashes, title = m.group('hashes', 'title')
+            if title is None:
+                title = ''
+            elif is_bytes:
+                title = title.decode()
+            if h := parse_heading(len(hashes), title.strip(), line, offset):
+                yield h
+        self.stop = max(cut, end)
+        self.stop_line = line + text.count(nl, lpos, self.stop)
+
+
+@lru_cache
+def close_fence_rgx(fence: str, is_bytes: bool = False) -> re.Pattern:
+    """Match the line closing a code fence opened by ``fence`` (e.g. ``````` or ``~~~~``)."""
+    pattern = r'\n[ \t]*' + re.escape(fence) + re.escape(fence[0]) + r'*[ \t]*\r?$'
+    return re.compile(pattern.encode() if is_bytes else pattern, re.M)
+
+
+def parse_heading(level: int, title: str, line: int, offset: int) -> Optional[Heading]:
+    """Parse a Markdown heading's (stripped) ``title``: ``##``+ headings can end with an ``<a id="..."></a>`` anchor, and
+    others (of up to 6 ``#``s) with a closing sequence of ``#``s (which isn't part of the title)."""
+    if level >= 2 and title.endswith('"></a>') and (idx := title.rfind(' <a id="')) >= 0:
+        id = title[idx + len(' <a id="'):-len('"></a>')]
+        if id and '"' not in id:
+            return Heading(level, title[:idx], id, line, offset)
+    if level > 6:
+        return None
+    if title.endswith('#'):
+        unclosed = title.rstrip('#')
+        if not unclosed or unclosed[-1] in ' \t':
+            title = unclosed.rstrip(' \t')
+    return Heading(level, title, None, line, offset)
+
+
+def scan_headings(source: Source) -> Iterator[Heading]:
+    """Yield all headings in ``source`` (see :class:`Scanner`)."""
+    return Scanner().scan(source)
+
+
+def resolve(headings: Iterable[Heading], auto_ids: bool = False) -> Iterator[Heading]:
+    """Select the TOC-able ``headings`` (with their links replaced by link text).
+
+    Those are ``##``+ Markdown headings with an ``<a id="..."></a>`` anchor, or HTML headings of the form::
+
+        <h2>
+        Title <a id="..."></a>
+        </h2>
+
+    With ``auto_ids``, other ``##``+ Markdown headings are also included, with their GitHub-generated ids. Every Markdown
+    heading (including ``#`` headings, and ones with explicit anchors) counts toward GitHub's slug deduplication.
+    """
+    slugger = Slugger()
+    for h in headings:
+        id = h.id
+        if auto_ids and not h.html:
+            slug = slugger(slugify(h.title))
+            if id is None and h.level >= 2:
+                id = slug
+        if id is None:
             continue
+        if id is h.id and '[' not in h.title:
+            yield h
+        else:
+            yield Heading(h.level, strip_links(h.title), id, h.line, h.offset, h.html)
 
-        # Remove markdown links but keep link text
-        title = re.sub(r'\[([^]]+)](?:\([^)]+\))?', r'\1', title)
 
-        # Calculate indentation (level 2 headers have no indent)
-        indent = ' ' * (indent_size * (level - 2))
-        lines.append(f'{indent}- [{title}](#{id})')
-        i += 1
+def iter_headings(source: Source, auto_ids: bool = False) -> Iterator[Heading]:
+    """Yield the TOC-able headings in ``source`` (see :func:`resolve`), in one pass."""
+    return resolve(scan_headings(source), auto_ids=auto_ids)
 
-    return '\n'.join(lines)
+
+@contextmanager
+def mapped(path: Union[str, Path]) -> Iterator[Union[mmap.mmap, bytes]]:
+    """Memory-map ``path``, read-only (empty files can't be mapped, and are returned as ``b''``)."""
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b''
+            return
+        with mm:
+            yield mm
+
+
+def format_toc(
+    headings: Iterable[Heading],
+    indent_size: int = 4,
+    auto_ids: bool = False,
+) -> str:
+    """Format a TOC from a document's ``headings`` (as yielded by :func:`scan_headings`)."""
+    return '\n'.join(
+        # Level 2 headers have no indent
+        f'{" " * (indent_size * (h.level - 2))}- [{h.title}](#{h.id})'
+        for h in resolve(headings, auto_ids=auto_ids)
+    )
+
+
+def generate_toc(
+    content: Source,
+    indent_size: int = 4,
+    auto_ids: bool = False,
+) -> str:
+    """Generate TOC from markdown content (see :func:`resolve`), matching mktoc's behavior."""
+    return format_toc(scan_headings(content), indent_size=indent_size, auto_ids=auto_ids)
 
 
 @command()
+@option('-a', '--auto-ids', is_flag=True, help="Also include headings without <a id> anchors, linking to their GitHub-generated ids")
+@option('-I', '--index/--no-index', default=None, help="Read headings from (and update) a persistent per-file index, only rescanning sections that changed; falls back to $TOC_INDEX")
+@option('-l', '--check-links', is_flag=True, help="With -t/--tree: instead of a TOC, print links whose target file or #anchor doesn't exist (and exit 1 if there are any)")
 @option('-n', '--indent-size', type=int, default=4, help="Indent size (spaces)")
+@option('-p', '--procs', type=int, help="With -t/--tree: scan files across this many worker processes (default: the number of CPUs)")
+@option('-t', '--tree', type=click.Path(exists=True, file_okay=False), help="Generate a TOC of all *.md files under this directory (and their headings)")
 @argument('path', required=False, type=click.Path(exists=True))
 def main(
+    auto_ids: bool = False,
+    index: Optional[bool] = None,
+    check_links: bool = False,
     indent_size: int = 4,
+    procs: Optional[int] = None,
+    tree: Optional[str] = None,
     path: str = None,
 ):
     """Generate a table of contents from a markdown file.
 
     If no PATH is provided, will try to use $MDCMD_FILE (set by mdcmd),
     or default to README.md if that's not set.
+
+    With -t/--tree DIR, generate a TOC spanning all the *.md files under DIR
+    (or, with -l/--check-links, report their broken links).
     """
     import os
+    from toc.index import HeadingIndex, TOC_INDEX_VAR
+
+    if tree:
+        if path:
+            raise click.UsageError('PATH and -t/--tree are mutually exclusive')
+        from toc.tree import check_links as find_broken_links, format_tree, scan_tree
+
+        files = scan_tree(tree, procs)
+        if not check_links:
+            print(format_tree(files, indent_size=indent_size, auto_ids=auto_ids))
+            return
+        broken = find_broken_links(tree, files)
+        for link in broken:
+            print(link)
+        if broken:
+            print(f'{len(broken)} broken link(s), in {len({ link.path for link in broken })} file(s)', file=sys.stderr)
+            sys.exit(1)
+        return
+    elif check_links or procs:
+        raise click.UsageError('-l/--check-links and -p/--procs require -t/--tree')
 
     if path:
         # Explicit path provided
@@ -86,12 +362,16 @@ def main(
         # Default to README.md
         path_obj = Path('README.md')
 
-    if path_obj.exists():
-        content = path_obj.read_text()
-    else:
-        content = sys.stdin.read()
+    if index is None:
+        index = bool(os.environ.get(TOC_INDEX_VAR))
 
-    toc = generate_toc(content, indent_size=indent_size)
+    if not path_obj.exists():
+        toc = generate_toc(sys.stdin, indent_size=indent_size, auto_ids=auto_ids)
+    elif index:
+        toc = format_toc(HeadingIndex().headings(str(path_obj)), indent_size=indent_size, auto_ids=auto_ids)
+    else:
+        with mapped(path_obj) as content:
+            toc = generate_toc(content, indent_size=indent_size, auto_ids=auto_ids)
     print(toc)
 
 
@@ -0,0 +1,128 @@
+"""Persistent, incrementally-updated index of the headings in Markdown files.
+
+Each file's index is stored as JSON under ``<root>/<sha256(abspath)>.json`` (``root`` defaults to ``toc/`` in
+``mdcmd``'s cache directory), and records the file's content hash and its headings (level, title, anchor, line and byte
+offset), grouped by "section": the file is split before each ``## `` line, and each section's headings are stored with
+its hash, and the code fence (if any) open at its start and end.
+
+When a file is indexed again:
+
+- if its size, mtime and inode are unchanged, or its content hash is, its stored headings are returned as-is;
+- otherwise, only sections whose hash (and starting fence) aren't in the previous index are scanned.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import re
+from hashlib import sha256
+from os import makedirs, replace, stat
+from os.path import abspath, join
+from tempfile import NamedTemporaryFile
+from typing import Optional, Union
+
+from toc import Heading, Scanner, mapped
+
+TOC_INDEX_VAR = 'TOC_INDEX'
+INDEX_VERSION = 1
+
+# Sections start at level-2 headings
+SECTION_RGX = re.compile(rb'\n(?=## )')
+
+
+def default_dir() -> str:
+    from mdcmd.cache import default_dir as cache_dir
+    return join(cache_dir(), 'toc')
+
+
+class HeadingIndex:
+    """Map Markdown files to their headings (see module docstring)."""
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or default_dir()
+        # Sections scanned / reused by the most recent `headings` call
+        self.scanned = 0
+        self.reused = 0
+
+    def entry_path(self, path: str) -> str:
+        return join(self.root, sha256(abspath(path).encode()).hexdigest() + '.json')
+
+    def load(self, path: str) -> Optional[dict]:
+        try:
+            with open(self.entry_path(path), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return entry if entry.get('version') == INDEX_VERSION else None
+
+    def save(self, path: str, entry: dict):
+        makedirs(self.root, exist_ok=True)
+        # Write to a sibling temp file and rename, so that concurrent readers never see partial entries
+        with NamedTemporaryFile('w', dir=self.root, delete=False, encoding='utf-8') as f:
+            # (`json.dumps` uses the C encoder, `json.dump` doesn't)
+            f.write(json.dumps(entry))
+        replace(f.name, self.entry_path(path))
+
+    def headings(self, path: str) -> list[Heading]:
+        """Return all headings in the Markdown file at ``path`` (as :func:`toc.scan_headings` would), updating its
+        index."""
+        st = stat(path)
+        sig = [ st.st_size, st.st_mtime_ns, st.st_ino ]
+        self.scanned = self.reused = 0
+        entry = self.load(path)
+        if entry and entry['stat'] == sig:
+            self.reused = len(entry['sections'])
+            return assemble(entry['sections'])
+        with mapped(path) as mm:
+            with memoryview(mm) as view:
+                digest = sha256(view).hexdigest()
+            if entry and entry['hash'] == digest:
+                self.reused = len(entry['sections'])
+            else:
+                entry = dict(hash=digest, sections=self.update(mm, entry['sections'] if entry else []))
+        entry.update(version=INDEX_VERSION, stat=sig)
+        self.save(path, entry)
+        return assemble(entry['sections'])
+
+    def update(self, data: Union[bytes, mmap.mmap], prev_sections: list[dict]) -> list[dict]:
+        """Split ``data`` into sections, reusing ``prev_sections`` that are unchanged, and scanning the rest."""
+        prev = { (section['hash'], section['fence_in']): section for section in prev_sections }
+        starts = [ 0, *( m.end() for m in SECTION_RGX.finditer(data) ) ]
+        ends = [ *starts[1:], len(data) ]
+        sections = []
+        fence = None
+        with memoryview(data) as view:
+            for start, end in zip(starts, ends):
+                with view[start:end] as chunk:
+                    key = sha256(chunk).hexdigest(), fence
+                if section := prev.get(key):
+                    self.reused += 1
+                else:
+                    self.scanned += 1
+                    text = data[start:end]
+                    scanner = Scanner(fence)
+                    headings = [ list(h) for h in scanner.scan(text) ]
+                    section = dict(
+                        hash=key[0],
+                        fence_in=fence,
+                        fence_out=scanner.fence,
+                        size=end - start,
+                        lines=text.count(b'\n'),
+                        headings=headings,
+                    )
+                    # Later sections with the same contents (and starting fence) are scanned once
+                    prev[key] = section
+                fence = section['fence_out']
+                sections.append(section)
+        return sections
+
+
+def assemble(sections: list[dict]) -> list[Heading]:
+    """Concatenate ``sections``' headings, offsetting their (section-relative) lines and byte offsets."""
+    headings = []
+    line = offset = 0
+    for section in sections:
+        for level, title, id, h_line, h_offset, html in section['headings']:
+            headings.append(Heading(level, title, id, line + h_line, offset + h_offset, html))
+        line += section['lines']
+        offset += section['size']
+    return headings
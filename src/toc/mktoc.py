@@ -1,20 +1,51 @@
+
 from __future__ import annotations
 
 import sys
-from os import environ as env
-from os.path import exists
-from typing import Optional
+from os import environ as env, getcwd, rename
+from os.path import basename, join
+from typing import Callable, Optional
 
-from click import argument, command, option, UsageError, Context
+from click import argument, command, option, UsageError
 
-from bmdf.utils import amend_opt, inplace_opt, no_cwd_tmpdir_opt
+from bmdf.utils import amend_check, amend_opt, amend_run, inplace_opt, no_cwd_tmpdir_opt
+from mdcmd.parse import Block, STDIN, split_doc
 
 DEFAULT_FILE_ENV_VAR = 'MKTOC_DEFAULT_PATH'
 DEFAULT_FILE = 'README.md'
 
+
+def update_toc(text: str, toc: Callable[[], str]) -> Optional[str]:
+    """Replace the old contents of each ``<!-- `toc` -->`` block in ``text`` with ``toc()`` (called at most once).
+
+    Everything outside the blocks' old contents is copied verbatim. Returns ``None`` if a block has options (e.g.
+    ``head=``), which are left to ``mdcmd``.
+    """
+    pieces = []
+    pos = 0
+    output = None
+    for item in split_doc(text, lambda cmd_str: cmd_str == 'toc'):
+        if not isinstance(item, Block):
+            continue
+        if item.opts:
+            return None
+        if output is None:
+            output = toc()
+        start, end, _, _ = item.spans.old
+        pieces.append(text[pos:start])
+        if text[start - 1] != '\n':
+            # The `<!-- `toc` -->` line is the last one, and has no newline
+            pieces.append('\n')
+        pieces.extend( line + '\n' for line in item.new_lines(output) )
+        pos = end
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+
 @command("mktoc")
 @amend_opt
 @inplace_opt
+@option('-I', '--index/--no-index', default=None, help="Read headings from (and update) a persistent per-file index, only rescanning sections that changed; falls back to $TOC_INDEX")
 @option('-n', '--indent-size', type=int, default=4, help="Indent size (spaces)")
 @no_cwd_tmpdir_opt
 @argument('path', required=False)
@@ -22,6 +53,7 @@ DEFAULT_FILE = 'README.md'
 def main(
     amend: bool,
     inplace: Optional[bool],
+    index: Optional[bool],
     indent_size: int,
     no_cwd_tmpdir: bool,
     path: Optional[str],
@@ -29,40 +61,68 @@ def main(
 ):
     """Insert a table of contents (TOC) in a markdown file.
 
-    This is a convenience wrapper around ``mdcmd -x '^toc$'``.
-
-    Looks for ``<!-- `toc` -->`` markers and replaces the content after them with a generated TOC.
+    Looks for ``<!-- `toc` -->`` markers and replaces the content after them with a generated TOC (like ``mdcmd -x
+    '^toc$'``, but in-process, and only rewriting the file if a TOC changed).
 
     If no ``out_path`` is provided, will operate "in-place" on ``README.md`` (as if ``mktoc -i README.md`` was passed).
     """
-    # Import mdcmd.cli locally to avoid circular imports
-    from mdcmd.cli import main as mdcmd_main
+    from toc import format_toc, generate_toc
+    from toc.index import HeadingIndex, TOC_INDEX_VAR
 
     if not path:
         path = env.get(DEFAULT_FILE_ENV_VAR, DEFAULT_FILE)
         if inplace is None:
             inplace = True
+    if inplace and out_path:
+        raise UsageError('Cannot specify both --inplace and an output path')
+    if index is None:
+        index = bool(env.get(TOC_INDEX_VAR))
+
+    amend_check(amend)
+
+    text = None
+    if path != STDIN:
+        with open(path, 'r') as f:
+            text = f.read()
+
+        def toc() -> str:
+            if index:
+                return format_toc(HeadingIndex().headings(path), indent_size=indent_size)
+            return generate_toc(text, indent_size=indent_size)
+
+        new_text = update_toc(text, toc)
+
+    if text is None or new_text is None:
+        # Read from stdin, or blocks with options: fall back to `mdcmd`
+        from mdcmd.cli import main as mdcmd_main
+
+        args = [ '-x', '^toc$' ]
+        if inplace:
+            args.append('-i')
+        if no_cwd_tmpdir:
+            args.append('-T')
+        args.append(path)
+        if out_path:
+            args.append(out_path)
+        # Passed to `toc` via its env var
+        env[TOC_INDEX_VAR] = '1' if index else ''
+        mdcmd_main(args, standalone_mode=False)
+    elif inplace:
+        if new_text != text:
+            from tempfile import TemporaryDirectory
+
+            with TemporaryDirectory(dir=None if no_cwd_tmpdir else getcwd()) as tmpdir:
+                tmp_path = join(tmpdir, basename(path))
+                with open(tmp_path, 'w') as f:
+                    f.write(new_text)
+                rename(tmp_path, path)
+    elif not out_path or out_path == '-':
+        sys.stdout.write(new_text)
+    else:
+        with open(out_path, 'w') as f:
+            f.write(new_text)
 
-    # Don't check exists() here - let mdcmd handle it
-    # This allows for proper error messages and handling in different directories
-
-    # Build mdcmd arguments
-    args = ['-x', '^toc$']
-    if amend:
-        args.append('-a')
-    if inplace:
-        args.append('-i')
-    if no_cwd_tmpdir:
-        args.append('-T')
-    args.append(path)
-    if out_path:
-        args.append(out_path)
-
-    # Note: indent_size is currently ignored since the toc command
-    # in bmdf.toc uses its own default of 4 spaces
-
-    # Call mdcmd with the appropriate arguments
-    mdcmd_main(args, standalone_mode=False)
+    amend_run(amend)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,163 @@
+"""Index the Markdown files in a directory tree: generate a TOC spanning all of them, or check the links between them.
+
+Files are scanned (see :class:`toc.Scanner`) across a pool of worker processes. Each file's "anchors" are the ids of
+its headings (explicit ``<a id>``s, and GitHub's generated ids for Markdown headings), and any other ``<a id="...">`` /
+``<a name="...">`` tags. Links are Markdown inline links / images (``[text](target)``) and reference definitions
+(``[ref]: target``), outside code fences; a link is broken if its target is a relative path that doesn't exist, or has
+a ``#fragment`` that isn't an anchor in the target (Markdown) file. Broken links in the output of an ``mdcmd`` command
+block (see :mod:`mdcmd.blocks`) are reported with the block's command, since that's where they need to be fixed.
+"""
+from __future__ import annotations
+
+import re
+from bisect import bisect_right
+from functools import partial
+from glob import glob
+from os.path import dirname, exists, join, normpath, relpath, sep
+from typing import NamedTuple, Optional
+from urllib.parse import quote, unquote
+
+from mdcmd.blocks import index_blocks
+from toc import Heading, Scanner, Slugger, resolve, slugify, strip_links
+
+LINK_RGX = re.compile(rb'''
+    # Inline link / image: `[text](target)`, or `[text](target "title")`
+    \]\((?P<target><[^>\n]*>|[^()\s]+)(?:[ \t]+"[^"\n]*")?\)
+    # Reference definition: `[ref]: target`
+  | \n[ ]{0,3}\[[^\]\n]+\]:[ \t]*(?P<ref><[^>\n]*>|\S+)
+''', re.X)
+ANCHOR_RGX = re.compile(rb'<a\s+(?:id|name)="([^"]+)"')
+# URL scheme (`https:`, `mailto:`, etc.)
+SCHEME_RGX = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*:')
+# GitHub line-number fragments (e.g. `#L10`, `#L10-L20`)
+LINES_FRAGMENT_RGX = re.compile(r'L\d+(?:-L\d+)?')
+
+
+class Link(NamedTuple):
+    line: int
+    target: str
+    # Command whose output (in an `mdcmd` block) contains the link
+    cmd: Optional[str] = None
+
+
+class FileIndex(NamedTuple):
+    path: str  # Relative to the tree's root
+    headings: list[Heading]
+    anchors: set[str]
+    links: list[Link]
+
+
+class BrokenLink(NamedTuple):
+    path: str
+    line: int
+    target: str
+    reason: str
+    cmd: Optional[str] = None
+
+    def __str__(self):
+        suffix = f' (in `{self.cmd}` output)' if self.cmd else ''
+        return f'{self.path}:{self.line + 1}: {self.target}: {self.reason}{suffix}'
+
+
+def find_files(root: str) -> list[str]:
+    """``*.md`` files under ``root`` (relative to it)."""
+    return sorted(relpath(path, root) for path in glob(join(root, '**', '*.md'), recursive=True))
+
+
+def scan_file(root: str, path: str) -> FileIndex:
+    """Scan ``path`` (relative to ``root``) for headings, anchors and links."""
+    with open(join(root, path), 'rb') as f:
+        data = f.read()
+    scanner = Scanner(fences=True)
+    headings = list(scanner.scan(data))
+    slugger = Slugger()
+    anchors = { h.id for h in headings if h.id }
+    anchors.update(slugger(slugify(h.title)) for h in headings if not h.html)
+    anchors.update(m[1].decode() for m in ANCHOR_RGX.finditer(data) if not fenced(scanner.fences, m.start()))
+    try:
+        blocks = [ (block.old.start, block.old.end, block.cmd_str) for block in index_blocks(data) ]
+    except ValueError:
+        # Malformed command blocks (which `mdcmd` would reject) are treated as static text
+        blocks = []
+    links = []
+    line, lpos = 0, 0
+    for m in LINK_RGX.finditer(data):
+        kind = 'target' if m['target'] else 'ref'
+        start = m.start(kind)
+        if fenced(scanner.fences, start):
+            continue
+        line += data.count(b'\n', lpos, start)
+        lpos = start
+        idx = bisect_right(blocks, (start, float('inf'))) - 1
+        cmd = blocks[idx][2] if idx >= 0 and start < blocks[idx][1] else None
+        links.append(Link(line, m[kind].decode().strip('<>'), cmd))
+    return FileIndex(path, headings, anchors, links)
+
+
+def fenced(fences: list[tuple[int, int]], offset: int) -> bool:
+    """Whether ``offset`` is inside one of the (sorted, disjoint) ``fences`` spans."""
+    idx = bisect_right(fences, (offset, float('inf'))) - 1
+    return idx >= 0 and offset < fences[idx][1]
+
+
+def scan_tree(root: str, procs: Optional[int] = None) -> list[FileIndex]:
+    """Scan the ``*.md`` files under ``root``, across ``procs`` worker processes (default: the number of CPUs)."""
+    from os import cpu_count
+
+    paths = find_files(root)
+    procs = min(procs or cpu_count() or 1, len(paths))
+    if procs <= 1:
+        return [ scan_file(root, path) for path in paths ]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=procs) as executor:
+        return list(executor.map(partial(scan_file, root), paths, chunksize=max(1, len(paths) // (4 * procs))))
+
+
+def format_tree(files: list[FileIndex], indent_size: int = 4, auto_ids: bool = False) -> str:
+    """A nested TOC of ``files``: directories, files (titled by their first ``#`` heading, if any), and their headings
+    (see :func:`toc.resolve`). Links are relative to the tree's root."""
+    lines = []
+    indent = ' ' * indent_size
+    prev_dirs: list[str] = []
+    for file in files:
+        *dirs, _ = file.path.split(sep)
+        common = 0
+        while common < min(len(dirs), len(prev_dirs)) and dirs[common] == prev_dirs[common]:
+            common += 1
+        for depth in range(common, len(dirs)):
+            lines.append(f'{indent * depth}- {dirs[depth]}/')
+        prev_dirs = dirs
+        depth = len(dirs)
+        url = quote('/'.join(file.path.split(sep)))
+        title = next(( strip_links(h.title) for h in file.headings if h.level == 1 and not h.html ), file.path)
+        lines.append(f'{indent * depth}- [{title}]({url})')
+        for h in resolve(file.headings, auto_ids=auto_ids):
+            lines.append(f'{indent * (depth + h.level - 1)}- [{h.title}]({url}#{h.id})')
+    return '\n'.join(lines)
+
+
+def check_links(root: str, files: list[FileIndex]) -> list[BrokenLink]:
+    """Find links in ``files`` whose targets don't exist (see module docstring)."""
+    anchors = { file.path: file.anchors for file in files }
+    broken = []
+    for file in files:
+        for link in file.links:
+            target = link.target
+            if SCHEME_RGX.match(target) or target.startswith('//'):
+                continue
+            path, _, fragment = target.partition('#')
+            path = unquote(path.partition('?')[0])
+            fragment = unquote(fragment)
+            if not path:
+                dest = file.path
+            elif path.startswith('/'):
+                # Relative to the tree's root (like GitHub's repo-root-relative links)
+                dest = normpath(path.lstrip('/'))
+            else:
+                dest = normpath(join(dirname(file.path), path))
+            if dest in anchors:
+                if fragment and fragment not in anchors[dest] and not LINES_FRAGMENT_RGX.fullmatch(fragment):
+                    broken.append(BrokenLink(file.path, link.line, target, f'no anchor "#{fragment}" in {dest}', link.cmd))
+            elif not exists(join(root, dest)):
+                broken.append(BrokenLink(file.path, link.line, target, f'{dest} not found', link.cmd))
+    return broken
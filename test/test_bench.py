@@ -0,0 +1,49 @@
+"""Smoke-test the benchmark suite (on a tiny corpus)."""
+import json
+import sys
+from os.path import join
+from subprocess import run
+from tempfile import TemporaryDirectory
+
+from test.utils import ROOT
+
+
+def test_suite():
+    with TemporaryDirectory() as tmpdir:
+        out_path = join(tmpdir, 'results.jsonl')
+        cmd = [ sys.executable, 'bench/suite.py', '-b', '3', '-l', '100', '-n', '100', '-r', '1', '-o', out_path ]
+        for _ in range(2):
+            proc = run(cmd, cwd=ROOT, capture_output=True, text=True)
+            assert proc.returncode == 0, proc.stderr
+        # The second run is compared against the first
+        assert 'compared with' in proc.stdout
+        with open(out_path, 'r') as f:
+            entries = [ json.loads(line) for line in f ]
+    assert len(entries) == 2
+    results = entries[-1]['results']
+    assert set(results) == { 'parse', 'sched', 'assemble', 'process_path', 'generate_toc', 'bmd' }
+    assert results['parse']['blocks'] == 4  # 3 command blocks, plus `toc`
+    assert results['process_path']['blocks'] == 4
+    assert results['bmd']['output_size'] == len('# y\n' * 100)
+
+
+def test_ansi():
+    # Checks that AnsiStream's output matches the regex's; speed is only compared when the benchmark is run standalone
+    proc = run([ sys.executable, 'bench/ansi.py', '-m', '1', '-r', '1', '--no-speed-check' ], cwd=ROOT, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert 'as fast as the regex' in proc.stdout
+
+
+def test_toc_gen():
+    # Checks that all implementations agree; speed is only compared when the benchmark is run standalone
+    proc = run([ sys.executable, 'bench/toc_gen.py', '-s', '5000', '-r', '1', '--no-speed-check' ], cwd=ROOT, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert 'as fast as the legacy implementation' in proc.stdout
+
+
+def test_blocks():
+    # Checks that `split_doc` matches the legacy implementation, and that every fuzzed shape parses; linear time is only
+    # checked when the benchmark is run standalone
+    proc = run([ sys.executable, 'bench/blocks.py', '-b', '200', '-l', '2000', '-r', '1', '--no-speed-check' ], cwd=ROOT, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert 'as fast as the legacy implementation' in proc.stdout
@@ -1,6 +1,13 @@
-from io import StringIO
+import re
+import sys
+from io import BytesIO, StringIO
+from time import perf_counter
+
+from click import ClickException
 
 from bmdf.cli import bmd
+from bmdf.pipeline import Pipeline, iter_line_batches
+from bmdf.utils import truncate
 
 import pytest
 parametrize = pytest.mark.parametrize
@@ -25,3 +32,139 @@ def test_env_vars(args, envs, opts, expected):
         file=file,
     )
     assert file.getvalue() == expected
+
+
+def test_iter_line_batches():
+    data = 'a\n\nhé\nunterminated é'.encode()
+    # Read one byte at a time, splitting multi-byte characters across reads
+    batches = list(iter_line_batches(BytesIO(data), chunk_size=1))
+    assert [ line for lines in batches for line in lines ] == [ 'a', '', 'hé', 'unterminated é' ]
+    assert list(iter_line_batches(BytesIO(b'\xff\n'))) == [ [ '�' ] ]
+    assert list(iter_line_batches(BytesIO(b''))) == []
+
+
+def test_pipeline():
+    with Pipeline([ [ 'seq', '5' ], [ 'sh', '-c', 'head -n 2; exit 3' ], [ 'tac' ] ]) as pipeline:
+        assert [ line for lines in pipeline.line_batches() for line in lines ] == [ '2', '1' ]
+    assert pipeline.returncodes == [ 0, 3, 0 ]
+
+
+STATS_RGX = r'real \d+\.\d\ds, user (?P<user>\d+\.\d\d)s, sys \d+\.\d\ds, max RSS (?P<rss>\d+\.\d)MiB, block I/O \d+ in / \d+ out'
+
+
+def test_pipeline_usage():
+    burn = 'import time; end = time.process_time() + 0.2\nwhile time.process_time() < end: pass'
+    with Pipeline([ [ sys.executable, '-c', burn ], [ sys.executable, '-c', f'{burn}\nx = bytearray(64 << 20)' ] ]) as pipeline:
+        assert list(pipeline.line_batches()) == []
+    assert [ usage.exit_code for usage in pipeline.usages ] == [ 0, 0 ]
+    usage = pipeline.usage
+    assert usage.user + usage.sys >= 0.4
+    assert usage.max_rss >= 64 << 20
+    assert pipeline.wall >= 0.2
+
+
+@parametrize(
+    "fence_level,expected",
+    [
+        (0, f"# 1\n# 2\n# {STATS_RGX}\n"),
+        (2, f"```bash\nseq 2\n```\n```\n1\n2\n{STATS_RGX}\n```\n"),
+        (3, f"<details><summary><code>seq 2</code> \\({STATS_RGX}\\)</summary>\n\n```\n1\n2\n```\n</details>\n"),
+    ],
+)
+def test_stats(fence_level, expected):
+    file = StringIO()
+    bmd.callback(('seq', '2'), stats=True, fence_level=fence_level, no_copy=True, file=file)
+    assert re.fullmatch(expected, file.getvalue()), file.getvalue()
+
+
+def test_repeat(tmp_path):
+    path = str(tmp_path / 'runs')
+    # Count the runs, in a file
+    cmd = ('echo', 'x', '>>', path, ';', 'wc', '-l', '<', path)
+    file = StringIO()
+    bmd.callback(cmd, repeat=4, warmup=2, no_copy=True, file=file)
+    # The first timed run's output is printed (after 2 warmup runs)
+    output, timings = file.getvalue().split('\n', 1)
+    assert output == '# 3'
+    ms = r'\d+\.\dms|\d+µs|\d+\.\d{3}s'
+    assert re.fullmatch(f'# 4 runs: ({ms}) ± ({ms}) \\(min ({ms}), max ({ms})\\)\n', timings), timings
+    with open(path) as f:
+        assert len(f.readlines()) == 6
+
+    with pytest.raises(ClickException, match=r"Output of run 2 \(of 3\) differed from run 1's"):
+        bmd.callback(cmd, repeat=3, fail_on_diff=True, no_copy=True, file=StringIO())
+    bmd.callback(('seq', '3'), repeat=3, fail_on_diff=True, no_copy=True, file=StringIO())
+
+
+def test_pipeline_both():
+    # Enough output on both streams to fill their pipes' buffers, if they weren't drained concurrently
+    n = 200_000
+    script = f'import sys\nfor i in range({n}): print(i); print("e" + str(i), file=sys.stderr)'
+    with Pipeline([ [ sys.executable, '-c', script ], [ 'cat' ] ], both=True) as pipeline:
+        lines = [ line for lines in pipeline.line_batches() for line in lines ]
+    assert len(lines) == 2 * n
+    assert [ line for line in lines if not line.startswith('e') ] == [ str(i) for i in range(n) ]
+
+
+def test_pipeline_arrival_order():
+    # Lines alternate between stdout and stderr, with no pauses between them; they're merged in the order written
+    n = 200
+    script = f'for i in $(seq {n}); do echo out$i; echo err$i >&2; done'
+    for _ in range(5):
+        file = StringIO()
+        bmd.callback(('bash', '-c', script), include_stderr=True, shell=False, no_copy=True, file=file)
+        assert file.getvalue() == ''.join( f'# out{i}\n# err{i}\n' for i in range(1, n + 1) )
+
+
+def test_pipeline_one_shell():
+    file = StringIO()
+    # Every stage reports the same `$$` (the PID of the one shell running the pipeline)
+    bmd.callback(('echo', '$$', '|', 'cat', '-', '<(echo', '$$)', '|', 'sort', '-u', '|', 'wc', '-l'), shell=True, executable='bash', no_copy=True, file=file)
+    assert file.getvalue() == "# 1\n"
+
+
+class Timed(StringIO):
+    """Record when each write happens."""
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def write(self, s):
+        self.times.append(perf_counter())
+        return super().write(s)
+
+
+def test_streaming():
+    file = Timed()
+    start = perf_counter()
+    bmd.callback(('echo', 'a;', 'sleep', '0.5;', 'echo', 'b'), no_copy=True, file=file)
+    assert file.getvalue() == "# a\n# b\n"
+    # The first line was written as soon as it was output, before the command exited
+    assert file.times[0] - start < 0.4
+    assert file.times[-1] - start >= 0.5
+
+
+def test_truncate():
+    batches = [ ['1', '2', '3'], ['4', '5'], ['6', '7', '8', '9', '10'] ]
+    def lines(**kwargs):
+        return [ line for lines in truncate(batches, **kwargs) for line in lines ]
+    assert lines() == [ str(n) for n in range(1, 11) ]
+    assert lines(head=2, tail=3) == [ '1', '2', '… 5 lines omitted …', '8', '9', '10' ]
+    assert lines(head=4) == [ '1', '2', '3', '4', '… 6 lines omitted …' ]
+    assert lines(tail=1, omitted_fmt='[%d]') == [ '[9]', '10' ]
+    assert lines(head=0, tail=0, omitted_fmt='...') == [ '...' ]
+    assert lines(head=6, tail=4) == lines()
+
+
+@parametrize(
+    "opts,expected",
+    [
+        (dict(head=2), "# 1\n# 2\n# … 4 lines omitted …\n# exit 3\n"),
+        (dict(tail=1, fence_level=2), "```bash\nseq '6;' exit 3\n```\n```\n… 5 lines omitted …\n6\nexit 3\n```\n"),
+    ],
+)
+def test_head_tail(opts, expected):
+    file = StringIO()
+    # The exit status is preserved (unlike piping through `head`)
+    bmd.callback(('seq', '6;', 'exit', '3'), error_fmt='exit %d', no_copy=True, file=file, **opts)
+    assert file.getvalue() == expected
@@ -0,0 +1,57 @@
+"""Test ``bmdf.ansi``: stripping ANSI escape sequences from streamed text, or rendering their colors as HTML."""
+from io import StringIO
+
+from bmdf.ansi import AnsiStream, strip_ansi
+from bmdf.cli import bmd
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+
+@parametrize(
+    "text,expected",
+    [
+        ('\x1b[1;31mred\x1b[0m plain\n', 'red plain\n'),
+        ('\x1b[2K\x1b[1Gprogress\x1b[?25h\n', 'progress\n'),
+        # OSC hyperlink (ended by ST) and window title (ended by BEL)
+        ('\x1b]8;;https://example.com\x1b\\link\x1b]8;;\x1b\\ \x1b]0;title\x07text\n', 'link text\n'),
+        ('charset \x1b(Bswitch\x1b=\n', 'charset switch\n'),
+        # A newline aborts a sequence; invalid `ESC`s are dropped
+        ('bad \x1b[12\nline\x1b\x01\n', 'bad [12\nline\x01\n'),
+        ('incomplete \x1b]0;tit', 'incomplete '),
+    ],
+)
+def test_strip(text, expected):
+    assert strip_ansi(text) == expected
+    # Fed one character at a time, sequences split across chunks are reassembled
+    stream = AnsiStream()
+    assert ''.join(stream.feed(c) for c in text) + stream.finish() == expected
+
+
+def test_html():
+    text = '\x1b[1;31mred <b>\nstill\x1b[0m plain\n\x1b[38;5;208morange\x1b[48;2;1;2;3m bg\x1b[m\n\x1b]8;;x\x1b\\a & b\n'
+    expected = (
+        '<span style="color:#cd0000;font-weight:bold">red &lt;b&gt;</span>\n'
+        '<span style="color:#cd0000;font-weight:bold">still</span> plain\n'
+        '<span style="color:#ff8700">orange</span><span style="color:#ff8700;background-color:#010203"> bg</span>\n'
+        'a &amp; b\n'
+    )
+    assert AnsiStream(html=True).feed(text) == expected
+    stream = AnsiStream(html=True)
+    assert ''.join(stream.feed(c) for c in text) + stream.finish() == expected
+    # Unterminated styles are closed at EOF
+    stream = AnsiStream(html=True)
+    assert stream.feed('\x1b[3mitalic') + stream.finish() == '<span style="font-style:italic">italic</span>'
+
+
+def test_bmd_ansi_html():
+    file = StringIO()
+    bmd.callback(('printf', r'\033[32mok\033[0m <done>\n'), shell=False, ansi_html=True, fence_level=3, no_copy=True, file=file)
+    assert file.getvalue() == (
+        "<details><summary><code>printf '\\033[32mok\\033[0m <done>\\n'</code></summary>\n"
+        "\n"
+        "<pre>\n"
+        '<span style="color:#00cd00">ok</span> &lt;done&gt;\n'
+        "</pre>\n"
+        "</details>\n"
+    )
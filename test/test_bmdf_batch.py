@@ -0,0 +1,100 @@
+"""Test ``bmd --batch``: JSONL command specs in, rendered Markdown (as JSONL) out."""
+import json
+from time import perf_counter
+
+from click.testing import CliRunner
+from utz import cd
+
+from bmdf.batch import render_spec
+from bmdf.cli import bmd
+from test.utils import ROOT
+
+SPECS = [
+    dict(id='pipe', command='seq 3 | wc -l', fence=1),
+    dict(command=['echo', '$FOO'], env=dict(FOO='bar'), fence=3, fence_type='text'),
+    dict(command='ls', workdir='.github'),
+    [ 'not', 'an', 'object' ],
+    dict(command='seq 2', bogus=1),
+]
+
+
+def run(specs, *args) -> tuple[int, list[dict]]:
+    input = ''.join(json.dumps(spec) + '\n' for spec in specs)
+    with cd(ROOT):
+        res = CliRunner().invoke(bmd, [ '-b', '-', *args ], input=input)
+    return res.exit_code, [ json.loads(line) for line in res.stdout.splitlines() ]
+
+
+def test_batch():
+    exit_code, records = run(SPECS, '-j', '2')
+    assert exit_code == 1
+    assert records == [
+        dict(index=0, id='pipe', markdown="```bash\nseq 3 | wc -l\n# 3\n```\n"),
+        dict(index=1, markdown="<details><summary><code>FOO=bar echo '$FOO'</code></summary>\n\n```text\nbar\n```\n</details>\n"),
+        dict(index=2, markdown="# workflows\n"),
+        dict(index=3, error="Expected a JSON object, got list"),
+        dict(index=4, error="Unrecognized key: bogus"),
+    ]
+
+
+def test_batch_defaults():
+    # Options passed to `bmd --batch` apply to every spec, unless overridden
+    exit_code, records = run([ dict(command='seq 2'), dict(command='seq 2', fence=0) ], '-f')
+    assert exit_code == 0
+    assert [ record['markdown'] for record in records ] == [ "```bash\nseq 2\n# 1\n# 2\n```\n", "# 1\n# 2\n" ]
+
+
+def test_batch_jobs():
+    specs = [ dict(command='sleep 0.2; echo %d' % idx) for idx in range(8) ]
+    start = perf_counter()
+    exit_code, records = run(specs, '-j', '8')
+    elapsed = perf_counter() - start
+    assert exit_code == 0
+    # Records are emitted in input order, though commands ran concurrently
+    assert [ record['markdown'] for record in records ] == [ f'# {idx}\n' for idx in range(8) ]
+    assert elapsed < 1
+
+
+def test_batch_click_errors():
+    # Specs that `bmd` rejects with a usage error (or a failed check) get an error record; the others are still rendered
+    specs = [
+        dict(command='seq 1'),
+        dict(command='seq 1', ansi_html=True),
+        dict(command='date +%N', repeat=2, fail_on_diff=True),
+        dict(command='seq 2'),
+    ]
+    exit_code, records = run(specs, '-j', '2')
+    assert exit_code == 1
+    assert records == [
+        dict(index=0, markdown="# 1\n"),
+        dict(index=1, error="-a/--ansi-html requires -f/--fence 2 or 3"),
+        dict(index=2, error="Output of run 2 (of 2) differed from run 1's"),
+        dict(index=3, markdown="# 1\n# 2\n"),
+    ]
+
+
+def test_batch_param_types():
+    # Values are converted like command-line args; unconvertible ones are that spec's error
+    specs = [
+        dict(command='seq 10', head='3'),
+        dict(command='seq 10', head='x'),
+        dict(command='seq 2', env='FOO=bar'),
+        dict(command='seq 2', fence='1'),
+    ]
+    exit_code, records = run(specs, '-j', '2')
+    assert exit_code == 1
+    assert records == [
+        dict(index=0, markdown="# 1\n# 2\n# 3\n# … 7 lines omitted …\n"),
+        dict(index=1, error="Invalid value for head: 'x' is not a valid integer."),
+        dict(index=2, error="Invalid value for env: Value must be an iterable."),
+        dict(index=3, markdown="```bash\nseq 2\n# 1\n# 2\n```\n"),
+    ]
+
+
+def test_render_spec_unexpected_error():
+    def render(**kwargs):
+        raise TypeError('boom')
+
+    params = { param.name: param for param in bmd.params }
+    record = render_spec(render, 0, json.dumps(dict(command='seq 2')), params, {}, None)
+    assert record == dict(index=0, error='TypeError: boom')
@@ -0,0 +1,66 @@
+"""Test ``bmdf.clipboard``'s backends, and ``bmd``'s copying with them."""
+import os
+from base64 import b64decode
+from io import StringIO
+from os.path import join
+from time import perf_counter, sleep
+
+from bmdf import clipboard
+from bmdf.cli import bmd
+from bmdf.clipboard import CommandCopy, Osc52Copy, detect, open_copy
+
+
+def mk_bin(dir: str, name: str, script: str) -> str:
+    path = join(dir, name)
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/sh\n{script}\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+def test_detect(tmp_path):
+    bin_dir = str(tmp_path)
+    assert detect('auto', bin_dir) is None
+    assert detect('none', bin_dir) is None
+    assert detect('osc52', bin_dir) is Osc52Copy
+    xclip = mk_bin(bin_dir, 'xclip', 'cat >/dev/null')
+    # Results are cached per spec and `$PATH`
+    assert detect('auto', bin_dir) is None
+    path = f'{bin_dir}:{bin_dir}'
+    backend = detect('auto', path)
+    assert backend.func is CommandCopy and backend.args == ([ xclip ],)
+    assert detect('auto', path) is backend
+    backend = detect('xclip -selection clipboard', path)
+    assert backend.args == ([ xclip, '-selection', 'clipboard' ],)
+    assert detect('missing-cmd', path) is None
+
+
+def test_background_copy(tmp_path):
+    bin_dir = str(tmp_path)
+    out_path = join(bin_dir, 'copied')
+    # A copy command that lingers after reading its input (like `xclip`)
+    mk_bin(bin_dir, 'pbcopy', f'cat > {out_path}; sleep 5')
+    file = StringIO()
+    start = perf_counter()
+    bmd.callback(('seq', '3'), fence_level=1, file=file, environ={ **os.environ, 'PATH': bin_dir + ':' + os.environ['PATH'] })
+    assert perf_counter() - start < 2
+    expected = "```bash\nseq 3\n# 1\n# 2\n# 3\n```"
+    assert file.getvalue() == f'{expected}\n'
+    for _ in range(50):
+        if os.path.exists(out_path) and open(out_path).read() == expected:
+            break
+        sleep(0.1)
+    assert open(out_path).read() == expected
+
+
+def test_osc52(monkeypatch):
+    tty = StringIO()
+    tty.close = lambda: None
+    monkeypatch.setattr(clipboard, 'tty', lambda: tty)
+    file = StringIO()
+    bmd.callback(('seq', '2'), file=file, environ={ **os.environ, 'BMDF_CLIPBOARD': 'osc52' })
+    assert file.getvalue() == "# 1\n# 2\n"
+    seq = tty.getvalue()
+    assert seq.startswith('\x1b]52;c;') and seq.endswith('\x07')
+    assert b64decode(seq[len('\x1b]52;c;'):-1]).decode() == "# 1\n# 2"
+    assert open_copy('none') is None
@@ -1,10 +1,12 @@
-from os.path import join, relpath
+import asyncio
+from os.path import exists, join, relpath
 from tempfile import TemporaryDirectory
 
 from click.testing import CliRunner
 from utz import cd
 
 from mdcmd.cli import main
+from mdcmd.engine import process_path
 from test.utils import DATA, ROOT
 
 
@@ -21,3 +23,32 @@ def test_mdcmd():
                 open(out_path, 'r', encoding='utf-8') as out_fd,
             ):
                 assert in_fd.read() == out_fd.read()
+
+
+def test_mdcmd_stdin_stdout():
+    with cd(ROOT):
+        runner = CliRunner()
+        input_md = '# Title\n\n<!-- `echo a` -->\n\nbody\n<!-- `seq 2` -->\n```\nold\n```\nend\n'
+        res = runner.invoke(main, ['-', '-'], input=input_md)
+        assert res.exit_code == 0
+        assert res.stdout == '# Title\n\n<!-- `echo a` -->\na\n\nbody\n<!-- `seq 2` -->\n1\n2\nend\n'
+
+
+def test_process_path_streams_prefix():
+    with TemporaryDirectory() as tmpdir:
+        path = join(tmpdir, 'in.md')
+        marker = join(tmpdir, 'marker')
+        with open(path, 'w') as f:
+            f.write(f'before\n<!-- `sh -c "sleep 0.3; touch {marker}; echo slow"` -->\n\nafter\n')
+
+        written = []
+        def write(line):
+            written.append((line, exists(marker)))
+
+        asyncio.run(process_path(path, dry_run=False, patterns=None, write_fn=write))
+        assert written == [
+            (f'before\n<!-- `sh -c "sleep 0.3; touch {marker}; echo slow"` -->', False),
+            ('slow', True),
+            ('', True),
+            ('after', True),
+        ]
@@ -0,0 +1,84 @@
+"""Test that mdcmd's in-process builtins match their subprocess equivalents."""
+from os import environ, getcwd
+from os.path import join
+from subprocess import run
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+
+from click.testing import CliRunner
+from utz import cd
+
+from mdcmd.cli import main
+from test.utils import ROOT
+
+DOC = dedent("""
+    # Builtins
+
+    <!-- `toc` -->
+
+    ## Section One <a id="one"></a>
+
+    <!-- `bmdf seq 3` -->
+
+    ### Sub <a id="sub"></a>
+
+    <!-- `bmdff -E FOO=bar echo $FOO` -->
+
+    <!-- `bmdfff -w .github ls` -->
+
+    <!-- `bmd -S -v -E FOO=baz echo '$FOO'` -->
+
+    <!-- `toc -n 2` -->
+
+""").lstrip()
+
+
+def test_builtins_match_subprocesses():
+    with cd(ROOT):
+        runner = CliRunner()
+        with TemporaryDirectory() as tmpdir:
+            in_path = join(tmpdir, 'in.md')
+            with open(in_path, 'w') as f:
+                f.write(DOC)
+
+            outputs = []
+            for args in [ [], ['-B'] ]:
+                out_path = join(tmpdir, 'out.md')
+                cwd = getcwd()
+                res = runner.invoke(main, [ *args, in_path, out_path ])
+                assert res.exit_code == 0, res.output
+                assert getcwd() == cwd
+                with open(out_path, 'r') as f:
+                    outputs.append(f.read())
+
+            builtin, subprocess = outputs
+            assert builtin == subprocess
+            assert '- [Section One](#one)\n    - [Sub](#sub)\n' in builtin
+            assert '- [Section One](#one)\n  - [Sub](#sub)\n' in builtin
+            assert '# 1\n# 2\n# 3\n' in builtin
+            assert '```\nbar\n```\n' in builtin
+            assert '```\nworkflows\n```\n' in builtin
+            assert '# baz\n' in builtin
+
+
+def test_toc_builtin_stdin():
+    with cd(ROOT):
+        runner = CliRunner()
+        input_md = '<!-- `toc` -->\n\n## A <a id="a"></a>\n'
+        res = runner.invoke(main, ['-', '-'], input=input_md)
+        assert res.exit_code == 0
+        assert res.stdout == '<!-- `toc` -->\n- [A](#a)\n\n## A <a id="a"></a>\n'
+
+
+def test_bmd_builtin_stdin():
+    # With the document piped in (`mdcmd - -`), in-process `bmd*` commands mustn't read (and consume) the rest of it
+    # (which is much longer than the parser's read buffer)
+    rest = ''.join( f'line {idx}\n' for idx in range(100_000) )
+    doc = '<!-- `bmdf -- cat` -->\n\n' + rest
+    for args in [ [], [ '-B' ] ]:
+        proc = run(
+            [ 'mdcmd', *args, '-', '-' ],
+            input=doc, capture_output=True, text=True, cwd=ROOT, env={ **environ, 'MDCMD_NO_SERVER': '1' },
+        )
+        assert proc.returncode == 0, proc.stderr
+        assert proc.stdout == '<!-- `bmdf -- cat` -->\n```bash\ncat\n```\n\n' + rest
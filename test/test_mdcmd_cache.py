@@ -0,0 +1,73 @@
+"""Test mdcmd's on-disk block-output cache."""
+from os.path import join
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+
+from click.testing import CliRunner
+from utz import cd
+
+from mdcmd.cache import Cache
+from mdcmd.cli import main
+from test.utils import ROOT
+
+
+def test_cache_hit_skips_command():
+    with cd(ROOT):
+        runner = CliRunner()
+        with TemporaryDirectory() as tmpdir:
+            counter = join(tmpdir, 'counter')
+            input_md = dedent(f"""
+                # Cache test
+
+                <!-- `sh -c 'echo run >> {counter}; wc -l < {counter}'` -->
+
+            """).lstrip()
+            in_path = join(tmpdir, 'in.md')
+            out_path = join(tmpdir, 'out.md')
+            cache_dir = join(tmpdir, 'cache')
+            with open(in_path, 'w') as f:
+                f.write(input_md)
+
+            for _ in range(2):
+                res = runner.invoke(main, ['--cache', '--cache-dir', cache_dir, in_path, out_path])
+                assert res.exit_code == 0, res.output
+                with open(out_path, 'r') as f:
+                    assert f.read().split('\n')[3].strip() == '1'
+
+            with open(counter, 'r') as f:
+                assert f.read() == 'run\n'
+
+
+def test_cache_key_inputs_and_env():
+    with TemporaryDirectory() as tmpdir:
+        input_path = join(tmpdir, 'input.txt')
+        with open(input_path, 'w') as f:
+            f.write('a')
+        cache = Cache(root=join(tmpdir, 'cache'), env_vars=['FOO'], inputs=[input_path])
+        key = cache.key(['echo'], 'README.md', { 'FOO': '1', 'BAR': '1' })
+        assert key == cache.key(['echo'], 'README.md', { 'FOO': '1', 'BAR': '2' })
+        assert key != cache.key(['echo'], 'README.md', { 'FOO': '2', 'BAR': '1' })
+        assert key != cache.key(['echo'], 'other.md', { 'FOO': '1', 'BAR': '1' })
+
+        with open(input_path, 'w') as f:
+            f.write('b')
+        cache2 = Cache(root=join(tmpdir, 'cache'), env_vars=['FOO'], inputs=[input_path])
+        assert key != cache2.key(['echo'], 'README.md', { 'FOO': '1' })
+
+
+def test_cache_evict_export_import():
+    with TemporaryDirectory() as tmpdir:
+        cache = Cache(root=join(tmpdir, 'cache'), max_size=10)
+        cache.put('aa01', '12345', mtime=1)
+        cache.put('aa02', '12345', mtime=2)
+        cache.put('bb03', '12345', mtime=3)
+        assert cache.evict() == 1
+        assert cache.get('aa01') is None
+        assert cache.get('aa02') == '12345'
+
+        export_path = join(tmpdir, 'cache.json')
+        cache.export(export_path)
+        cache2 = Cache(root=join(tmpdir, 'cache2'))
+        assert cache2.import_(export_path) == 2
+        assert cache2.get('aa02') == '12345'
+        assert cache2.get('bb03') == '12345'
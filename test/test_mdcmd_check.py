@@ -0,0 +1,75 @@
+"""Test mdcmd's -c/--check and -d/--diff modes."""
+from os.path import join
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+
+from click.testing import CliRunner
+from utz import cd
+
+from mdcmd.cli import main
+from test.utils import DATA, ROOT
+
+STALE_MD = dedent("""
+    # Check
+
+    <!-- `seq 3` -->
+    ```
+    1
+    2
+    ```
+
+    <!-- `echo '- ok'` -->
+    - ok
+
+    <!-- `echo new` -->
+    ```
+    old
+    ```
+""").lstrip()
+
+
+def test_check_up_to_date():
+    with cd(ROOT):
+        runner = CliRunner()
+        res = runner.invoke(main, ['--check', join(DATA, 'README.md')])
+        assert res.exit_code == 0
+        assert res.stdout == ''
+
+
+def test_check_stale():
+    with cd(ROOT):
+        runner = CliRunner()
+        with TemporaryDirectory() as tmpdir:
+            path = join(tmpdir, 'stale.md')
+            with open(path, 'w') as f:
+                f.write(STALE_MD)
+
+            res = runner.invoke(main, ['--check', path])
+            assert res.exit_code == 1
+            assert res.stdout == dedent(f"""\
+                --- {path}
+                +++ {path}
+                @@ -4,4 +4,3 @@ seq 3
+                -```
+                 1
+                 2
+                -```
+                +3
+                @@ -13,3 +13 @@ echo new
+                -```
+                -old
+                -```
+                +new
+            """)
+            # File is untouched
+            with open(path, 'r') as f:
+                assert f.read() == STALE_MD
+
+            res = runner.invoke(main, ['--diff', path])
+            assert res.exit_code == 0
+            assert '@@ -13,3 +13 @@ echo new' in res.stdout
+
+            res = runner.invoke(main, ['--check', '--fail-fast', '-C', path])
+            assert res.exit_code == 1
+            assert '@@ -4,4 +4,3 @@ seq 3' in res.stdout
+            assert 'echo new' not in res.stdout
@@ -0,0 +1,110 @@
+"""Test mdcmd's multi-file mode."""
+from os import makedirs
+from os.path import join
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+
+from click.testing import CliRunner
+from utz import cd
+
+from mdcmd.cli import expand_paths, is_multi, main
+from test.utils import ROOT
+
+
+def write_md(path: str, body: str):
+    with open(path, 'w') as f:
+        f.write(dedent(body).lstrip())
+
+
+def test_expand_paths():
+    with TemporaryDirectory() as tmpdir:
+        makedirs(join(tmpdir, 'docs', 'sub'))
+        for name in ['a.md', 'docs/b.md', 'docs/sub/c.md', 'docs/d.txt']:
+            write_md(join(tmpdir, name), '# x\n')
+        with cd(tmpdir):
+            assert expand_paths(('a.md', 'docs')) == ['a.md', 'docs/b.md', 'docs/sub/c.md']
+            assert expand_paths(('*.md', 'a.md')) == ['a.md']
+            assert is_multi(('a.md', 'b.md'), None) is False
+            assert is_multi(('a.md', 'b.md'), True) is True
+            assert is_multi(('docs',), None) is True
+
+
+def test_multi_file_shared_commands():
+    with cd(ROOT):
+        runner = CliRunner()
+        with TemporaryDirectory() as tmpdir:
+            counter = join(tmpdir, 'counter')
+            shared = f"sh -c 'echo run >> {counter}; echo shared'"
+            paths = []
+            for idx in range(3):
+                path = join(tmpdir, f'doc{idx}.md')
+                write_md(path, f"""
+                    # Doc {idx}
+
+                    <!-- `{shared}` -->
+                    ```
+                    old
+                    ```
+
+                    <!-- `echo {idx}` -->
+
+                """)
+                paths.append(path)
+
+            res = runner.invoke(main, ['-p', '2', *paths])
+            assert res.exit_code == 0, res.output
+
+            for idx, path in enumerate(paths):
+                with open(path, 'r') as f:
+                    lines = f.read().split('\n')
+                assert lines[3] == 'shared'
+                assert lines[6] == str(idx)
+
+            with open(counter, 'r') as f:
+                assert f.read() == 'run\n'
+
+
+def test_multi_file_failure():
+    with cd(ROOT):
+        runner = CliRunner()
+        with TemporaryDirectory() as tmpdir:
+            good = join(tmpdir, 'good.md')
+            bad = join(tmpdir, 'bad.md')
+            write_md(good, """
+                <!-- `echo good` -->
+
+            """)
+            write_md(bad, """
+                <!-- `false` -->
+                ```
+                old
+                ```
+
+            """)
+            res = runner.invoke(main, ['-i', good, bad])
+            assert res.exit_code == 1
+            with open(good, 'r') as f:
+                assert f.read() == '<!-- `echo good` -->\ngood\n\n'
+            with open(bad, 'r') as f:
+                assert f.read() == '<!-- `false` -->\n```\nold\n```\n\n'
+
+
+def test_multi_file_file_dependent():
+    # `bmdf toc` (like `toc`) depends on the file it's in, so its output isn't shared across files
+    with cd(ROOT):
+        with TemporaryDirectory() as tmpdir:
+            paths = []
+            for name in [ 'a', 'b' ]:
+                path = join(tmpdir, f'{name}.md')
+                write_md(path, f"""
+                    <!-- `bmdf toc` -->
+
+                    ## {name.upper()} <a id="{name}"></a>
+                """)
+                paths.append(path)
+
+            res = CliRunner().invoke(main, [ '-i', '-p', '2', *paths ])
+            assert res.exit_code == 0, res.output
+            for name, path in zip([ 'a', 'b' ], paths):
+                with open(path, 'r') as f:
+                    assert f"- [{name.upper()}](#{name})" in f.read()
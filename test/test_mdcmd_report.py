@@ -0,0 +1,92 @@
+"""Test mdcmd's -r/--report per-block timing and resource report."""
+import json
+from os.path import join
+from subprocess import CalledProcessError
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+
+from click.testing import CliRunner
+from utz import cd
+
+from mdcmd.cli import main
+from mdcmd.report import BUILTIN, Report
+from mdcmd.subproc import Usage
+from test.utils import ROOT
+
+DOC = dedent("""
+    # Report
+
+    <!-- `seq 3` -->
+
+    <!-- `bash -c 'sleep 0.3; echo slow'` -->
+
+    <!-- `toc` -->
+
+    <!-- `bmdf -- bash -c 'exit 2'` -->
+
+""").lstrip()
+
+
+def test_report():
+    with cd(ROOT), TemporaryDirectory() as tmpdir:
+        in_path = join(tmpdir, 'in.md')
+        with open(in_path, 'w') as f:
+            f.write(DOC)
+        report_path = join(tmpdir, 'report.json')
+        res = CliRunner().invoke(main, ['-r', report_path, '-j', '3', in_path, join(tmpdir, 'out.md')])
+        assert res.exit_code == 0, res.output
+        with open(report_path, 'r') as f:
+            blocks = json.load(f)['blocks']
+
+        # Slowest first
+        assert [ (b['line'], b['cmd'], b['source']) for b in blocks ][0] == (5, "bash -c 'sleep 0.3; echo slow'", 'subprocess')
+        assert sorted((b['line'], b['source']) for b in blocks) == [ (3, 'subprocess'), (5, 'subprocess'), (7, 'builtin'), (9, 'builtin') ]
+        walls = [ b['wall'] for b in blocks ]
+        assert walls == sorted(walls, reverse=True)
+        slow = blocks[0]
+        assert slow['wall'] >= 0.3
+        assert slow['wall'] == slow['queued'] + slow['running']
+        assert slow['output_size'] == len('slow')
+        assert slow['exit_code'] == 0
+        assert slow['max_rss'] > 0
+        assert slow['error'] is None
+        seq = next(b for b in blocks if b['cmd'] == 'seq 3')
+        assert seq['output_size'] == len('1\n2\n3')
+        # In-process `bmd*` blocks report their wrapped command's usage; `toc` runs no command, so has none
+        bmdf = next(b for b in blocks if b['line'] == 9)
+        assert bmdf['exit_code'] == 2
+        assert bmdf['max_rss'] > 0
+        toc = next(b for b in blocks if b['cmd'] == 'toc')
+        assert (toc['user'], toc['sys'], toc['max_rss'], toc['exit_code']) == (None, None, None, None)
+
+
+def test_report_table():
+    report = Report()
+    fast = report.add('a.md', 3, 'seq 3')
+    fast.running, fast.output_size, fast.usage = 0.01, 5, Usage(exit_code=0, user=0.001, max_rss=2 << 20)
+    slow = report.add('a.md', 5, 'cargo build')
+    slow.queued, slow.running, slow.output_size, slow.usage = 0.5, 2, 1536, Usage(exit_code=0, user=1.5, sys=0.25, max_rss=300 << 20)
+    toc = report.add('a.md', 7, 'toc')
+    toc.source, toc.running, toc.output_size = BUILTIN, 0.002, 10
+    assert report.table() == dedent("""\
+         wall  queued  running   user    sys   max_rss  output  exit      source  block
+        2.50s   0.50s    2.00s  1.50s  0.25s  300.0MiB  1.5KiB     0  subprocess  a.md:5 cargo build
+        0.01s   0.00s    0.01s  0.00s  0.00s    2.0MiB      5B     0  subprocess  a.md:3 seq 3
+        0.00s   0.00s    0.00s      -      -         -     10B     -     builtin  a.md:7 toc
+        2.51s   0.50s    2.01s  1.50s  0.25s  300.0MiB  1.5KiB                    total (3 blocks)""")
+
+
+def test_report_failure():
+    with cd(ROOT), TemporaryDirectory() as tmpdir:
+        in_path = join(tmpdir, 'in.md')
+        with open(in_path, 'w') as f:
+            f.write("<!-- `bash -c 'exit 3'` -->\n\n")
+        report_path = join(tmpdir, 'report.json')
+        res = CliRunner().invoke(main, ['-r', report_path, in_path, join(tmpdir, 'out.md')])
+        assert isinstance(res.exception, CalledProcessError)
+        # The report is written even though a command failed
+        with open(report_path, 'r') as f:
+            [block] = json.load(f)['blocks']
+        assert block['exit_code'] == 3
+        assert block['output_size'] is None
+        assert block['error'].startswith('CalledProcessError')
@@ -0,0 +1,54 @@
+"""Test mdcmd's bounded-concurrency block scheduler."""
+import asyncio
+from asyncio import gather, sleep
+
+import pytest
+
+from mdcmd.sched import Group, Scheduler
+
+
+def max_concurrency(jobs, groups, cmd_strs):
+    running = {}
+    peaks = {}
+
+    async def task(cmd_str):
+        kind = cmd_str.split()[0]
+        running[kind] = running.get(kind, 0) + 1
+        running['*'] = running.get('*', 0) + 1
+        for k in (kind, '*'):
+            peaks[k] = max(peaks.get(k, 0), running[k])
+        await sleep(0.01)
+        running[kind] -= 1
+        running['*'] -= 1
+        return cmd_str
+
+    async def main():
+        sched = Scheduler(jobs=jobs, groups=groups)
+        return await gather(*[ sched.run(cmd_str, task(cmd_str)) for cmd_str in cmd_strs ])
+
+    results = asyncio.run(main())
+    assert results == cmd_strs
+    return peaks
+
+
+def test_jobs_limit():
+    peaks = max_concurrency(3, (), [ f'echo {i}' for i in range(10) ])
+    assert peaks['*'] == 3
+
+
+def test_group_limit():
+    cmd_strs = [ f'heavy {i}' for i in range(4) ] + [ f'cheap {i}' for i in range(6) ]
+    peaks = max_concurrency(4, [ Group.parse('^heavy=1') ], cmd_strs)
+    assert peaks['heavy'] == 1
+    assert peaks['cheap'] == 3
+    assert peaks['*'] == 4
+
+
+def test_group_parse():
+    group = Group.parse('a=b=2')
+    assert group.pattern.pattern == 'a=b'
+    assert group.limit == 2
+    with pytest.raises(ValueError):
+        Group.parse('nolimit')
+    with pytest.raises(ValueError):
+        Group.parse('x=0')
@@ -0,0 +1,112 @@
+"""Test forwarding console-script invocations to ``mdcmd-server``."""
+import os
+import sys
+from os.path import join
+from subprocess import PIPE, Popen, run
+from tempfile import TemporaryDirectory
+from time import sleep
+
+import pytest
+
+from mdcmd.client import MDCMD_NO_SERVER_VAR, MDCMD_SERVER_SOCKET_VAR, connect, request, runtime, send
+from mdcmd.server import Server
+from test.utils import ROOT
+
+DOC = "# Server\n\n<!-- `bash -c 'echo $FOO $PWD'` -->\n\n<!-- `bmdf seq 2` -->\n"
+
+
+def client(prog: str, *args: str, cwd: str, env: dict, input: str = None):
+    """Run a console script's entry point (as installed by ``pyproject.toml``), in a subprocess."""
+    return run(
+        [ sys.executable, '-c', f'from mdcmd.client import {prog}; {prog}()', *args ],
+        cwd=cwd, env=env, input=input, capture_output=True, text=True,
+    )
+
+
+@pytest.fixture
+def server():
+    with TemporaryDirectory() as tmpdir:
+        path = join(tmpdir, 'mdcmd.sock')
+        proc = Popen([ sys.executable, '-m', 'mdcmd.server', 'run', '-s', path ], cwd=ROOT, stderr=PIPE)
+        try:
+            for _ in range(200):
+                if request(dict(op='status'), path):
+                    break
+                assert proc.poll() is None, proc.stderr.read()
+                sleep(0.05)
+            yield path
+        finally:
+            request(dict(op='stop'), path)
+            proc.wait(10)
+
+
+def test_forward(server):
+    with TemporaryDirectory() as tmpdir:
+        env = { **os.environ, MDCMD_SERVER_SOCKET_VAR: server, 'FOO': 'bar' }
+        res = client('mdcmd', '-', '-', cwd=tmpdir, env=env, input=DOC)
+        assert res.returncode == 0, res.stderr
+        assert res.stdout == (
+            "# Server\n\n<!-- `bash -c 'echo $FOO $PWD'` -->\n"
+            f"bar {os.path.realpath(tmpdir)}\n\n"
+            "<!-- `bmdf seq 2` -->\n```bash\nseq 2\n# 1\n# 2\n```\n\n"
+        )
+        assert request(dict(op='status'), server)['served'] == 1
+
+        # Program name, exit code, and stderr are the same as when run in-process
+        res = client('toc', '--help', cwd=tmpdir, env=env)
+        assert res.returncode == 0
+        assert res.stdout.startswith('Usage: toc ')
+        res = client('mdcmd', 'missing.md', cwd=tmpdir, env=env)
+        assert res.returncode == 1
+        assert 'missing.md' in res.stderr
+        assert request(dict(op='status'), server)['served'] == 3
+
+        # Forwarding can be disabled
+        res = client('mdcmd', '-', '-', cwd=tmpdir, env={ **env, MDCMD_NO_SERVER_VAR: '1' }, input=DOC)
+        assert res.returncode == 0
+        assert 'bar' in res.stdout
+        assert request(dict(op='status'), server)['served'] == 3
+
+
+def test_fallback():
+    with TemporaryDirectory() as tmpdir:
+        env = { **os.environ, MDCMD_SERVER_SOCKET_VAR: join(tmpdir, 'missing.sock'), 'FOO': 'baz' }
+        res = client('mdcmd', '-', '-', cwd=tmpdir, env=env, input=DOC)
+        assert res.returncode == 0, res.stderr
+        assert 'baz' in res.stdout
+
+
+def test_runtime_mismatch(server):
+    # A server running a different Python or `mdcmd` version refuses invocations; the client runs them in-process
+    for key, value in [ ('executable', '/other/venv/bin/python'), ('version', '0.0.0') ]:
+        sock = connect(server)
+        with sock, sock.makefile('rb') as f:
+            send(sock, dict(op='run', prog='toc', args=[ '--help' ], cwd=ROOT, env={}, **{ **runtime(), key: value }), fds=(0, 1, 2))
+            assert f.readline() == b''
+    assert request(dict(op='status'), server)['served'] == 0
+
+
+def test_private_dir(server):
+    socket_dir = os.path.dirname(server)
+    with TemporaryDirectory() as tmpdir:
+        env = { **os.environ, MDCMD_SERVER_SOCKET_VAR: server, 'FOO': 'bar' }
+        # Not forwarded to a socket in a directory others can access (or via a symlinked directory)
+        os.chmod(socket_dir, 0o755)
+        try:
+            assert connect(server) is None
+            res = client('mdcmd', '-', '-', cwd=tmpdir, env=env, input=DOC)
+            assert res.returncode == 0, res.stderr
+            assert 'bar' in res.stdout
+        finally:
+            os.chmod(socket_dir, 0o700)
+        link = join(tmpdir, 'link')
+        os.symlink(socket_dir, link)
+        assert connect(join(link, 'mdcmd.sock')) is None
+        assert request(dict(op='status'), server)['served'] == 0
+
+        # The server won't listen in such a directory either
+        shared = join(tmpdir, 'shared')
+        os.mkdir(shared, 0o755)
+        os.chmod(shared, 0o755)
+        with pytest.raises(RuntimeError, match='must be owned by this user'):
+            Server(join(shared, 'mdcmd.sock')).serve()
@@ -0,0 +1,97 @@
+"""Test mdcmd's timeouts and cancellation (which kill commands' process groups)."""
+from os import kill
+from os.path import join
+from subprocess import CalledProcessError
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from click.testing import CliRunner
+from utz import cd
+
+from mdcmd.cli import main
+from mdcmd.subproc import BlockTimeout
+from test.utils import ROOT
+
+
+def run(doc: str, *args: str):
+    with cd(ROOT), TemporaryDirectory() as tmpdir:
+        path = join(tmpdir, 'in.md')
+        with open(path, 'w') as f:
+            f.write(doc.format(tmpdir=tmpdir))
+        start = perf_counter()
+        res = CliRunner().invoke(main, [ *args, path, join(tmpdir, 'out.md') ])
+        elapsed = perf_counter() - start
+        pid_path = join(tmpdir, 'pid')
+        try:
+            with open(pid_path, 'r') as f:
+                pid = int(f.read())
+        except FileNotFoundError:
+            pid = None
+        out = None
+        if res.exit_code == 0:
+            with open(join(tmpdir, 'out.md'), 'r') as f:
+                out = f.read()
+        return res, elapsed, pid, out
+
+
+def is_running(pid: int) -> bool:
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # Killed, but not yet reaped by its (new) parent
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        return f.read().split(') ')[1][0] != 'Z'
+
+
+def test_block_timeout_kills_process_group():
+    doc = "<!-- `bash -c 'sleep 30 & echo $! > {tmpdir}/pid; wait'` timeout=0.5 -->\n\n"
+    res, elapsed, pid, _ = run(doc)
+    assert isinstance(res.exception, BlockTimeout)
+    assert res.exception.timeout == 0.5
+    assert elapsed < 10
+    # The backgrounded grandchild was killed along with its parent
+    assert pid and not is_running(pid)
+
+
+def test_run_timeout():
+    res, elapsed, _, _ = run("<!-- `sleep 30` -->\n\n", '-t', '0.3')
+    assert isinstance(res.exception, BlockTimeout)
+    assert elapsed < 10
+
+    # Blocks' own timeouts take precedence
+    res, _, _, out = run("<!-- `bash -c 'sleep 0.5; echo ok'` timeout=10 -->\n\n", '-t', '0.1')
+    assert res.exit_code == 0, res.output
+    assert out == "<!-- `bash -c 'sleep 0.5; echo ok'` timeout=10 -->\nok\n\n"
+
+
+def test_fail_fast_cancels_in_flight():
+    doc = (
+        "<!-- `bash -c 'sleep 30 & echo $! > {tmpdir}/pid; wait'` -->\n\n"
+        "<!-- `bash -c 'sleep 0.2; exit 3'` -->\n\n"
+    )
+    res, elapsed, pid, _ = run(doc, '-F', '-j', '2')
+    assert isinstance(res.exception, CalledProcessError)
+    assert res.exception.returncode == 3
+    assert elapsed < 10
+    assert pid and not is_running(pid)
+
+
+def test_fail_fast_cancels_in_process_bmd():
+    # `bmdf` runs in-process (in a worker thread); its command's process group is killed on cancellation
+    doc = (
+        "<!-- `bmdf -S -- bash -c 'sleep 30 & echo $! > {tmpdir}/pid; wait'` -->\n\n"
+        "<!-- `bash -c 'sleep 0.2; exit 3'` -->\n\n"
+    )
+    res, elapsed, pid, _ = run(doc, '-F', '-j', '2')
+    assert isinstance(res.exception, CalledProcessError)
+    assert res.exception.returncode == 3
+    assert elapsed < 10
+    assert pid and not is_running(pid)
+
+
+def test_in_process_bmd_timeout():
+    res, elapsed, pid, _ = run("<!-- `bmdf -S -- bash -c 'sleep 30 & echo $! > {tmpdir}/pid; wait'` -->\n\n", '-t', '0.5')
+    assert isinstance(res.exception, BlockTimeout)
+    assert elapsed < 10
+    assert pid and not is_running(pid)
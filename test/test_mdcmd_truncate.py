@@ -0,0 +1,56 @@
+"""Test blocks' head=/tail= output truncation."""
+from textwrap import dedent
+
+from click.testing import CliRunner
+from utz import cd
+
+from mdcmd.cli import main
+from mdcmd.engine import shared_key
+from test.utils import ROOT
+
+DOC = dedent("""
+    <!-- `seq 100` head=2 tail=2 -->
+
+    <!-- `seq 3` head=5 -->
+
+    <!-- `bmdf seq 10` tail=1 -->
+""").lstrip()
+
+
+def test_truncate():
+    with cd(ROOT):
+        for args in [ [], ['-B'] ]:
+            res = CliRunner().invoke(main, [ *args, '-', '-' ], input=DOC, env={ 'BMDF_OMITTED_FMT': '(%d more)' })
+            assert res.exit_code == 0, res.output
+            assert res.stdout == dedent("""
+                <!-- `seq 100` head=2 tail=2 -->
+                1
+                2
+                (96 more)
+                99
+                100
+
+                <!-- `seq 3` head=5 -->
+                1
+                2
+                3
+
+                <!-- `bmdf seq 10` tail=1 -->
+                ```bash
+                seq 10
+                # (9 more)
+                # 10
+                ```
+
+            """).lstrip()
+
+
+def test_shared_key():
+    # Blocks running the same command with different truncation can't share its output
+    assert shared_key(['seq', '100']) == ('seq', '100')
+    assert shared_key(['seq', '100'], {'head': 2}) != shared_key(['seq', '100'], {'tail': 2})
+    assert shared_key(['toc'], {'head': 2}) is None
+    # Commands that may run `toc`, or read `$MDCMD_FILE`, aren't shared either
+    for cmd in [ ['bmdf', 'toc'], ['bmdfff', '--', 'toc'], ['sh', '-c', 'toc -n 2'], ['sh', '-c', 'wc -l $MDCMD_FILE'] ]:
+        assert shared_key(cmd) is None
+    assert shared_key(['mktocs']) == ('mktocs',)
@@ -152,4 +152,49 @@ def test_mktoc_with_existing_toc():
             assert '[Outdated](#outdated)' not in output
             # New TOC should be present
             assert '- [New Section](#new)' in output
-            assert '- [Updated Section](#updated)' in output
\ No newline at end of file
+            assert '- [Updated Section](#updated)' in output
+
+
+def test_mktoc_indent_size(tmp_path):
+    """``-n/--indent-size`` applies to the TOC; text outside the TOC block is copied as-is."""
+    input_md = dedent("""
+        # Document
+        <!-- `toc` -->
+
+        ## Section <a id="section"></a>   
+        ### Sub-section <a id="sub"></a>
+        <!-- `echo not run` -->
+        stale
+    """).lstrip()
+    path = tmp_path / 'test.md'
+    path.write_text(input_md)
+    res = CliRunner().invoke(mktoc_main, [ '-n', '2', str(path), '-' ])
+    assert res.exit_code == 0, res.output
+    assert res.output == input_md.replace('<!-- `toc` -->\n', '<!-- `toc` -->\n- [Section](#section)\n  - [Sub-section](#sub)\n')
+
+
+def test_mktoc_unchanged(tmp_path):
+    """An up-to-date TOC isn't rewritten; a stale one is patched (matching ``mdcmd -x '^toc$'``)."""
+    from mdcmd.cli import main as mdcmd_main
+
+    path = tmp_path / 'README.md'
+    with open(join(ROOT, 'README.md'), 'r') as f:
+        readme = f.read()
+    path.write_text(readme)
+    ino = path.stat().st_ino
+    runner = CliRunner()
+    res = runner.invoke(mktoc_main, [ '-i', str(path) ])
+    assert res.exit_code == 0, res.output
+    assert path.stat().st_ino == ino
+    assert path.read_text() == readme
+
+    stale = readme.replace('- [`toc`', '- [Old section](#old)\n- [`toc`', 1)
+    assert stale != readme
+    path.write_text(stale)
+    res = runner.invoke(mktoc_main, [ '-i', str(path) ])
+    assert res.exit_code == 0, res.output
+    assert path.read_text() == readme
+    path.write_text(stale)
+    res = runner.invoke(mdcmd_main, [ '-x', '^toc$', str(path), str(tmp_path / 'mdcmd.md') ])
+    assert res.exit_code == 0, res.output
+    assert (tmp_path / 'mdcmd.md').read_text() == readme
@@ -0,0 +1,169 @@
+"""Test Markdown command-block parsing."""
+import random
+from os.path import join
+
+import pytest
+
+from mdcmd.blocks import BlockSpans, EMPTY, FENCE, LIST, Span, index_blocks
+from mdcmd.parse import Block, iter_doc, split_doc
+from test.utils import DATA, ROOT
+
+parametrize = pytest.mark.parametrize
+
+
+def render(items) -> str:
+    out = []
+    for item in items:
+        if isinstance(item, Block):
+            out.append(f'[{item.cmd_str}@{item.line}: {item.old_lines}]')
+            if item.trailing_blank:
+                out.append('')
+        else:
+            out.append(item)
+    return ''.join(f'{line}\n' for line in out)
+
+
+DOCS = [
+    '',
+    '\n',
+    'no trailing newline',
+    '<!-- `echo a` -->',
+    '<!-- `echo a` -->\n',
+    '<!-- `echo a` -->\n\nafter\n',
+    '<!-- `echo a` -->\n```\nold\n```\nafter',
+    '<!-- `bmdff seq 2` -->\n```bash\nseq 2\n```\n```\n1\n2\n```\n\n',
+    '<!-- `toc` -->\n- a\n  - b\n- c\n\n## H\n',
+    '<!-- `x` -->\n<details>\n<summary>s</summary>\n</details>\n<!-- `y` -->\n\n',
+    '  <!-- `indented` -->\n<!-- `skipped` -->\n\n',
+]
+
+
+@parametrize('text', DOCS)
+def test_split_doc_matches_iter_doc(text):
+    select = lambda cmd_str: cmd_str != 'skipped'
+    expected = render(iter_doc(text.splitlines(), select))
+    actual = render(split_doc(text, select))
+    assert actual == expected
+
+
+@parametrize('path', [ join(DATA, 'README.md'), join(ROOT, 'README.md') ])
+def test_split_doc_files(path):
+    with open(path, 'r') as f:
+        text = f.read()
+    items = list(split_doc(text))
+    assert render(items) == render(iter_doc(text.splitlines()))
+    # Static text is kept in runs, not line-by-line
+    assert len(items) < 4 * sum(isinstance(item, Block) for item in items) + 2
+
+
+def test_unexpected_block_start():
+    with pytest.raises(ValueError):
+        list(split_doc('<!-- `echo a` -->\nunexpected\n'))
+
+
+def test_block_lines():
+    text = '# T\n\n<!-- `echo a` -->\n```\nold\n```\nmid\n<!-- `echo b` -->\n\nend\n'
+    blocks = [ item for item in split_doc(text) if isinstance(item, Block) ]
+    assert [ (b.line, b.old_lines) for b in blocks ] == [ (3, ['```', 'old', '```']), (8, ['']) ]
+    assert blocks[0].new_lines('x\ny') == ['x', 'y']
+    assert blocks[1].new_lines('') == ['', '']
+
+
+def test_block_opts():
+    text = '<!-- `sleep 1` timeout=2.5 -->\n\n<!-- `echo a` -->\n\n'
+    blocks = [ item for item in split_doc(text) if isinstance(item, Block) ]
+    assert [ (b.cmd, b.opts, b.timeout) for b in blocks ] == [
+        (['sleep', '1'], {'timeout': '2.5'}, 2.5),
+        (['echo', 'a'], {}, None),
+    ]
+    assert render(split_doc(text)) == render(iter_doc(text.splitlines()))
+    with pytest.raises(ValueError):
+        list(split_doc('<!-- `echo a` retries=2 -->\n\n'))
+    with pytest.raises(ValueError):
+        list(split_doc('<!-- `echo a` timeout=soon -->\n\n'))
+
+
+def test_block_truncation():
+    text = '<!-- `seq 100` head=3 tail=2 -->\n\n<!-- `seq 100` tail=1 timeout=5 -->\n\n'
+    blocks = [ item for item in split_doc(text) if isinstance(item, Block) ]
+    assert [ b.truncation for b in blocks ] == [ {'head': 3, 'tail': 2}, {'tail': 1} ]
+    with pytest.raises(ValueError):
+        list(split_doc('<!-- `seq 100` head=-1 -->\n\n'))
+
+
+FUZZ_LINES = [
+    '<!-- `echo a` -->', '<!-- `bmdff seq 2` -->', '<!-- `toc` -->', '<!-- `seq 9` head=2 -->', '<!-- `skipped` -->',
+    '```', '```bash', '<details>', '</details>', '- item', '  continued', '', '', 'text, ünïcödé', '## Heading',
+]
+
+
+def fuzz_doc(rng: random.Random) -> str:
+    """A random document, built from :data:`FUZZ_LINES` (so that command blocks of each form, open or unclosed, and
+    unexpected block starts are all common)."""
+    text = '\n'.join( rng.choice(FUZZ_LINES) for _ in range(rng.randint(0, 30)) )
+    return text + '\n' if rng.random() < .8 else text
+
+
+def parse_all(fn):
+    try:
+        return fn()
+    except ValueError:
+        return ValueError
+
+
+def check_spans(text, spans: BlockSpans):
+    """``spans``' offsets and line numbers are consistent with ``text``."""
+    nl = b'\n' if isinstance(text, bytes) else '\n'
+    assert text[spans.marker.start:spans.marker.start + 6] == ('<!-- `'.encode() if isinstance(text, bytes) else '<!-- `')
+    assert spans.marker.end == spans.content.start and spans.content.end == spans.close.start
+    assert spans.old == Span(spans.content.start, spans.close.end, spans.content.line, spans.close.end_line)
+    for span in [ spans.marker, spans.content, spans.close ]:
+        assert span.line == text.count(nl, 0, span.start) + 1
+        assert span.end_line - span.line == text.count(nl, span.start, span.end)
+        assert span.start == 0 or text[span.start - 1:span.start] == nl or span.start == len(text)
+
+
+@parametrize('seed', range(300))
+def test_fuzz(seed):
+    """:func:`index_blocks` (via :func:`split_doc`) and line-by-line parsing (:func:`iter_doc`) agree, on random docs."""
+    rng = random.Random(seed)
+    text = fuzz_doc(rng)
+    select = lambda cmd_str: cmd_str != 'skipped'
+    expected = parse_all(lambda: list(iter_doc(text.splitlines(), select)))
+    items = parse_all(lambda: list(split_doc(text, select)))
+    if expected is ValueError:
+        assert items is ValueError
+        return
+    assert render(items) == render(expected)
+    blocks = list(index_blocks(text, select))
+    byte_blocks = list(index_blocks(text.encode(), select))
+    assert blocks == [ item.spans for item in items if isinstance(item, Block) ]
+    assert len(byte_blocks) == len(blocks)
+    for spans, byte_spans in zip(blocks, byte_blocks):
+        check_spans(text, spans)
+        check_spans(text.encode(), byte_spans)
+        assert byte_spans.marker.start == len(text[:spans.marker.start].encode())
+        assert byte_spans.close.end == len(text[:spans.close.end].encode())
+        assert byte_spans._replace(marker=spans.marker, content=spans.content, close=spans.close) == spans
+
+
+def test_block_spans():
+    text = '# T\n<!-- `bmdff seq 2` -->\n```bash\nseq 2\n```\n```\n1\n2\n```\n<!-- `toc` -->\n- a\n  - b\n\n## H\n<!-- `echo a` -->'
+    blocks = list(index_blocks(text))
+    assert [ (b.cmd_str, b.kind, b.trailing_blank) for b in blocks ] == [
+        ('bmdff seq 2', FENCE, False),
+        ('toc', LIST, True),
+        ('echo a', EMPTY, True),
+    ]
+    fence, lst, empty = blocks
+    assert fence.marker == Span(4, 27, 2, 3)
+    assert text[fence.content.start:fence.content.end] == '```bash\nseq 2\n```\n```\n1\n2\n'
+    assert fence.close == Span(53, 57, 9, 10)
+    assert (lst.content.line, lst.content.end_line, lst.close.line, lst.close.end_line) == (11, 13, 13, 14)
+    assert text[lst.close.start:lst.close.end] == '\n'
+    assert empty.marker.end == empty.content.start == empty.close.end == len(text)
+
+    with pytest.raises(ValueError, match=r'Unclosed block .* \(line 1\)'):
+        list(index_blocks('<!-- `echo a` -->\n<details>\nnever closed\n'))
+    with pytest.raises(ValueError, match=r'Unclosed block .* \(line 2\)'):
+        list(iter_doc([ 'x', '<!-- `echo a` -->', '```', 'never closed' ]))
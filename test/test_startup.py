@@ -0,0 +1,43 @@
+"""Test that the console scripts' commands import quickly, deferring heavy modules until they run."""
+import sys
+from subprocess import run
+
+from click.testing import CliRunner
+from utz import cd
+
+from mdcmd.cli import main, mk_patterns
+from test.utils import ROOT
+
+
+def test_startup_deferred_imports():
+    # Checks that no command loads `DEFERRED` modules at import time; the time budget is only checked when the benchmark
+    # is run standalone
+    proc = run([ sys.executable, 'bench/startup.py', '-r', '1', '--no-speed-check' ], cwd=ROOT, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+
+
+def test_patterns():
+    assert mk_patterns((), ()) is None
+    execute = mk_patterns(('^toc$', 'seq,echo'), ())
+    assert [ execute(cmd) for cmd in ('toc', 'toc -n 2', 'seq 3', 'bmdf echo') ] == [ True, False, True, True ]
+    exclude = mk_patterns((), ('^bmd',))
+    assert [ exclude(cmd) for cmd in ('bmdf seq 3', 'seq 3') ] == [ False, True ]
+
+
+def test_patterns_xor():
+    with cd(ROOT):
+        res = CliRunner().invoke(main, ['-x', 'seq', '-X', 'echo', '-', '-'], input='')
+        assert res.exit_code == 2
+        assert 'Pass -x/--execute xor -X/--exclude' in res.output
+
+
+def test_moved_names():
+    # Names that moved out of `mdcmd.cli` are still importable from it, without loading the engine until they're used
+    proc = run(
+        [ sys.executable, '-c', 'import sys, mdcmd.cli; assert "mdcmd.engine" not in sys.modules; from mdcmd.cli import async_text, out_fd, process_path, CMD_LINE_RGX, HTML_OPEN_RGX' ],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    assert proc.returncode == 0, proc.stderr
+    import mdcmd.cli
+    from mdcmd import engine
+    assert mdcmd.cli.process_path is engine.process_path
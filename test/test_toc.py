@@ -0,0 +1,98 @@
+"""Test ``toc``'s heading extraction, GitHub-style ids, and code-fence handling."""
+from textwrap import dedent
+
+from click.testing import CliRunner
+
+import toc
+from toc import generate_toc, iter_headings, main, mapped, scan_headings, slugify
+
+DOC = dedent("""
+    # Title
+
+    ## Intro <a id="intro"></a>
+
+    ## Usage
+    ### Options (`-v`, [`--verbose`](#verbose))
+
+    ```bash
+    ## not a heading <a id="nope"></a>
+    # also not one
+    ```
+
+    <h3>
+    HTML [heading](https://example.com) <a id="html"></a>
+    </h3>
+
+    ## Usage
+    ~~~~
+    ```
+    ## still code
+    ~~~~
+    ## Usage ##
+    ```inline `code`, not a fence```
+    ## C# & .NET 2.0!
+
+    ```
+    ## unclosed fence
+""").lstrip()
+
+
+def test_explicit_ids():
+    assert generate_toc(DOC) == dedent("""
+        - [Intro](#intro)
+            - [HTML heading](#html)
+    """).strip()
+
+
+def test_auto_ids():
+    assert generate_toc(DOC, indent_size=2, auto_ids=True) == dedent("""
+        - [Intro](#intro)
+        - [Usage](#usage)
+          - [Options (`-v`, `--verbose`)](#options--v---verbose)
+          - [HTML heading](#html)
+        - [Usage](#usage-1)
+        - [Usage](#usage-2)
+        - [C# & .NET 2.0!](#c--net-20)
+    """).strip()
+
+
+def test_slugs():
+    assert slugify('Hello, World!') == 'hello-world'
+    assert slugify('`toc`: Markdown <em>TOC</em>') == 'toc-markdown-toc'
+    assert slugify('snake_case and kebab-case') == 'snake_case-and-kebab-case'
+    assert slugify('Ünïcödé') == 'ünïcödé'
+    # A heading's GitHub slug can collide with a deduplicated one
+    headings = list(iter_headings([ '## a', '## a', '## a-1' ], auto_ids=True))
+    assert [ h.id for h in headings ] == [ 'a', 'a-1', 'a-1-1' ]
+    assert [ h.line for h in headings ] == [ 0, 1, 2 ]
+
+
+def test_sources(tmp_path, monkeypatch):
+    doc = '# Ünïcödé\n\n' + DOC
+    path = tmp_path / 'doc.md'
+    path.write_text(doc.replace('\n', '\r\n'))
+    expected = generate_toc(doc, auto_ids=True)
+    headings = list(scan_headings(doc))
+    assert all(doc[h.offset:].startswith(('#', '<h')) for h in headings)
+    # Offsets are in bytes, for bytes sources
+    byte_headings = [ h._replace(offset=len(doc[:h.offset].encode())) for h in headings ]
+    # Small chunks, so that headings (incl. multi-line HTML ones) and fences straddle chunk boundaries
+    for size in [ 1, 2, 3, 7, 2**20 ]:
+        monkeypatch.setattr(toc, 'CHUNK_SIZE', size)
+        monkeypatch.setattr(toc, 'CHUNK_LINES', size)
+        with mapped(path) as mm:
+            assert generate_toc(mm, auto_ids=True) == expected
+        with open(path, 'r', newline='') as f:
+            assert [ h[:4] for h in scan_headings(f) ] == [ h[:4] for h in headings ]
+        assert list(scan_headings(doc.splitlines())) == headings
+        assert list(scan_headings(doc.encode())) == byte_headings
+    assert [ h.line for h in iter_headings(doc, auto_ids=True) ] == [ 4, 6, 7, 14, 18, 23, 25 ]
+
+    empty = tmp_path / 'empty.md'
+    empty.write_text('')
+    with mapped(empty) as mm:
+        assert generate_toc(mm) == ''
+
+    res = CliRunner().invoke(main, [ '-a', '-n', '2', str(path) ])
+    assert res.exit_code == 0, res.output
+    assert res.output == generate_toc(DOC, indent_size=2, auto_ids=True) + '\n'
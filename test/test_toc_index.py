@@ -0,0 +1,74 @@
+"""Test ``toc.index``'s persistent, incrementally-updated heading index."""
+import os
+from os.path import join
+
+from click.testing import CliRunner
+
+from toc import generate_toc, main, scan_headings
+from toc.index import HeadingIndex, TOC_INDEX_VAR
+
+
+def mk_doc(sections: int, edit: dict = None) -> str:
+    edit = edit or {}
+    return '# Handbook\n\n' + ''.join(
+        edit.get(idx, f'## Section {idx} <a id="s{idx}"></a>\n\nBody {idx}, ü.\n\n```bash\n# not a heading\n```\n\n### Sub {idx}\n\n')
+        for idx in range(sections)
+    )
+
+
+def check(index: HeadingIndex, path: str, doc: str, scanned: int):
+    with open(path, 'w') as f:
+        f.write(doc)
+    assert index.headings(path) == list(scan_headings(doc.encode()))
+    assert index.scanned == scanned
+    assert index.scanned + index.reused == doc.count('\n## ') + 1
+
+
+def test_incremental(tmp_path):
+    index = HeadingIndex(root=str(tmp_path / 'index'))
+    path = str(tmp_path / 'doc.md')
+    check(index, path, mk_doc(20), scanned=21)
+    # Unchanged (by stat, then by content hash)
+    check(index, path, mk_doc(20), scanned=0)
+    os.utime(path, ns=(0, 0))
+    assert len(index.headings(path)) == 41 and index.scanned == 0
+    # Body text changed in one section: its headings' offsets shift, but only it is rescanned
+    check(index, path, mk_doc(20, { 3: '## Section 3 <a id="s3"></a>\n\nLonger body text\n\n' }), scanned=1)
+    # Sections added; one renamed, and one reverted
+    check(index, path, mk_doc(22, { 5: '## Renamed\n\n' }), scanned=4)
+    # An unclosed fence: every section after it starts in a fence, and is rescanned
+    check(index, path, mk_doc(22, { 5: '## Renamed\n\n', 10: '## Fence\n\n~~~\n\n' }), scanned=12)
+    assert [ h.title for h in index.headings(path) ][-2:] == [ 'Sub 9', 'Fence' ]
+    # Removing it; only the previous version's sections are kept in the index
+    check(index, path, mk_doc(22, { 5: '## Renamed\n\n' }), scanned=12)
+    check(index, path, mk_doc(22, { 5: '## Renamed\n\n', 21: '## Last\n' }), scanned=1)
+
+
+def test_cli(tmp_path):
+    path = join(tmp_path, 'doc.md')
+    doc = mk_doc(3)
+    with open(path, 'w') as f:
+        f.write(doc)
+    env = { 'MDCMD_CACHE_DIR': str(tmp_path / 'cache'), TOC_INDEX_VAR: '1' }
+    runner = CliRunner()
+    for args in [ [], [ '-a' ] ]:
+        res = runner.invoke(main, [ *args, path ], env=env)
+        assert res.exit_code == 0, res.output
+        assert res.output == generate_toc(doc, auto_ids=bool(args)) + '\n'
+    assert os.listdir(tmp_path / 'cache' / 'toc')
+
+
+def test_mktoc(tmp_path, monkeypatch):
+    from toc.mktoc import main as mktoc_main
+
+    monkeypatch.setenv('MDCMD_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv(TOC_INDEX_VAR, '')
+    path = join(tmp_path, 'doc.md')
+    doc = mk_doc(3)
+    with open(path, 'w') as f:
+        f.write(doc.replace('# Handbook\n', '# Handbook\n\n<!-- `toc` -->\n'))
+    res = CliRunner().invoke(mktoc_main, [ '-I', '-i', path ])
+    assert res.exit_code == 0, res.output
+    with open(path, 'r') as f:
+        assert generate_toc(doc) in f.read()
+    assert os.listdir(tmp_path / 'cache' / 'toc')
@@ -0,0 +1,109 @@
+"""Test ``toc -t/--tree``: multi-file TOCs, and link checking."""
+from os import makedirs
+from os.path import dirname, join
+from textwrap import dedent
+
+from click.testing import CliRunner
+
+from toc import main
+from toc.tree import check_links, scan_tree
+
+FILES = {
+    'README.md': """
+        # Home
+
+        ## Intro <a id="intro"></a>
+
+        See [the API](docs/api/ref.md#functions), [a typo](docs/api/ref.md#functons "title"), [a missing
+        file](docs/gone.md), [this file](#intro), [a line](README.md#L3), and [elsewhere](https://example.com/#x).
+
+        ```markdown
+        [fenced](nowhere.md)
+        ```
+
+        <a id="custom"></a>
+
+        <!-- `toc` -->
+        - [Stale](#stale)
+    """,
+    'docs/guide.md': """
+        # Guide
+
+        ## Setup <a id="setup"></a>
+
+        ### Un-anchored
+
+        [home](/README.md#custom)
+    """,
+    'docs/api/ref.md': """
+        # API Reference
+
+        ## Functions
+
+        ### `foo()`
+
+        ## Functions
+
+        [back](../../README.md#home), [second](#functions-1), [spaces](<../guide.md#setup>)
+
+        [ref]: ../../README.md#outro
+    """,
+}
+
+
+def mk_tree(root: str):
+    for path, text in FILES.items():
+        path = join(root, path)
+        makedirs(dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(dedent(text).lstrip())
+
+
+def test_tree_toc(tmp_path):
+    mk_tree(tmp_path)
+    runner = CliRunner()
+    res = runner.invoke(main, [ '-t', str(tmp_path), '-n', '2' ])
+    assert res.exit_code == 0, res.output
+    assert res.output == dedent("""
+        - [Home](README.md)
+          - [Intro](README.md#intro)
+        - docs/
+          - api/
+            - [API Reference](docs/api/ref.md)
+          - [Guide](docs/guide.md)
+            - [Setup](docs/guide.md#setup)
+    """).lstrip()
+    # Scanning in worker processes gives the same results
+    res = runner.invoke(main, [ '-t', str(tmp_path), '-a', '-p', '2' ])
+    assert res.exit_code == 0, res.output
+    assert res.output == dedent("""
+        - [Home](README.md)
+            - [Intro](README.md#intro)
+        - docs/
+            - api/
+                - [API Reference](docs/api/ref.md)
+                    - [Functions](docs/api/ref.md#functions)
+                        - [`foo()`](docs/api/ref.md#foo)
+                    - [Functions](docs/api/ref.md#functions-1)
+            - [Guide](docs/guide.md)
+                - [Setup](docs/guide.md#setup)
+                    - [Un-anchored](docs/guide.md#un-anchored)
+    """).lstrip()
+    assert scan_tree(str(tmp_path), procs=2) == scan_tree(str(tmp_path), procs=1)
+
+
+def test_check_links(tmp_path):
+    mk_tree(tmp_path)
+    broken = check_links(str(tmp_path), scan_tree(str(tmp_path)))
+    assert [ str(link) for link in broken ] == [
+        'README.md:5: docs/api/ref.md#functons: no anchor "#functons" in docs/api/ref.md',
+        'README.md:6: docs/gone.md: docs/gone.md not found',
+        'README.md:15: #stale: no anchor "#stale" in README.md (in `toc` output)',
+        'docs/api/ref.md:11: ../../README.md#outro: no anchor "#outro" in README.md',
+    ]
+    res = CliRunner().invoke(main, [ '-t', str(tmp_path), '-l' ])
+    assert res.exit_code == 1
+    assert res.output.startswith('README.md:5: docs/api/ref.md#functons')
+
+    res = CliRunner().invoke(main, [ '-l' ])
+    assert res.exit_code == 2